@@ -151,7 +151,7 @@ function Dashboard({ setIsAuthenticated }) {
     if (isPlayingAll && cameraShards.length > 0) {
       if (currentShardIndex < cameraShards.length) {
         const shardId = cameraShards[currentShardIndex];
-        setCurrentVideoUrl(`http://localhost:8000/shards/${shardId}.mp4`);
+        setCurrentVideoUrl(`${API_URL}/video/${shardId}`);
       } else {
         setIsPlayingAll(false); // End of playlist
       }
@@ -174,7 +174,7 @@ function Dashboard({ setIsAuthenticated }) {
       setCurrentShardIndex(0);
       setIsPlayingAll(false);
       if (res.data.shards.length > 0) {
-        setCurrentVideoUrl(`http://localhost:8000/shards/${res.data.shards[0]}.mp4`);
+        setCurrentVideoUrl(`${API_URL}/video/${res.data.shards[0]}`);
       } else {
         setCurrentVideoUrl('');
       }
@@ -237,6 +237,8 @@ function Dashboard({ setIsAuthenticated }) {
 
   const [isProcessing, setIsProcessing] = useState(false);
   const [liveFrame, setLiveFrame] = useState(null);
+  // Overlay preview metadata: scale of the JPEG vs. full resolution, and track boxes in full-res pixels
+  const [liveMeta, setLiveMeta] = useState({ scale: 1, tracks: [] });
   const [alerts, setAlerts] = useState([]);
   const wsRef = useRef(null);
 
@@ -259,20 +261,28 @@ function Dashboard({ setIsAuthenticated }) {
         source: inputType === 'upload' ? videoFilePath : streamUrl,
         cam_id: parseInt(selectedCamId),
         shard_duration: 30,
-        alert_threshold: alertThreshold
+        alert_threshold: alertThreshold,
+        // Downscaled frames + track metadata; boxes and regions are drawn here
+        preview_mode: 'overlay'
       }));
     };
 
     ws.onmessage = (event) => {
-      // If binary, it's a frame
+      // If binary, it's a frame: [4-byte JSON length][JSON metadata][JPEG]
       if (event.data instanceof Blob) {
-        const url = URL.createObjectURL(event.data);
-        setLiveFrame(prev => {
-          // Revoke previous blob URL to prevent memory leak
-          if (prev && prev.startsWith('blob:')) {
-            URL.revokeObjectURL(prev);
-          }
-          return url;
+        event.data.arrayBuffer().then(buf => {
+          const headerLen = new DataView(buf).getUint32(0);
+          const meta = JSON.parse(new TextDecoder().decode(new Uint8Array(buf, 4, headerLen)));
+          const jpeg = new Blob([new Uint8Array(buf, 4 + headerLen)], { type: 'image/jpeg' });
+          const url = URL.createObjectURL(jpeg);
+          setLiveMeta(meta);
+          setLiveFrame(prev => {
+            // Revoke previous blob URL to prevent memory leak
+            if (prev && prev.startsWith('blob:')) {
+              URL.revokeObjectURL(prev);
+            }
+            return url;
+          });
         });
       } else {
         // JSON status
@@ -929,10 +939,10 @@ function Dashboard({ setIsAuthenticated }) {
                             position: 'absolute',
                             border: '2px solid rgba(0, 255, 0, 0.5)',
                             backgroundColor: 'rgba(0, 255, 0, 0.1)',
-                            left: ((r.x1 * liveScale.x) + (liveScale.offsetX || 0)) + 'px',
-                            top: ((r.y1 * liveScale.y) + (liveScale.offsetY || 0)) + 'px',
-                            width: ((r.x2 - r.x1) * liveScale.x) + 'px',
-                            height: ((r.y2 - r.y1) * liveScale.y) + 'px',
+                            left: ((r.x1 * liveScale.x * liveMeta.scale) + (liveScale.offsetX || 0)) + 'px',
+                            top: ((r.y1 * liveScale.y * liveMeta.scale) + (liveScale.offsetY || 0)) + 'px',
+                            width: ((r.x2 - r.x1) * liveScale.x * liveMeta.scale) + 'px',
+                            height: ((r.y2 - r.y1) * liveScale.y * liveMeta.scale) + 'px',
                             pointerEvents: 'none'
                           }}
                         >
@@ -949,6 +959,37 @@ function Dashboard({ setIsAuthenticated }) {
                           </span>
                         </div>
                      ))}
+
+                     {/* Live Track Overlay (full-res boxes scaled onto the downscaled frame) */}
+                     {liveMeta.tracks.map(([x1, y1, x2, y2, id, gender], i) => {
+                        const color = gender === 'F' ? 'rgb(255, 20, 147)' : gender === 'M' ? 'rgb(0, 0, 255)' : 'rgb(255, 255, 255)';
+                        return (
+                          <div
+                            key={`${id}-${i}`}
+                            style={{
+                              position: 'absolute',
+                              border: `2px solid ${color}`,
+                              left: ((x1 * liveScale.x * liveMeta.scale) + (liveScale.offsetX || 0)) + 'px',
+                              top: ((y1 * liveScale.y * liveMeta.scale) + (liveScale.offsetY || 0)) + 'px',
+                              width: ((x2 - x1) * liveScale.x * liveMeta.scale) + 'px',
+                              height: ((y2 - y1) * liveScale.y * liveMeta.scale) + 'px',
+                              pointerEvents: 'none'
+                            }}
+                          >
+                            <span style={{
+                              position: 'absolute',
+                              top: '-18px',
+                              left: '0',
+                              background: color,
+                              color: 'white',
+                              padding: '1px 4px',
+                              fontSize: '10px'
+                            }}>
+                              ID:{id} {gender === 'F' ? 'Female' : gender === 'M' ? 'Male' : 'Unknown'}
+                            </span>
+                          </div>
+                        );
+                     })}
                    </div>
                 ) : (
                   videoSource && (
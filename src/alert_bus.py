@@ -0,0 +1,183 @@
+import queue
+import threading
+import time
+import uuid
+from datetime import datetime
+
+ALERT_QUEUE_SIZE = 10000
+ALERT_BATCH_SIZE = 100
+ALERT_FLUSH_INTERVAL = 0.5  # seconds
+ALERT_DEDUP_WINDOW = 10.0  # seconds
+ALERT_PERSIST_RETRIES = 3  # batch INSERT attempts before falling back to one row at a time
+ALERT_RETRY_BACKOFF = 0.25  # seconds before the first retry, doubled after each one
+
+
+class AlertBus:
+    """
+    In-memory alert bus between the frame loop and everything slow.
+
+    publish() only enqueues and returns immediately, so the processing thread
+    never waits on the database. A dispatcher thread drops repeats of the
+    same (cam, region, track, alert_type) inside ALERT_DEDUP_WINDOW, fans each
+    alert out to the registered subscribers and persists them with one
+    batched INSERT per flush. If the queue is full the alert is dropped and counted rather than
+    blocking the caller. A failed batch is retried with backoff (reconnecting if the
+    connection was lost), then inserted row by row so one bad alert does not take
+    the batch with it; alerts that still can't be stored are counted as failed.
+    """
+
+    def __init__(self, queue_size=ALERT_QUEUE_SIZE, batch_size=ALERT_BATCH_SIZE,
+                 flush_interval=ALERT_FLUSH_INTERVAL, dedup_window=ALERT_DEDUP_WINDOW):
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.dedup_window = dedup_window
+        self._queue = queue.Queue(maxsize=queue_size)
+        self._subscribers = []
+        self._recent = {}  # dedup key -> monotonic time last seen
+        self._lock = threading.Lock()
+        self._thread = None
+        self._orm = None
+        self._orm_factory = None
+        self.published = 0
+        self.dropped = 0
+        self.deduplicated = 0
+        self.persisted = 0
+        self.failed = 0
+
+    def start(self, orm_factory):
+        """
+        Start the dispatcher thread. orm_factory() is called on that thread to
+        open a dedicated DataBaseOrm, so alert INSERTs never share the connection
+        (and transaction) used by request handlers or shard ingest.
+        """
+        with self._lock:
+            if self._thread is not None and self._thread.is_alive():
+                return
+            self._thread = threading.Thread(target=self._run, args=(orm_factory,), daemon=True)
+            self._thread.start()
+
+    def subscribe(self, callback):
+        """Register callback(alert); called on the dispatcher thread, so it must not block."""
+        with self._lock:
+            self._subscribers.append(callback)
+
+    def unsubscribe(self, callback):
+        with self._lock:
+            if callback in self._subscribers:
+                self._subscribers.remove(callback)
+
+    def publish(self, alert):
+        """
+        alert: dict with at least 'alert_type', 'region_id' and 'cam_id'; 'track_id' is used
+        for de-duplication. 'alert_id' and 'time' are filled in if missing.
+        """
+        alert.setdefault("alert_id", str(uuid.uuid4()))
+        alert.setdefault("time", datetime.now())
+        try:
+            self._queue.put_nowait(alert)
+            self.published += 1
+        except queue.Full:
+            self.dropped += 1
+
+    def _is_duplicate(self, alert, now):
+        key = (alert.get("cam_id"), alert.get("region_id"), alert.get("track_id"), alert.get("alert_type"))
+        last = self._recent.get(key)
+        self._recent[key] = now
+        return last is not None and now - last < self.dedup_window
+
+    def _prune_recent(self, now):
+        expired = [k for k, t in self._recent.items() if now - t >= self.dedup_window]
+        for k in expired:
+            del self._recent[k]
+
+    def _run(self, orm_factory):
+        self._orm_factory = orm_factory
+        self._connect()
+
+        pending = []
+        deadline = time.monotonic() + self.flush_interval
+        while True:
+            timeout = max(deadline - time.monotonic(), 0)
+            try:
+                alert = self._queue.get(timeout=timeout)
+            except queue.Empty:
+                alert = None
+
+            now = time.monotonic()
+            if alert is not None:
+                if self._is_duplicate(alert, now):
+                    self.deduplicated += 1
+                else:
+                    self._fan_out(alert)
+                    pending.append(alert)
+
+            if len(pending) >= self.batch_size or now >= deadline:
+                if pending:
+                    self._persist(pending)
+                    pending = []
+                self._prune_recent(now)
+                deadline = now + self.flush_interval
+
+    def _fan_out(self, alert):
+        with self._lock:
+            subscribers = list(self._subscribers)
+        for callback in subscribers:
+            try:
+                callback(alert)
+            except Exception as e:
+                print(f"Alert subscriber error: {e}")
+
+    def _connect(self):
+        try:
+            self._orm = self._orm_factory()
+        except Exception as e:
+            self._orm = None
+            print(f"Alert bus could not open a DB connection: {e}")
+
+    def _insert(self, method, *args):
+        """Call an ORM insert; False instead of raising (e.g. rollback on a dropped connection)."""
+        if self._orm is None:
+            return False
+        try:
+            return bool(method(*args))
+        except Exception as e:
+            print(f"Alert bus insert error: {e}")
+            return False
+
+    def _persist(self, alerts):
+        rows = [(a["alert_id"], a["alert_type"], a["time"], a["region_id"]) for a in alerts]
+        backoff = ALERT_RETRY_BACKOFF
+        for attempt in range(ALERT_PERSIST_RETRIES):
+            if attempt:
+                time.sleep(backoff)
+                backoff *= 2
+            if self._orm is None or self._orm.conn.closed:
+                self._connect()
+            if self._orm is not None and self._insert(self._orm.batch_insert_alerts, rows):
+                self.persisted += len(rows)
+                return
+
+        # Row by row, so only the alerts the database rejects are lost
+        failed = 0
+        for row in rows:
+            if self._orm is not None and self._insert(self._orm.add_alert, *row):
+                self.persisted += 1
+            else:
+                failed += 1
+        if failed:
+            self.failed += failed
+            print(f"Alert bus dropped {failed} alerts that could not be persisted")
+
+    def stats(self):
+        return {
+            "published": self.published,
+            "dropped": self.dropped,
+            "deduplicated": self.deduplicated,
+            "persisted": self.persisted,
+            "failed": self.failed,
+            "queued": self._queue.qsize(),
+        }
+
+
+# Shared by the live processing sessions of this process
+alert_bus = AlertBus()
@@ -0,0 +1,168 @@
+import copy
+import threading
+import time
+from collections import OrderedDict
+from functools import wraps
+
+# Defaults for the shared analytics cache
+ANALYTICS_CACHE_TTL = 30  # seconds; upper bound on staleness if an invalidation is missed
+ANALYTICS_CACHE_MAX_ENTRIES = 1024
+ALL_CAMERAS = "all"  # camera tag of entries that read every camera's data; dropped by every ingest
+
+
+class AnalyticsCache:
+    """
+    In-process LRU + TTL cache for analytics query results.
+    Entries are keyed by (method, region_id, params) and tagged with the
+    region and the camera the region belongs to, so new shards for a camera
+    or a region edit only drop the entries they can affect. Entries computed
+    over every camera are tagged ALL_CAMERAS and dropped by any camera's new
+    shards. Values are copied in and out, so callers can't mutate cached results.
+    """
+
+    def __init__(self, ttl=ANALYTICS_CACHE_TTL, max_entries=ANALYTICS_CACHE_MAX_ENTRIES):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._entries = OrderedDict()  # key -> (expires_at, value, region_id, cam_id)
+        self._by_region = {}  # region_id -> set(keys)
+        self._by_camera = {}  # cam_id -> set(keys)
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+        # Bumped on every invalidation so a result computed before it is not stored after it
+        self.generation = 0
+
+    def get(self, key):
+        """Return (True, value) on a fresh hit, (False, None) otherwise."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return False, None
+            if entry[0] < time.monotonic():
+                self._remove(key)
+                self.misses += 1
+                return False, None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            value = entry[1]
+        return True, copy.deepcopy(value)
+
+    def set(self, key, value, region_id=None, cam_id=None, generation=None):
+        value = copy.deepcopy(value)
+        with self._lock:
+            if generation is not None and generation != self.generation:
+                return
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = (time.monotonic() + self.ttl, value, region_id, cam_id)
+            self._by_region.setdefault(region_id, set()).add(key)
+            self._by_camera.setdefault(cam_id, set()).add(key)
+            while len(self._entries) > self.max_entries:
+                oldest = next(iter(self._entries))
+                self._remove(oldest)
+                self.evictions += 1
+
+    def _remove(self, key):
+        # Caller must hold the lock
+        entry = self._entries.pop(key, None)
+        if entry is None:
+            return
+        _, _, region_id, cam_id = entry
+        for index, tag in ((self._by_region, region_id), (self._by_camera, cam_id)):
+            keys = index.get(tag)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del index[tag]
+
+    def _invalidate_keys(self, keys):
+        self.generation += 1
+        for key in list(keys):
+            self._remove(key)
+            self.invalidations += 1
+
+    def invalidate_region(self, region_id):
+        """Drop every entry computed for this region (region edited or deleted)."""
+        with self._lock:
+            self._invalidate_keys(self._by_region.get(region_id, ()))
+
+    def invalidate_camera(self, cam_id):
+        """Drop entries that depend on this camera's data (new shards ingested)."""
+        with self._lock:
+            keys = self._by_camera.get(cam_id, set()) | self._by_camera.get(ALL_CAMERAS, set())
+            self._invalidate_keys(keys)
+
+    def skip_store(self):
+        """Called from a cached method's error path: its fallback value is returned but not cached."""
+        self._local.skip = True
+
+    def _take_skip(self):
+        skip = getattr(self._local, "skip", False)
+        self._local.skip = False
+        return skip
+
+    def clear(self):
+        with self._lock:
+            self.invalidations += len(self._entries)
+            self.generation += 1
+            self._entries.clear()
+            self._by_region.clear()
+            self._by_camera.clear()
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "max_entries": self.max_entries,
+                "ttl_seconds": self.ttl,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+                "evictions": self.evictions,
+                "invalidations": self.invalidations,
+            }
+
+
+# Shared by every DataBaseOrm instance in this process
+analytics_cache = AnalyticsCache()
+
+
+def cached_analytics(method=None, store_wide=False):
+    """
+    Decorator for DataBaseOrm analytics methods whose first argument is region_id.
+    The region is looked up once on a miss to tag the entry with its camera, or
+    the entry is tagged ALL_CAMERAS with store_wide=True, for queries that read
+    other cameras' data too (box coordinates of any camera, re-ID aliases).
+    Concurrent misses for the same key are not coalesced; a result is dropped
+    instead of stored if an invalidation happened while it was being computed,
+    or if the method called analytics_cache.skip_store().
+    """
+    if method is None:
+        return lambda m: cached_analytics(m, store_wide=store_wide)
+
+    @wraps(method)
+    def wrapper(self, region_id, *args, **kwargs):
+        key = (method.__name__, region_id, args, tuple(sorted(kwargs.items())))
+        hit, value = analytics_cache.get(key)
+        if hit:
+            return value
+
+        generation = analytics_cache.generation
+        if store_wide:
+            cam_id = ALL_CAMERAS
+        else:
+            region = self.get_region(region_id)
+            cam_id = region['cam_id'] if region else None
+
+        analytics_cache._take_skip()
+        value = method(self, region_id, *args, **kwargs)
+        if not analytics_cache._take_skip():
+            analytics_cache.set(key, value, region_id=region_id, cam_id=cam_id, generation=generation)
+        return value
+
+    return wrapper
@@ -1,6 +1,6 @@
-from fastapi import FastAPI, UploadFile, File, Form, BackgroundTasks, HTTPException, WebSocket, WebSocketDisconnect
+from fastapi import FastAPI, UploadFile, File, Form, HTTPException, WebSocket, WebSocketDisconnect, Request
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse, StreamingResponse, FileResponse
+from fastapi.responses import JSONResponse, StreamingResponse, FileResponse, Response
 from fastapi.staticfiles import StaticFiles
 from pydantic import BaseModel
 from typing import List, Optional, Dict
@@ -13,9 +13,25 @@ import base64
 import csv
 import io
 import threading
+import time
+import hashlib
 from datetime import datetime
 from database import DataBaseOrm
+from analytics_cache import analytics_cache
 from sharding import process_video_shards
+from batch_processing import process_video_parallel, probe_video, BATCH_WORKERS
+from job_queue import job_queue, JOB_KIND_STREAM, JOB_KIND_BATCH
+from dwell_engine import DwellEngine
+from alert_bus import alert_bus
+from jpeg_encoder import encoder_pool
+from segment_writer import get_shard_record
+from live_source import ingest_stats, is_live_source, LIVE_MAX_LATENCY
+from pipeline_metrics import pipeline_metrics
+from shard_ingest import ingest_shard
+from reid import reid_service
+from upload_store import upload_store, safe_filename, write_block, UploadError, UPLOAD_CHUNK_SIZE
+from shard_media import shard_file, hls_file, media_type_of, plan_file_response, iter_file
+from preview_broadcaster import get_broadcaster, all_broadcasters, PREVIEW_MODE_FULL, PREVIEW_MODE_OVERLAY
 
 app = FastAPI()
 
@@ -34,14 +50,12 @@ class ConnectionManager:
         self.active_connections[cam_id].append(websocket)
 
     def disconnect(self, websocket: WebSocket, cam_id: int):
+        # Only forgets the socket; processing sessions cancel their own token
         if cam_id in self.active_connections:
             if websocket in self.active_connections[cam_id]:
                 self.active_connections[cam_id].remove(websocket)
             if not self.active_connections[cam_id]:
                 del self.active_connections[cam_id]
-        # Set cancellation token when disconnecting
-        if cam_id in processing_cancel_tokens:
-            processing_cancel_tokens[cam_id].set()
 
     async def send_bytes(self, message: bytes, websocket: WebSocket, cam_id: int):
         try:
@@ -57,13 +71,18 @@ class ConnectionManager:
         except:
             pass
 
+    async def broadcast_json(self, message: dict, cam_id: int):
+        for websocket in list(self.active_connections.get(cam_id, [])):
+            await self.send_json(message, websocket, cam_id)
+
     def get_active_cameras(self):
         return list(self.active_connections.keys())
     
     def is_connected(self, websocket: WebSocket, cam_id: int) -> bool:
         return cam_id in self.active_connections and websocket in self.active_connections[cam_id]
 
-manager = ConnectionManager()
+manager = ConnectionManager()  # /ws/process sessions
+viewers = ConnectionManager()  # read-only /ws/view sockets; they only receive alerts here
 
 # Mount shards directory to serve video files
 if not os.path.exists("shards"):
@@ -85,6 +104,29 @@ try:
 except Exception as e:
     print(f"DB Connection failed: {e}")
 
+def alert_to_ws_message(alert):
+    return {
+        "type": "alert",
+        "message": alert["message"],
+        "region_id": alert["region_id"],
+        "track_id": alert["track_id"],
+        "duration": alert["duration"],
+        "cam_id": alert["cam_id"]
+    }
+
+@app.on_event("startup")
+async def start_alert_bus():
+    loop = asyncio.get_running_loop()
+
+    def forward_to_viewers(alert):
+        # Runs on the alert bus thread; hand off to the event loop without waiting
+        message = alert_to_ws_message(alert)
+        for sockets in (manager, viewers):
+            asyncio.run_coroutine_threadsafe(sockets.broadcast_json(message, alert["cam_id"]), loop)
+
+    alert_bus.subscribe(forward_to_viewers)
+    alert_bus.start(DataBaseOrm)
+
 # Models
 class CameraCreate(BaseModel):
     cam_id: int
@@ -98,11 +140,20 @@ class RegionCreate(BaseModel):
     y1: int
     y2: int
     cam_id: int
+    polygon: Optional[List[List[int]]] = None  # [[x, y], ...] for non-rectangular regions
 
 class ProcessRequest(BaseModel):
     source: str # File path or URL
     cam_id: int
     shard_duration: int = 30
+    live: Optional[bool] = None  # None: camera indexes and stream URLs are live, files are not
+    max_latency: Optional[float] = LIVE_MAX_LATENCY  # live only: skip frames older than this (seconds)
+
+class BatchProcessRequest(BaseModel):
+    source: str # Path of a recorded video file
+    cam_id: int
+    shard_duration: int = 30
+    workers: int = BATCH_WORKERS
 
 # Routes
 @app.get("/api/cameras")
@@ -120,20 +171,37 @@ def get_shards(cam_id: int):
     shards = orm.get_shards_by_camera(cam_id)
     return {"cam_id": cam_id, "shards": shards}
 
+def ranged_file_response(path: str, request: Request):
+    """Serve a file with Range, ETag and Last-Modified support so players can seek without re-downloading"""
+    status, headers, start, length = plan_file_response(path, request.headers)
+    if status in (304, 416):
+        return Response(status_code=status, headers=headers)
+    return StreamingResponse(iter_file(path, start, length), status_code=status,
+                             media_type=media_type_of(path), headers=headers)
+
+@app.get("/api/shards/index/{shard_id}")
+def get_shard_index(shard_id: str):
+    """Frame range, wall-clock range and size of a recorded shard"""
+    record = get_shard_record(shard_id)
+    if record is None:
+        raise HTTPException(status_code=404, detail="Shard not in index")
+    return record
+
 @app.get("/api/video/{shard_id}")
-def stream_video(shard_id: str):
-    """Stream video with proper headers for browser playback"""
-    # Try different extensions
-    for ext in ['.mp4', '.avi']:
-        video_path = os.path.join("shards", f"{shard_id}{ext}")
-        if os.path.exists(video_path):
-            return FileResponse(
-                video_path,
-                media_type="video/mp4",
-                filename=f"{shard_id}{ext}"
-            )
-    
-    raise HTTPException(status_code=404, detail="Video not found")
+def stream_video(shard_id: str, request: Request):
+    """Stream video with proper headers for browser playback (supports byte ranges)"""
+    video_path = shard_file(shard_id)
+    if video_path is None:
+        raise HTTPException(status_code=404, detail="Video not found")
+    return ranged_file_response(video_path, request)
+
+@app.get("/api/video/{shard_id}/hls/{name}")
+def stream_video_hls(shard_id: str, name: str, request: Request):
+    """HLS rendition of a shard (index.m3u8, init.mp4, seg_NNN.m4s), written when SHARD_OUTPUT_MODE is 'hls'"""
+    path = hls_file(shard_id, name)
+    if path is None:
+        raise HTTPException(status_code=404, detail="HLS rendition not found")
+    return ranged_file_response(path, request)
 
 @app.get("/api/analytics/footfall/{region_id}")
 def get_footfall(region_id: int):
@@ -202,12 +270,15 @@ def clear_camera_data(cam_id: int):
                 # Delete bounding boxes for these shards
                 cur.execute("DELETE FROM bounding_box WHERE video_shard = ANY(%s)", (shards,))
                 bbox_deleted = cur.rowcount
+                # Region analytics read the boxes' region assignments
+                cur.execute("DELETE FROM region_presence WHERE video_shard = ANY(%s)", (shards,))
                 
                 # Delete tracking entries
                 cur.execute("DELETE FROM tracking WHERE cam_id = %s", (cam_id,))
                 tracking_deleted = cur.rowcount
                 
                 orm.conn.commit()
+                analytics_cache.invalidate_camera(cam_id)
                 return {
                     "message": f"Cleared data for camera {cam_id}",
                     "bounding_boxes_deleted": bbox_deleted,
@@ -234,6 +305,11 @@ def get_tracking_stats(region_id: int):
     data = orm.get_tracking_duration_stats(region_id)
     return {"region_id": region_id, "data": data}
 
+@app.get("/api/analytics/cache-stats")
+def get_analytics_cache_stats():
+    """Hit/miss counters for the analytics result cache"""
+    return analytics_cache.stats()
+
 @app.post("/api/cameras")
 def add_camera(camera: CameraCreate):
     try:
@@ -252,7 +328,8 @@ def add_region(region: RegionCreate):
             region.x2, 
             region.y1, 
             region.y2, 
-            region.cam_id
+            region.cam_id,
+            region.polygon
         )
         return {"message": "Region added successfully"}
     except Exception as e:
@@ -264,52 +341,223 @@ async def upload_video(file: UploadFile = File(...)):
     if not os.path.exists(upload_dir):
         os.makedirs(upload_dir)
     
-    file_path = os.path.join(upload_dir, file.filename)
-    with open(file_path, "wb") as buffer:
-        shutil.copyfileobj(file.file, buffer)
+    file_path = os.path.join(upload_dir, safe_filename(file.filename))
+    # Copy off the event loop; large files go through the chunked /api/uploads API instead
+    def copy():
+        with open(file_path, "wb") as buffer:
+            shutil.copyfileobj(file.file, buffer, UPLOAD_WRITE_BUFFER)
+    await asyncio.to_thread(copy)
     
     return {"file_path": os.path.abspath(file_path)}
 
-def run_processing_task(source, shard_duration, cam_id):
-    print(f"Starting processing for {source} on cam {cam_id}")
-    shard_generator = process_video_shards(source, shard_duration, cam_id=cam_id)
-    
-    for shard_id, data, tracking_data in shard_generator:
-        print(f"Shard {shard_id} processed.")
-        
-        # Insert Tracking
-        tracking_tuples = []
-        for t in tracking_data:
-            tracking_tuples.append((
-                t["tracking_id"],
-                t["confusion_time"],
-                t["tracker_group"],
-                t["cam_id"],
-                t["time"],
-                t["video_shard"],
-                t.get("gender", "Unknown")
-            ))
-        if tracking_tuples:
-            orm.batch_insert_tracking(tracking_tuples)
-
-        # Insert Bounding Boxes
-        bbox_tuples = []
-        for d in data:
-            bbox = d["bbox"]
-            bbox_tuples.append((
-                int(bbox[0]), int(bbox[2]), int(bbox[1]), int(bbox[3]),
-                d["timestamp"],
-                d["track_id"],
-                d["Video_shard"],
-                d["Frame_number"]
-            ))
-        if bbox_tuples:
-            orm.batch_insert_bounding_boxes(bbox_tuples)
+UPLOAD_WRITE_BUFFER = 1024 * 1024  # request body bytes collected before each disk write
+
+class UploadCreate(BaseModel):
+    filename: str
+    size: int  # bytes
+    chunk_size: int = UPLOAD_CHUNK_SIZE
+    sha256: Optional[str] = None  # of the whole file, checked on completion
+
+class UploadProcessRequest(BaseModel):
+    cam_id: int
+    shard_duration: int = 30
+
+def get_upload_session(upload_id: str):
+    session = upload_store.get(upload_id)
+    if session is None:
+        raise HTTPException(status_code=404, detail="Upload not found")
+    return session
+
+@app.post("/api/uploads")
+def create_upload(request: UploadCreate):
+    """Start a chunked, resumable upload; the file is preallocated on disk"""
+    try:
+        session = upload_store.create(request.filename, request.size, request.chunk_size, request.sha256)
+    except UploadError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return session.status()
+
+@app.get("/api/uploads/{upload_id}")
+def get_upload(upload_id: str):
+    """Upload progress; clients resume by sending the missing chunks"""
+    return get_upload_session(upload_id).status()
+
+@app.put("/api/uploads/{upload_id}/chunks/{index}")
+async def upload_chunk(upload_id: str, index: int, request: Request):
+    """
+    Raw chunk bytes as the request body, written straight to the chunk's offset as they
+    arrive. Send X-Chunk-Sha256 to have the chunk verified.
+    """
+    session = get_upload_session(upload_id)
+    try:
+        fd, start, end = upload_store.open_chunk(session, index)
+    except UploadError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    digest = hashlib.sha256()
+    offset = start
+    pending = bytearray()
+    try:
+        async for piece in request.stream():
+            if offset + len(pending) + len(piece) > end:
+                raise HTTPException(status_code=413, detail=f"Chunk {index} is larger than {end - start} bytes")
+            pending += piece
+            if len(pending) >= UPLOAD_WRITE_BUFFER:
+                offset = await asyncio.to_thread(write_block, fd, pending, offset, digest)
+                pending = bytearray()
+        if pending:
+            offset = await asyncio.to_thread(write_block, fd, pending, offset, digest)
+    finally:
+        os.close(fd)
+
+    if offset != end:
+        raise HTTPException(status_code=400, detail=f"Chunk {index} should be {end - start} bytes, got {offset - start}")
+    try:
+        return await asyncio.to_thread(upload_store.finish_chunk, session, index, digest.hexdigest(),
+                                       request.headers.get("x-chunk-sha256"))
+    except UploadError as e:
+        raise HTTPException(status_code=422, detail=str(e))
+
+@app.post("/api/uploads/{upload_id}/complete")
+async def complete_upload(upload_id: str):
+    session = get_upload_session(upload_id)
+    try:
+        file_path = await asyncio.to_thread(upload_store.complete, session)
+    except UploadError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    return {"file_path": os.path.abspath(file_path), **session.status()}
+
+@app.post("/api/uploads/{upload_id}/process")
+def process_upload(upload_id: str, request: UploadProcessRequest):
+    """
+    Queue processing of an upload. Streamable files (MPEG-TS, MKV, fragmented or
+    faststart MP4) start on the part received so far and follow the upload as it grows.
+    """
+    session = get_upload_session(upload_id)
+    if not session.completed and not upload_store.is_streamable(session):
+        raise HTTPException(status_code=409, detail="This file can only be processed once the upload is complete")
+    job = queue_job(JOB_KIND_STREAM, session.filename, request.cam_id, request.shard_duration,
+                    {"upload_id": upload_id, "live": False})
+    return {"message": "Processing queued", "job_id": str(job['job_id'])}
+
+RESUME_WARMUP_FRAMES = 60  # frames re-tracked before the resume point so the tracker has settled
+
+def run_job(job, context):
+    """
+    Job runner for the job queue: processes the job's source and persists every shard,
+    starting after the last persisted shard when the job is being resumed.
+    """
+    source, cam_id, shard_duration = job['source'], job['cam_id'], job['shard_duration']
+    options = job['options'] or {}
+    if options.get("upload_id"):
+        # Chunked upload: read the finished file, or follow the upload while it arrives
+        session = upload_store.get(options["upload_id"])
+        if session is None:
+            raise RuntimeError(f"Upload {options['upload_id']} not found")
+        source = upload_store.data_path(session) if session.completed else upload_store.progressive_source(session)
+    processing_cancel_tokens[cam_id] = context.cancel_token
+    try:
+        if job['kind'] == JOB_KIND_BATCH:
+            fps, total_frames = probe_video(source)
+            frames_per_shard = max(1, int((fps or 30) * shard_duration))
+            shards = process_video_parallel(source, shard_duration, cam_id=cam_id,
+                                            workers=options.get("workers", BATCH_WORKERS),
+                                            start_frame=job['resume_frame'], time_origin=job['time_origin'],
+                                            cancel_token=context.cancel_token)
+            for shard_id, data, tracking_data in shards:
+                if context.cancel_token.is_set():
+                    break
+                print(f"Shard {shard_id} processed.")
+                ingest_shard(context.orm, shard_id, data, tracking_data, cam_id)
+                resume_frame = context.resume_frame + frames_per_shard
+                if total_frames > 0:
+                    # The last shard ends at the end of the file; unknown lengths just count whole shards
+                    resume_frame = min(resume_frame, total_frames)
+                context.progress(frames=resume_frame - context.resume_frame, shards=1, resume_frame=resume_frame)
+            return
+
+        live = options.get("live")
+        if live is None:
+            live = is_live_source(source)
+        # Files resume at the frame after the last persisted shard; live streams just reconnect
+        start = 0 if live else job['resume_frame']
+        warmup = min(start, RESUME_WARMUP_FRAMES)
+        frames_read = [0]
+        # Viewers (MJPEG, /ws/view) watch jobs through the camera's broadcaster
+        broadcaster = get_broadcaster(cam_id)
+
+        def count_frames(annotated_frame, tracks, raw_frame):
+            frames_read[0] += 1
+            broadcaster.submit(annotated_frame, raw_frame, tracks)
+            # False stops process_video_shards right away when the job is cancelled
+            return context.progress(frames=1)
+
+        shard_generator = process_video_shards(
+            source, shard_duration, cam_id=cam_id, frame_callback=count_frames,
+            cancel_token=context.cancel_token, live=live,
+            max_latency=options.get("max_latency", LIVE_MAX_LATENCY),
+            start_frame=start - warmup, warmup_frames=warmup, time_origin=job['time_origin']
+        )
+        for shard_id, data, tracking_data in shard_generator:
+            if context.cancel_token.is_set():
+                break
+            print(f"Shard {shard_id} processed.")
+            ingest_shard(context.orm, shard_id, data, tracking_data, cam_id)
+            # A shard ends exactly at the frames read so far; resume after it
+            context.progress(shards=1, resume_frame=0 if live else start - warmup + frames_read[0])
+    finally:
+        if processing_cancel_tokens.get(cam_id) is context.cancel_token:
+            del processing_cancel_tokens[cam_id]
+
+def queue_job(kind, source, cam_id, shard_duration, options):
+    if cam_id in processing_cancel_tokens or orm.get_active_job_for_camera(cam_id):
+        raise HTTPException(status_code=409, detail=f"Camera {cam_id} is already being processed")
+    job = orm.create_job(str(uuid.uuid4()), kind, source, cam_id, shard_duration, options)
+    if job is None:
+        raise HTTPException(status_code=409, detail=f"Could not queue a job for camera {cam_id}")
+    job_queue.notify()
+    return job
+
+@app.on_event("startup")
+async def start_job_queue():
+    # Also resumes jobs interrupted by a restart (see JobQueue)
+    job_queue.start(DataBaseOrm, run_job)
 
 @app.post("/api/process")
-def start_processing(request: ProcessRequest, background_tasks: BackgroundTasks):
-    background_tasks.add_task(run_processing_task, request.source, request.shard_duration, request.cam_id)
-    return {"message": "Processing started in background"}
+def start_processing(request: ProcessRequest):
+    job = queue_job(JOB_KIND_STREAM, request.source, request.cam_id, request.shard_duration,
+                    {"live": request.live, "max_latency": request.max_latency})
+    return {"message": "Processing queued", "job_id": str(job['job_id'])}
+
+@app.post("/api/process/batch")
+def start_batch_processing(request: BatchProcessRequest):
+    """Reprocess a recorded file in parallel time ranges; shards are saved in file order"""
+    if not os.path.exists(request.source):
+        raise HTTPException(status_code=404, detail="Video file not found")
+    job = queue_job(JOB_KIND_BATCH, request.source, request.cam_id, request.shard_duration,
+                    {"workers": max(1, request.workers)})
+    return {"message": "Batch processing queued", "job_id": str(job['job_id'])}
+
+@app.get("/api/jobs")
+def list_jobs(state: Optional[str] = None, limit: int = 50):
+    return {"jobs": orm.list_jobs(state, limit)}
+
+@app.get("/api/jobs/{job_id}")
+def get_job(job_id: str):
+    job = orm.get_job(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job
+
+@app.post("/api/jobs/{job_id}/cancel")
+def cancel_job(job_id: str):
+    """Cancel a queued job, or stop a running one after its current frame"""
+    job = orm.request_job_cancel(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    # Running here: stop now instead of at the next progress write
+    job_queue.cancel_local(job_id)
+    return job
 
 @app.delete("/api/reset-database")
 def reset_database():
@@ -400,30 +648,49 @@ async def get_heatmap_data(region_id: int, shard_id: Optional[str] = None, resol
     except Exception as e:
         raise HTTPException(500, str(e))
 
+@app.get("/api/alerts/bus-stats")
+async def get_alert_bus_stats():
+    """Counters for the live alert bus"""
+    return alert_bus.stats()
+
+@app.get("/api/processing/preview-stats")
+async def get_preview_stats():
+    """Per-camera preview broadcaster and subscriber stats"""
+    return {"encoder": encoder_pool.stats(), "cameras": [b.stats() for b in all_broadcasters()]}
+
+@app.get("/api/processing/ingest-stats")
+async def get_ingest_stats():
+    """Per-camera reader stats: processed and dropped fps, lag behind the live scene, reconnects"""
+    return {"cameras": ingest_stats()}
+
+@app.get("/api/processing/stats/{cam_id}")
+async def get_processing_stats(cam_id: int):
+    """Per-stage latencies, fps, queue depths, gender cache hit rate and DB insert rates of one camera"""
+    broadcaster = next((b for b in all_broadcasters() if b.cam_id == cam_id), None)
+    return {
+        **pipeline_metrics.camera(cam_id).snapshot(),
+        "ingest": ingest_stats(cam_id),
+        "preview": broadcaster.stats() if broadcaster is not None else None,
+    }
+
+@app.get("/metrics")
+async def get_metrics():
+    """Pipeline metrics of every camera in the Prometheus text format"""
+    bus = alert_bus.stats()
+    extra = {
+        "alert_bus_queue_depth": bus["queued"],
+        "alert_bus_dropped_total": bus["dropped"],
+        "alert_bus_failed_total": bus["failed"],
+        "preview_encode_latency_ms_avg": encoder_pool.stats()["encode_latency"]["avg_ms"] or 0,
+        "reid_indexed_tracks": reid_service.stats()["indexed_tracks"],
+        "reid_merged_tracks_total": reid_service.stats()["merged_tracks"],
+    }
+    return Response(pipeline_metrics.render_prometheus(extra), media_type="text/plain; version=0.0.4")
+
 @app.get("/api/processing/active-cameras")
 async def get_active_cameras():
-    """Get list of cameras currently being processed"""
-    return {"active_cameras": manager.get_active_cameras()}
-
-def is_in_region(bbox, region):
-    # bbox: [x1, y1, x2, y2]
-    # region: dict from ORM
-    
-    # Calculate center of bbox
-    bx1, by1, bx2, by2 = bbox
-    cx = (bx1 + bx2) / 2
-    cy = (by1 + by2) / 2
-    
-    # Region coordinates
-    if isinstance(region, dict):
-        rx1, rx2, ry1, ry2 = region['x1'], region['x2'], region['y1'], region['y2']
-    elif isinstance(region, tuple):
-        rx1, rx2, ry1, ry2 = region[2], region[3], region[4], region[5]
-    else:
-        # Fallback if it's an object
-        rx1, rx2, ry1, ry2 = region.x1, region.x2, region.y1, region.y2
-        
-    return rx1 <= cx <= rx2 and ry1 <= cy <= ry2
+    """Get list of cameras currently being processed (jobs and /ws/process sessions, not viewers)"""
+    return {"active_cameras": sorted(processing_cancel_tokens)}
 
 @app.websocket("/ws/process")
 async def websocket_endpoint(websocket: WebSocket):
@@ -437,7 +704,21 @@ async def websocket_endpoint(websocket: WebSocket):
         cam_id = int(data.get("cam_id", 1))
         shard_duration = int(data.get("shard_duration", 30))
         alert_threshold = float(data.get("alert_threshold", 5.0))
+        live = data.get("live")  # optional: force the live (reconnecting) reader, e.g. for a looped file
+        # Live sources: frames older than this are skipped so alerts stay current
+        max_latency = data.get("max_latency", LIVE_MAX_LATENCY)
+        max_latency = float(max_latency) if max_latency is not None else None
+        # "full": annotated full-resolution JPEGs; "overlay": downscaled frames + track metadata
+        preview_mode = data.get("preview_mode", PREVIEW_MODE_FULL)
+        if preview_mode not in (PREVIEW_MODE_FULL, PREVIEW_MODE_OVERLAY):
+            preview_mode = PREVIEW_MODE_FULL
         
+        # One processing session per camera, whether interactive or a queued job
+        if cam_id in processing_cancel_tokens or orm.get_active_job_for_camera(cam_id):
+            await websocket.send_json({"status": "error", "detail": f"Camera {cam_id} is already being processed"})
+            await websocket.close()
+            return
+
         # Create cancellation token for this processing session
         cancel_token = threading.Event()
         processing_cancel_tokens[cam_id] = cancel_token
@@ -448,108 +729,53 @@ async def websocket_endpoint(websocket: WebSocket):
         manager.active_connections[cam_id].append(websocket)
         print(f"WS: Starting processing for {source} on camera {cam_id}")
 
-        # Fetch regions for this camera
-        all_regions = orm.get_all_regions()
-        cam_regions = [r for r in all_regions if r.get('cam_id') == cam_id]
-        
-        # Dwell time tracking
-        dwell_tracker = {}
-        alerted_events = set()
-        frame_count = 0
-        FRAME_SKIP = 5  # Only send every 5th frame to reduce lag
-        JPEG_QUALITY = 60  # Reduce quality for faster transmission
-
+        # Dwell time tracking over this camera's region index
+        dwell_engine = DwellEngine(orm.get_region_index(cam_id), alert_threshold)
+        # Live preview: this socket subscribes to the camera's broadcaster, which
+        # encodes off the inference thread and drops frames for slow clients
         loop = asyncio.get_event_loop()
+        broadcaster = get_broadcaster(cam_id)
+        preview = broadcaster.subscribe(loop, preview_mode)
+        preview_task = asyncio.create_task(preview.run(websocket.send_bytes))
+        # A failed send just ends this viewer's preview; retrieve the error so it isn't logged as unhandled
+        preview_task.add_done_callback(lambda t: t.cancelled() or t.exception())
 
-        def frame_sender(frame, tracks):
-            nonlocal frame_count
-            
+        def frame_sender(frame, tracks, raw_frame=None):
             # Check if cancelled
             if cancel_token.is_set():
                 return False  # Signal to stop processing
-                
-            frame_count += 1
-            
-            # Use video timestamp from first track (all same frame)
-            video_time = tracks[0]['frame_timestamp'] if tracks else 0
-            active_track_ids = set()
             
-            for track in tracks:
-                t_id = track['track_id']
-                bbox = track['bbox']
-                frame_time = track['frame_timestamp']  # Actual video time
-                active_track_ids.add(t_id)
-                
-                if t_id not in dwell_tracker:
-                    dwell_tracker[t_id] = {}
-                
-                for region in cam_regions:
-                    region_id = region['region_id']
-                    region_name = region['region_name']
-                    
-                    if is_in_region(bbox, region):
-                        if region_id not in dwell_tracker[t_id]:
-                            dwell_tracker[t_id][region_id] = frame_time
-                        else:
-                            duration = frame_time - dwell_tracker[t_id][region_id]
-                            if duration > alert_threshold:
-                                if (t_id, region_id) not in alerted_events:
-                                    alert_msg = {
-                                        "type": "alert",
-                                        "message": f"Person in {region_name} for {int(duration)}s",
-                                        "region_id": region_id,
-                                        "track_id": t_id,
-                                        "duration": duration,
-                                        "cam_id": cam_id
-                                    }
-                                    asyncio.run_coroutine_threadsafe(
-                                        manager.send_json(alert_msg, websocket, cam_id),
-                                        loop
-                                    )
-                                    # Save alert to database
-                                    try:
-                                        import uuid
-                                        alert_id = str(uuid.uuid4())
-                                        orm.add_alert(
-                                            alert_id=alert_id,
-                                            type=f"dwell_time_exceeded",
-                                            time=datetime.now(),
-                                            region_id=region_id
-                                        )
-                                    except Exception as e:
-                                        print(f"Error saving alert to DB: {e}")
-                                    alerted_events.add((t_id, region_id))
-                    else:
-                        if region_id in dwell_tracker[t_id]:
-                            del dwell_tracker[t_id][region_id]
-                            if (t_id, region_id) in alerted_events:
-                                alerted_events.remove((t_id, region_id))
-
-            # Cleanup
-            for t_id in list(dwell_tracker.keys()):
-                if t_id not in active_track_ids:
-                    del dwell_tracker[t_id]
-
-            # Only send every Nth frame to reduce WebSocket traffic
-            if frame_count % FRAME_SKIP == 0:
-                # Send FULL RESOLUTION frame (no scaling) so region boxes match
-                ret, buffer = cv2.imencode('.jpg', frame, [cv2.IMWRITE_JPEG_QUALITY, JPEG_QUALITY])
-                if ret:
-                    asyncio.run_coroutine_threadsafe(
-                        manager.send_bytes(buffer.tobytes(), websocket, cam_id), 
-                        loop
-                    )
+            for t_id, region, duration in dwell_engine.update(tracks):
+                # Delivery to viewers and the DB INSERT happen on the alert bus thread
+                alert_bus.publish({
+                    "alert_type": "dwell_time_exceeded",
+                    "message": f"Person in {region['region_name']} for {int(duration)}s",
+                    "region_id": region['region_id'],
+                    "track_id": t_id,
+                    "duration": duration,
+                    "cam_id": cam_id
+                })
+
+            # Full mode sends FULL RESOLUTION frames (no scaling) so region boxes match;
+            # overlay mode sends the scale factor along with the downscaled frame
+            broadcaster.submit(frame, raw_frame, tracks)
             
             return True  # Continue processing
 
-        await asyncio.to_thread(
-            run_processing_with_callback, 
-            source, 
-            shard_duration, 
-            cam_id, 
-            frame_sender,
-            cancel_token
-        )
+        try:
+            await asyncio.to_thread(
+                run_processing_with_callback, 
+                source, 
+                shard_duration, 
+                cam_id, 
+                frame_sender,
+                cancel_token,
+                live,
+                max_latency
+            )
+        finally:
+            broadcaster.unsubscribe(preview)
+            preview_task.cancel()
         
         try:
             if cam_id in manager.active_connections and websocket in manager.active_connections[cam_id]:
@@ -560,6 +786,9 @@ async def websocket_endpoint(websocket: WebSocket):
     except WebSocketDisconnect:
         if cam_id:
             manager.disconnect(websocket, cam_id)
+        # The client that started processing went away: stop its pipeline
+        if cancel_token:
+            cancel_token.set()
         print(f"Client disconnected from camera {cam_id}")
     except Exception as e:
         print(f"WS Error: {e}")
@@ -569,19 +798,98 @@ async def websocket_endpoint(websocket: WebSocket):
             pass
         if cam_id:
             manager.disconnect(websocket, cam_id)
+        if cancel_token:
+            cancel_token.set()
     finally:
-        # Cleanup cancellation token
-        if cam_id and cam_id in processing_cancel_tokens:
+        # Cleanup cancellation token (only this session's own)
+        if cancel_token is not None and processing_cancel_tokens.get(cam_id) is cancel_token:
             del processing_cancel_tokens[cam_id]
 
-def run_processing_with_callback(source, shard_duration, cam_id, callback, cancel_token=None):
+def viewer_broadcaster(cam_id):
+    """
+    Broadcaster for a read-only viewer: only for cameras that exist or are being
+    processed, so viewers can't start a broadcaster thread for arbitrary IDs.
+    """
+    if cam_id not in processing_cancel_tokens and not orm.camera_exists(cam_id):
+        return None
+    return get_broadcaster(cam_id)
+
+def mjpeg_part(jpeg: bytes) -> bytes:
+    return b"--frame\r\nContent-Type: image/jpeg\r\nContent-Length: " + str(len(jpeg)).encode() + b"\r\n\r\n" + jpeg + b"\r\n"
+
+@app.get("/api/stream/{cam_id}/mjpeg")
+async def stream_mjpeg(cam_id: int):
+    """Read-only MJPEG live view. Viewers attach and detach without touching processing."""
+    broadcaster = viewer_broadcaster(cam_id)
+    if broadcaster is None:
+        raise HTTPException(status_code=404, detail=f"Camera {cam_id} not found")
+    loop = asyncio.get_running_loop()
+
+    async def frames():
+        subscriber = broadcaster.subscribe(loop)
+        try:
+            # Most recent frame first, so the viewer never starts on a blank image
+            latest = broadcaster.ring.latest()
+            if latest:
+                yield mjpeg_part(latest[2])
+            while True:
+                jpeg = await subscriber.next_frame()
+                if jpeg is None:
+                    break
+                started = time.monotonic()
+                yield mjpeg_part(jpeg)
+                subscriber.record_sent(time.monotonic() - started)
+        finally:
+            broadcaster.unsubscribe(subscriber)
+
+    return StreamingResponse(frames(), media_type="multipart/x-mixed-replace; boundary=frame")
+
+@app.websocket("/ws/view/{cam_id}")
+async def websocket_view(websocket: WebSocket, cam_id: int, mode: str = PREVIEW_MODE_FULL):
+    """
+    Read-only live view of a camera: preview frames (same format as /ws/process for the
+    given mode) plus alerts. Disconnecting never cancels processing.
+    """
+    if mode not in (PREVIEW_MODE_FULL, PREVIEW_MODE_OVERLAY):
+        mode = PREVIEW_MODE_FULL
+    broadcaster = viewer_broadcaster(cam_id)
+    if broadcaster is None:
+        await websocket.close(code=1008)
+        return
+    await viewers.connect(websocket, cam_id)
+    preview = broadcaster.subscribe(asyncio.get_running_loop(), mode)
+
+    async def drain():
+        # Viewers don't send anything; this only notices the disconnect
+        while True:
+            await websocket.receive_text()
+
+    try:
+        latest = broadcaster.ring.latest()
+        if latest and mode == PREVIEW_MODE_FULL:
+            await websocket.send_bytes(latest[2])
+        tasks = [asyncio.create_task(preview.run(websocket.send_bytes)), asyncio.create_task(drain())]
+        done, pending = await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+        for task in pending:
+            task.cancel()
+        for task in done:
+            task.exception()
+    except WebSocketDisconnect:
+        pass
+    finally:
+        broadcaster.unsubscribe(preview)
+        viewers.disconnect(websocket, cam_id)
+
+def run_processing_with_callback(source, shard_duration, cam_id, callback, cancel_token=None, live=None, max_latency=LIVE_MAX_LATENCY):
     # Wrapper to run the generator and consume it
     shard_generator = process_video_shards(
         source, 
         shard_duration, 
         cam_id=cam_id, 
         frame_callback=callback,
-        cancel_token=cancel_token
+        cancel_token=cancel_token,
+        live=live,
+        max_latency=max_latency
     )
     
     for shard_id, data, tracking_data in shard_generator:
@@ -590,38 +898,11 @@ def run_processing_with_callback(source, shard_duration, cam_id, callback, cance
             print(f"WS: Processing cancelled for camera {cam_id}")
             break
         print(f"WS: Shard {shard_id} processed.")
-        # Save to DB (same logic as run_processing_task)
-        save_shard_data(shard_id, data, tracking_data)
-
-def save_shard_data(shard_id, data, tracking_data):
-    # Insert Tracking
-    tracking_tuples = []
-    for t in tracking_data:
-        tracking_tuples.append((
-            t["tracking_id"],
-            t["confusion_time"],
-            t["tracker_group"],
-            t["cam_id"],
-            t["time"],
-            t["video_shard"],
-            t.get("gender", "Unknown")
-        ))
-    if tracking_tuples:
-        orm.batch_insert_tracking(tracking_tuples)
-
-    # Insert Bounding Boxes
-    bbox_tuples = []
-    for d in data:
-        bbox = d["bbox"]
-        bbox_tuples.append((
-            int(bbox[0]), int(bbox[2]), int(bbox[1]), int(bbox[3]),
-            d["timestamp"],
-            d["track_id"],
-            d["Video_shard"],
-            d["Frame_number"]
-        ))
-    if bbox_tuples:
-        orm.batch_insert_bounding_boxes(bbox_tuples)
+        # Save to DB (same logic as run_job)
+        save_shard_data(shard_id, data, tracking_data, cam_id)
+
+def save_shard_data(shard_id, data, tracking_data, cam_id=None):
+    ingest_shard(orm, shard_id, data, tracking_data, cam_id)
 
 # ==================== AI REPORT GENERATION ====================
 
@@ -0,0 +1,217 @@
+import multiprocessing
+import os
+from datetime import datetime
+import cv2
+import numpy as np
+
+BATCH_WORKERS = max(1, min(4, (os.cpu_count() or 2) // 2))
+BATCH_MIN_CHUNK_SECONDS = 60  # shorter files are not worth splitting
+# Chunks are also the unit of progress: a chunk's shards reach the caller (and are persisted)
+# only when it is done, so keep several per worker and none longer than BATCH_MAX_CHUNK_SECONDS.
+# Each chunk loads its models again, which is why they aren't shorter.
+BATCH_CHUNKS_PER_WORKER = 4
+BATCH_MAX_CHUNK_SECONDS = 300
+BATCH_CANCEL_POLL = 0.5  # seconds between cancel checks while waiting for a chunk
+STITCH_OVERLAP_SECONDS = 2.0  # frames processed by both neighbouring chunks
+STITCH_MIN_IOU = 0.5  # mean IoU over the overlap for two tracks to be the same person
+STITCH_MIN_FRAMES = 3  # overlap frames both tracks must appear in
+
+
+def probe_video(source):
+    """(fps, frame_count) of a video file; frame_count is 0 when the container doesn't say."""
+    cap = cv2.VideoCapture(source)
+    try:
+        if not cap.isOpened():
+            return None, 0
+        fps = cap.get(cv2.CAP_PROP_FPS) or 30
+        return fps, int(cap.get(cv2.CAP_PROP_FRAME_COUNT) or 0)
+    finally:
+        cap.release()
+
+
+def plan_chunks(total_frames, fps, workers, overlap_frames, shard_duration, start_frame=0):
+    """
+    Split [start_frame, total_frames) into contiguous chunks, each a whole number of
+    shards long, as (start, end, warmup) tuples: BATCH_CHUNKS_PER_WORKER per worker, or
+    more so none is longer than BATCH_MAX_CHUNK_SECONDS, but none shorter than
+    BATCH_MIN_CHUNK_SECONDS; a single worker gets one chunk. Every chunk that does
+    not begin the file starts warmup = overlap_frames early so its tracker has settled,
+    and those frames are also the last ones of the previous chunk.
+    """
+    frames_per_shard = max(1, int(fps * shard_duration))
+    min_chunk = max(frames_per_shard, int(fps * BATCH_MIN_CHUNK_SECONDS))
+    max_chunk = max(min_chunk, int(fps * BATCH_MAX_CHUNK_SECONDS))
+    remaining = max(0, total_frames - start_frame)
+    count = 1
+    if workers > 1:
+        count = max(workers * BATCH_CHUNKS_PER_WORKER, -(-remaining // max_chunk))
+        count = max(1, min(count, remaining // min_chunk))
+    shards = -(-remaining // frames_per_shard)
+    per_chunk = max(1, -(-shards // count)) * frames_per_shard
+
+    chunks = []
+    for start in range(start_frame, total_frames, per_chunk):
+        end = min(start + per_chunk, total_frames)
+        warmup = min(overlap_frames, start)
+        chunks.append((start - warmup, end, warmup))
+    return chunks
+
+
+def _iou_matrix(a, b):
+    """IoU between every box of a (N, 4) and b (M, 4), boxes as x1, y1, x2, y2."""
+    x1 = np.maximum(a[:, None, 0], b[None, :, 0])
+    y1 = np.maximum(a[:, None, 1], b[None, :, 1])
+    x2 = np.minimum(a[:, None, 2], b[None, :, 2])
+    y2 = np.minimum(a[:, None, 3], b[None, :, 3])
+    inter = np.clip(x2 - x1, 0, None) * np.clip(y2 - y1, 0, None)
+    area_a = (a[:, 2] - a[:, 0]) * (a[:, 3] - a[:, 1])
+    area_b = (b[:, 2] - b[:, 0]) * (b[:, 3] - b[:, 1])
+    union = area_a[:, None] + area_b[None, :] - inter
+    return np.where(union > 0, inter / np.maximum(union, 1e-9), 0.0)
+
+
+def match_tracks(previous_tail, next_head):
+    """
+    Match the tracks of two chunks over the frames both processed.
+    previous_tail / next_head: {frame_number: [(track_id, bbox), ...]}.
+    Returns {next track_id: previous track_id}, pairing greedily by mean IoU.
+    """
+    sums = {}
+    counts = {}
+    for frame, head in next_head.items():
+        tail = previous_tail.get(frame)
+        if not tail or not head:
+            continue
+        iou = _iou_matrix(np.array([b for _, b in tail], dtype=np.float64),
+                          np.array([b for _, b in head], dtype=np.float64))
+        for i, (prev_id, _) in enumerate(tail):
+            for j, (next_id, _) in enumerate(head):
+                if iou[i, j] > 0:
+                    key = (prev_id, next_id)
+                    sums[key] = sums.get(key, 0.0) + iou[i, j]
+                    counts[key] = counts.get(key, 0) + 1
+
+    # Frames where only one of the two tracks appears count as zero overlap
+    presence = {}
+    for frames in (previous_tail, next_head):
+        for frame, tracks in frames.items():
+            if frame in previous_tail and frame in next_head:
+                for track_id, _ in tracks:
+                    presence.setdefault(track_id, set()).add(frame)
+
+    candidates = []
+    for (prev_id, next_id), total in sums.items():
+        if counts[(prev_id, next_id)] < STITCH_MIN_FRAMES:
+            continue
+        frames = len(presence.get(prev_id, set()) | presence.get(next_id, set()))
+        score = total / frames
+        if score >= STITCH_MIN_IOU:
+            candidates.append((score, prev_id, next_id))
+
+    mapping = {}
+    used = set()
+    for score, prev_id, next_id in sorted(candidates, reverse=True):
+        if next_id in mapping or prev_id in used:
+            continue
+        mapping[next_id] = prev_id
+        used.add(prev_id)
+    return mapping
+
+
+def _process_chunk(job):
+    """Runs in a worker process: process one chunk and return its shards plus the overlap tracks."""
+    from sharding import process_video_shards
+
+    source, shard_duration, cam_id, start, end, warmup, overlap, time_origin, options = job
+    head, tail = {}, {}
+    position = [start]
+
+    def record_overlap(annotated_frame, tracks, raw_frame):
+        # Called once per frame, in order, with the file position known from the chunk start
+        frame = position[0]
+        position[0] += 1
+        boxes = [(t["track_id"], t["bbox"]) for t in tracks]
+        if frame < start + warmup:
+            head[frame] = boxes
+        if frame >= end - overlap:
+            tail[frame] = boxes
+        return True
+
+    shards = list(process_video_shards(
+        source, shard_duration, cam_id=cam_id, frame_callback=record_overlap,
+        live=False, start_frame=start, end_frame=end, warmup_frames=warmup,
+        time_origin=time_origin, **options
+    ))
+    return shards, head, tail
+
+
+def _remap(shards, mapping):
+    if not mapping:
+        return shards
+    for shard_id, data, tracking_data in shards:
+        for obj in data:
+            obj["track_id"] = mapping.get(obj["track_id"], obj["track_id"])
+        for entry in tracking_data:
+            entry["tracking_id"] = mapping.get(entry["tracking_id"], entry["tracking_id"])
+    return shards
+
+
+def process_video_parallel(source, shard_duration, cam_id=1, workers=BATCH_WORKERS, start_frame=0, time_origin=None,
+                           cancel_token=None, **options):
+    """
+    Offline counterpart of process_video_shards for recorded files: the file is cut
+    into time ranges that are processed in separate processes, and the results are
+    yielded as (shard_id, shard_data, tracking_data) in file order, so shards are
+    written in the same order as a sequential run. Tracks that cross a chunk
+    boundary are stitched by matching boxes over the frames both chunks processed,
+    and keep the earlier chunk's track id. Falls back to a sequential run when the file is
+    too short or its length is unknown. start_frame resumes a run from that frame (a
+    shard boundary); time_origin is the wall-clock time of frame 0. Setting
+    cancel_token stops the run within BATCH_CANCEL_POLL, terminating the chunks
+    still being processed.
+    """
+    fps, total_frames = probe_video(source)
+    if fps is None:
+        print(f"Error: Could not open video source {source}")
+        return
+    overlap = int(fps * STITCH_OVERLAP_SECONDS)
+    # One clock for the whole file, so timestamps line up across chunks
+    time_origin = time_origin or datetime.now()
+    chunks = plan_chunks(total_frames, fps, workers, overlap, shard_duration, start_frame) if total_frames > 0 else []
+    if len(chunks) <= 1:
+        from sharding import process_video_shards
+        warmup = min(overlap, start_frame)
+        yield from process_video_shards(source, shard_duration, cam_id=cam_id, live=False,
+                                        cancel_token=cancel_token, start_frame=start_frame - warmup,
+                                        warmup_frames=warmup, time_origin=time_origin, **options)
+        return
+
+    jobs = [(source, shard_duration, cam_id, start, end, warmup, overlap, time_origin, options)
+            for start, end, warmup in chunks]
+    print(f"Batch processing {source}: {total_frames} frames in {len(jobs)} chunks on {workers} workers")
+
+    # Separate processes (spawned, so CUDA and the models are initialised per worker)
+    context = multiprocessing.get_context("spawn")
+    with context.Pool(processes=min(workers, len(jobs))) as pool:
+        previous_tail = None
+        carried = {}  # track ids of the previous chunk -> id they were stitched to
+        results = pool.imap(_process_chunk, jobs)
+        for index in range(len(jobs)):
+            while True:
+                if cancel_token is not None and cancel_token.is_set():
+                    # Leaving the with block terminates the workers mid-chunk
+                    print(f"Batch processing {source}: cancelled")
+                    return
+                try:
+                    shards, head, tail = results.next(timeout=BATCH_CANCEL_POLL)
+                    break
+                except multiprocessing.TimeoutError:
+                    pass
+            mapping = {}
+            if previous_tail is not None:
+                mapping = {new: carried.get(old, old) for new, old in match_tracks(previous_tail, head).items()}
+                print(f"Chunk {index}: stitched {len(mapping)} tracks across the boundary")
+            for shard in _remap(shards, mapping):
+                yield shard
+            previous_tail = tail
+            carried = mapping
@@ -0,0 +1,292 @@
+import argparse
+import glob
+import itertools
+import json
+import multiprocessing
+import os
+import platform
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime
+from region_index import RegionIndex
+
+# Benchmarks are CPU-only so results are comparable between machines and versions
+os.environ.setdefault("CUDA_VISIBLE_DEVICES", "")
+
+BENCHMARK_CORPUS = os.path.join(os.path.dirname(os.path.abspath(__file__)), "shards")
+BENCHMARK_CORPUS_LIMIT = 5  # videos; the first N of the sorted corpus
+BENCHMARK_SHARD_DURATION = 30  # seconds
+BENCHMARK_THREADS = 4  # torch intra-op threads
+BENCHMARK_CAM_ID = 1
+BENCHMARK_REGION_GRID = 3  # regions per side of the frame, for the region assignment at ingest
+REGRESSION_THRESHOLD = 0.10  # fractional fps drop reported as a regression by --compare
+
+MODE_ANNOTATED = "annotated"
+MODE_HEADLESS = "headless"
+
+
+class MemoryStore:
+    """
+    In-memory stand-in for the DataBaseOrm methods used at shard ingest, so the
+    whole of shard_ingest.ingest_shard (region assignment, heatmap tiles, gender
+    updates, re-ID) can be benchmarked without PostgreSQL.
+    """
+
+    def __init__(self, regions=()):
+        self.regions = list(regions)
+        self.tracking = []
+        self.bounding_boxes = []
+        self.track_genders = []
+        self.region_presence = []
+        self.heatmap_tiles = {}  # shard_id -> (cam_id, shard tile, {day: tile})
+        self.track_aliases = []
+        self.track_appearances = []
+
+    def batch_insert_tracking(self, tracking_tuples):
+        self.tracking.extend(tracking_tuples)
+        return True
+
+    def update_track_genders(self, track_genders):
+        self.track_genders.extend(track_genders)
+
+    def batch_insert_bounding_boxes(self, bbox_tuples):
+        self.bounding_boxes.extend(bbox_tuples)
+        return True
+
+    def get_region_index(self, cam_id):
+        return RegionIndex([r for r in self.regions if r["cam_id"] == cam_id])
+
+    def batch_insert_region_presence(self, presence_tuples):
+        self.region_presence.extend(presence_tuples)
+
+    def save_heatmap_tiles(self, cam_id, shard_id, shard_tile, day_tiles):
+        self.heatmap_tiles.setdefault(shard_id, (cam_id, shard_tile, day_tiles))
+
+    def get_recent_track_appearances(self, window_seconds):
+        return []
+
+    def upsert_track_appearances(self, appearances):
+        self.track_appearances.extend(appearances)
+
+    def batch_insert_track_aliases(self, aliases):
+        self.track_aliases.extend(aliases)
+
+
+def benchmark_regions(cam_id=BENCHMARK_CAM_ID, width=1920, height=1080, grid=BENCHMARK_REGION_GRID):
+    """A grid x grid tiling of the frame, so every box is assigned to a region at ingest."""
+    regions = []
+    for row in range(grid):
+        for col in range(grid):
+            regions.append({
+                "region_id": row * grid + col + 1,
+                "region_name": f"bench_{row}_{col}",
+                "cam_id": cam_id,
+                "x1": col * width // grid, "x2": (col + 1) * width // grid,
+                "y1": row * height // grid, "y2": (row + 1) * height // grid,
+            })
+    return regions
+
+
+def load_corpus(corpus_dir=BENCHMARK_CORPUS, limit=BENCHMARK_CORPUS_LIMIT):
+    """The benchmark videos: *.mp4 in corpus_dir, sorted by name so every run sees the same files."""
+    videos = sorted(glob.glob(os.path.join(corpus_dir, "*.mp4")))
+    return videos[:limit] if limit else videos
+
+
+def build_configs(models, sizes, strides, modes, backends=("torch",), precisions=("fp32",)):
+    return [
+        {"model": model, "imgsz": imgsz, "frame_stride": stride, "mode": mode, "backend": backend, "precision": precision}
+        for model, imgsz, stride, mode, backend, precision in itertools.product(models, sizes, strides, modes, backends, precisions)
+    ]
+
+
+def _peak_rss_mb():
+    # ru_maxrss is in kilobytes on Linux and bytes on macOS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return round(peak / (1024 * 1024 if sys.platform == "darwin" else 1024), 1)
+
+
+def _run_config(job):
+    """Runs in a fresh process: process every corpus video with one configuration."""
+    config, videos, shard_duration, cnn_weights_path, threads = job
+    import torch
+    torch.set_num_threads(threads)
+    from sharding import process_video_shards
+    from pipeline_metrics import pipeline_metrics
+    from shard_ingest import ingest_shard
+
+    store = MemoryStore(benchmark_regions())
+    output_dir = tempfile.mkdtemp(prefix="benchmark_shards_")
+    frames = 0
+    steady_frames = 0
+    steady_seconds = 0.0
+    shards = 0
+    started = time.perf_counter()
+    try:
+        for video in videos:
+            # Time from the first frame on, so model loading is not counted as throughput
+            first_frame = [None]
+            video_frames = [0]
+
+            def on_frame(annotated_frame, tracks, raw_frame):
+                if first_frame[0] is None:
+                    first_frame[0] = time.perf_counter()
+                video_frames[0] += 1
+                return True
+
+            for shard_id, data, tracking_data in process_video_shards(
+                video, shard_duration, cam_id=BENCHMARK_CAM_ID, output_dir=output_dir,
+                model_path=config["model"], cnn_weights_path=cnn_weights_path,
+                frame_callback=on_frame, live=False, imgsz=config["imgsz"],
+                frame_stride=config["frame_stride"], annotate=config["mode"] == MODE_ANNOTATED,
+                backend=config.get("backend"), precision=config.get("precision"), threads=threads
+            ):
+                ingest_shard(store, shard_id, data, tracking_data, BENCHMARK_CAM_ID)
+                shards += 1
+
+            frames += video_frames[0]
+            if first_frame[0] is not None and video_frames[0] > 1:
+                steady_frames += video_frames[0] - 1
+                steady_seconds += time.perf_counter() - first_frame[0]
+        wall_seconds = time.perf_counter() - started
+    finally:
+        shutil.rmtree(output_dir, ignore_errors=True)
+
+    stages = {}
+    for name, histogram in pipeline_metrics.camera(BENCHMARK_CAM_ID).stages.items():
+        _, count, sum_ms = histogram.raw()
+        if count:
+            stages[name] = {
+                "count": count,
+                "total_s": round(sum_ms / 1000, 3),
+                "avg_ms": round(sum_ms / count, 3),
+            }
+
+    return {
+        "config": config,
+        "frames": frames,
+        "shards": shards,
+        "wall_seconds": round(wall_seconds, 3),
+        "fps": round(steady_frames / steady_seconds, 2) if steady_seconds else None,
+        "stages": stages,
+        "peak_rss_mb": _peak_rss_mb(),
+        "boxes": len(store.bounding_boxes),
+        "tracks": len(store.tracking),
+    }
+
+
+def git_revision():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__)), timeout=10).stdout.strip() or None
+    except Exception:
+        return None
+
+
+def run_benchmark(configs, videos, shard_duration=BENCHMARK_SHARD_DURATION,
+                  cnn_weights_path="../train/cnn_weights.pth", threads=BENCHMARK_THREADS):
+    """
+    Run every configuration over the corpus, each in its own process so peak RSS
+    and model loading are measured from a clean start. Returns the report dict.
+    """
+    jobs = [(config, videos, shard_duration, cnn_weights_path, threads) for config in configs]
+    runs = []
+    context = multiprocessing.get_context("spawn")
+    with context.Pool(processes=1, maxtasksperchild=1) as pool:
+        for run in pool.imap(_run_config, jobs):
+            print(f"{run['config']}: {run['fps']} fps, {run['boxes']} boxes, peak RSS {run['peak_rss_mb']} MB")
+            runs.append(run)
+
+    return {
+        "created_at": datetime.now().isoformat(),
+        "revision": git_revision(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "threads": threads,
+        "shard_duration": shard_duration,
+        "corpus": [os.path.basename(v) for v in videos],
+        "runs": runs,
+    }
+
+
+def _config_key(config):
+    return (config["model"], config["imgsz"], config["frame_stride"], config["mode"],
+            config.get("backend", "torch"), config.get("precision", "fp32"))
+
+
+def compare_reports(baseline, current, threshold=REGRESSION_THRESHOLD):
+    """
+    Per-configuration fps and box-count changes between two reports.
+    Returns (lines, regressed): regressed is True if any configuration lost more than threshold of its fps.
+    """
+    lines = []
+    regressed = False
+    if baseline.get("corpus") != current.get("corpus"):
+        lines.append("WARNING: the reports were run over different corpora")
+    previous = {_config_key(run["config"]): run for run in baseline.get("runs", [])}
+    for run in current["runs"]:
+        before = previous.get(_config_key(run["config"]))
+        if before is None or not before.get("fps") or not run.get("fps"):
+            continue
+        change = (run["fps"] - before["fps"]) / before["fps"]
+        status = "ok"
+        if change < -threshold:
+            status = "REGRESSION"
+            regressed = True
+        lines.append(f"{run['config']}: {before['fps']} -> {run['fps']} fps ({change:+.1%}), "
+                     f"boxes {before['boxes']} -> {run['boxes']} [{status}]")
+    return lines, regressed
+
+
+def _list_arg(value, cast=str):
+    return [cast(v) for v in value.split(",") if v]
+
+
+def _size_arg(value):
+    return None if value in ("", "default", "0") else int(value)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Offline CPU benchmark of process_video_shards")
+    parser.add_argument("--corpus", default=BENCHMARK_CORPUS, help="directory of .mp4 files")
+    parser.add_argument("--limit", type=int, default=BENCHMARK_CORPUS_LIMIT, help="videos to use (0 = all)")
+    parser.add_argument("--models", default="yolo12s.pt", help="comma-separated YOLO weights")
+    parser.add_argument("--imgsz", default="default", help="comma-separated inference sizes, 'default' for the model's")
+    parser.add_argument("--stride", default="1", help="comma-separated frame strides")
+    parser.add_argument("--modes", default=f"{MODE_ANNOTATED},{MODE_HEADLESS}", help="annotated and/or headless")
+    parser.add_argument("--backends", default="torch", help="comma-separated: torch, onnxruntime, openvino")
+    parser.add_argument("--precisions", default="fp32", help="comma-separated: fp32, int8")
+    parser.add_argument("--shard-duration", type=int, default=BENCHMARK_SHARD_DURATION)
+    parser.add_argument("--cnn-weights", default="../train/cnn_weights.pth")
+    parser.add_argument("--threads", type=int, default=BENCHMARK_THREADS)
+    parser.add_argument("--output", default=None, help="JSON report path (default: benchmark_<time>.json)")
+    parser.add_argument("--compare", default=None, help="baseline JSON report to compare against")
+    parser.add_argument("--threshold", type=float, default=REGRESSION_THRESHOLD)
+    args = parser.parse_args()
+
+    videos = load_corpus(args.corpus, args.limit)
+    if not videos:
+        print(f"No .mp4 files in {args.corpus}")
+        sys.exit(1)
+    configs = build_configs(_list_arg(args.models), _list_arg(args.imgsz, _size_arg),
+                            _list_arg(args.stride, int), _list_arg(args.modes),
+                            _list_arg(args.backends), _list_arg(args.precisions))
+
+    report = run_benchmark(configs, videos, args.shard_duration, args.cnn_weights, args.threads)
+    output = args.output or f"benchmark_{datetime.now():%Y%m%d_%H%M%S}.json"
+    with open(output, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"Report written to {output}")
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        lines, regressed = compare_reports(baseline, report, args.threshold)
+        for line in lines:
+            print(line)
+        sys.exit(1 if regressed else 0)
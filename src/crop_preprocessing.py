@@ -0,0 +1,68 @@
+import cv2
+import numpy as np
+from gender_classifier import GENDER_INPUT_SIZE
+
+CROP_BATCH_CAPACITY = 16  # crops per frame before the buffers grow (they double as needed)
+
+
+class CropBatcher:
+    """
+    Cuts the person crops of a frame into one reused (N, 3, 64, 64) float32 batch
+    for the Gender CNN.
+
+    Each box is resized straight into a preallocated uint8 (N, 64, 64, 3) staging
+    buffer, then a single vectorized divide over the whole batch does the
+    BGR -> RGB swap, the HWC -> CHW permute, the float conversion and the /255
+    normalization into the preallocated float buffer. No per-crop arrays or
+    tensors are created, and torch.from_numpy on the result shares its memory.
+
+    The returned batch is a view of the buffer and is overwritten by the next
+    fill(); one batcher per pipeline.
+    """
+
+    def __init__(self, size=GENDER_INPUT_SIZE, capacity=CROP_BATCH_CAPACITY):
+        self.size = size
+        self._count = 0
+        self._allocate(capacity)
+
+    def _allocate(self, capacity):
+        self.capacity = capacity
+        self._staging = np.empty((capacity, self.size, self.size, 3), dtype=np.uint8)
+        self._batch = np.empty((capacity, 3, self.size, self.size), dtype=np.float32)
+
+    def fill(self, frame, boxes):
+        """
+        boxes: (x1, y1, x2, y2) in frame pixels. Returns (batch, kept): batch is
+        float32 (len(kept), 3, 64, 64) RGB in [0, 1], and kept holds the indices
+        of the boxes it covers (boxes empty after clamping to the frame are left out).
+        """
+        if len(boxes) > self.capacity:
+            self._allocate(max(len(boxes), self.capacity * 2))
+        height, width = frame.shape[:2]
+        kept = []
+        for i, (x1, y1, x2, y2) in enumerate(boxes):
+            x1, y1 = max(0, int(x1)), max(0, int(y1))
+            x2, y2 = min(width, int(x2)), min(height, int(y2))
+            if x2 > x1 and y2 > y1:
+                cv2.resize(frame[y1:y2, x1:x2], (self.size, self.size), dst=self._staging[len(kept)])
+                kept.append(i)
+        n = self._count = len(kept)
+        batch = self._batch[:n]
+        # BGR -> RGB, HWC -> CHW, uint8 -> float32 and /255 in one pass over all crops
+        np.divide(self._staging[:n, :, :, ::-1].transpose(0, 3, 1, 2), np.float32(255.0),
+                  out=batch, casting="unsafe")
+        return batch, kept
+
+    def crops(self):
+        """The resized uint8 BGR (N, 64, 64, 3) crops of the last fill(), as a view of the staging buffer."""
+        return self._staging[:self._count]
+
+    def sharpness(self):
+        """
+        Variance of the Laplacian of each crop of the last fill(), on the resized
+        greyscale crops: low values mean blurred or featureless crops.
+        """
+        grey = self._staging[:self._count].astype(np.float32).mean(axis=3)
+        laplacian = (grey[:, :-2, 1:-1] + grey[:, 2:, 1:-1] + grey[:, 1:-1, :-2] + grey[:, 1:-1, 2:]
+                     - 4 * grey[:, 1:-1, 1:-1])
+        return laplacian.reshape(self._count, -1).var(axis=1)
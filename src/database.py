@@ -1,31 +1,42 @@
+import os
 import psycopg2 
-from psycopg2.extras import DictCursor, execute_values
+from psycopg2.extras import DictCursor, execute_values, execute_batch
 from datetime import datetime
 import uuid
 import requests
 import json
+from analytics_cache import analytics_cache, cached_analytics
+from region_catalog import region_catalog
+from region_index import RegionIndex, region_polygon
+from reid import reid_service
+from heatmap_tiles import HeatmapTile, render_region
 
 # Ollama Configuration
 OLLAMA_URL = "http://localhost:11434/api/generate"
 OLLAMA_MODEL = "llama3.1:latest"  # Change to your installed model (mistral, llama3.2, etc.)
-conn = psycopg2.connect(
-    host="localhost",
-    user="postgres",
-    password="your_password",
-    dbname="salesloss"
-)
+
+# update_region leaves the polygon as it is unless one (or None, to clear it) is given
+POLYGON_UNCHANGED = object()
+
+# PostgreSQL Configuration
+DEFAULT_DB_NAME = "salesloss"  # the app's own data; synthetic loaders refuse it (see synthetic_workload)
+DB_CONFIG = {
+    "host": "localhost",
+    "user": "postgres",
+    "password": "your_password",
+    # SALESLOSS_DB_NAME points the app (or a benchmark) at another database, e.g. a scratch copy
+    "dbname": os.environ.get("SALESLOSS_DB_NAME", DEFAULT_DB_NAME)
+}
+conn = psycopg2.connect(**DB_CONFIG)
 
 class DataBaseOrm:
     def __init__(self):
-        self.conn = psycopg2.connect(
-                    host="localhost",
-                    user="postgres",
-                    password="your_password",
-                    dbname="salesloss"
-                )
+        self.conn = psycopg2.connect(**DB_CONFIG)
         self.cursor = self.conn.cursor(cursor_factory= DictCursor)
         # Ensure indexes exist for performance
         self._create_indexes()
+        # Keep the region catalog in sync with region edits from other workers
+        region_catalog.start_listener(lambda: psycopg2.connect(**DB_CONFIG))
     
     def _create_indexes(self):
         """Create database indexes for better query performance"""
@@ -61,6 +72,16 @@ class DataBaseOrm:
         self.cursor.execute(query, (camera_id,))
         return self.cursor.fetchone()
 
+    def camera_exists(self, camera_id):
+        try:
+            with self.conn.cursor() as cur:
+                cur.execute("SELECT 1 FROM camera WHERE cam_id = %s", (camera_id,))
+                return cur.fetchone() is not None
+        except Exception as e:
+            self.conn.rollback()
+            print(f"Error checking camera: {e}")
+            return False
+
     def get_all_cameras(self):
         query = "SELECT * FROM camera"
         self.cursor.execute(query)
@@ -109,11 +130,13 @@ class DataBaseOrm:
     def batch_insert_tracking(self, tracking_data):
         """
         Batch insert tracking data.
-        tracking_data: list of tuples (tracking_id, confusion_time, tracker_group, cam_id, time, video_shard, gender)
+        tracking_data: list of tuples (tracking_id, confusion_time, tracker_group, cam_id, time, video_shard, gender,
+        gender_confidence, gender_samples)
         """
         try:
             query = """
-                INSERT INTO tracking (tracking_id, confusion_time, tracker_group, cam_id, "time", video_shard, gender)
+                INSERT INTO tracking (tracking_id, confusion_time, tracker_group, cam_id, "time", video_shard, gender,
+                                      gender_confidence, gender_samples)
                 VALUES %s
                 ON CONFLICT (tracking_id, video_shard) DO NOTHING
             """
@@ -124,6 +147,23 @@ class DataBaseOrm:
             self.conn.rollback()
             print(f"Error batch inserting tracking: {e}")
 
+    def update_track_genders(self, track_genders):
+        """
+        Carry a track's latest gender vote back to its rows from earlier shards.
+        track_genders: list of tuples (gender, gender_confidence, gender_samples, tracking_id);
+        only rows voted on fewer samples are updated.
+        """
+        try:
+            query = """
+                UPDATE tracking SET gender = %s, gender_confidence = %s, gender_samples = %s
+                WHERE tracking_id = %s AND gender_samples < %s
+            """
+            execute_batch(self.cursor, query, [t + (t[2],) for t in track_genders])
+            self.conn.commit()
+        except Exception as e:
+            self.conn.rollback()
+            print(f"Error updating track genders: {e}")
+
     def get_tracking(self, tracking_id, video_shard):
         query = "SELECT * FROM tracking WHERE tracking_id = %s AND video_shard = %s"
         self.cursor.execute(query, (tracking_id, video_shard))
@@ -169,20 +209,110 @@ class DataBaseOrm:
             self.conn.rollback()
             print(f"Error batch inserting bounding boxes: {e}")
 
+    def batch_insert_region_presence(self, presence_data):
+        """
+        Batch insert ingest-time region assignments.
+        presence_data: list of tuples (region_id, tracking_id, video_shard, first_seen, last_seen, frames)
+        """
+        try:
+            query = """
+                INSERT INTO region_presence (region_id, tracking_id, video_shard, first_seen, last_seen, frames)
+                VALUES %s
+                ON CONFLICT (region_id, tracking_id, video_shard) DO NOTHING
+            """
+            execute_values(self.cursor, query, presence_data)
+            self.conn.commit()
+            print(f"Batch inserted {len(presence_data)} region presence records.")
+        except Exception as e:
+            self.conn.rollback()
+            print(f"Error batch inserting region presence: {e}")
+
+    def batch_insert_track_aliases(self, alias_data):
+        """
+        Record re-identified tracks (see reid): the tracking_id is the same person as canonical_id.
+        alias_data: list of tuples (tracking_id, canonical_id, similarity)
+        """
+        try:
+            query = """
+                INSERT INTO track_alias (tracking_id, canonical_id, similarity)
+                VALUES %s
+                ON CONFLICT (tracking_id) DO NOTHING
+            """
+            execute_values(self.cursor, query, alias_data)
+            self.conn.commit()
+            print(f"Batch inserted {len(alias_data)} track aliases.")
+        except Exception as e:
+            self.conn.rollback()
+            print(f"Error batch inserting track aliases: {e}")
+
+    def upsert_track_appearances(self, appearance_data):
+        """
+        Store the latest appearance embedding and time span of tracks, so the
+        re-ID window survives a restart.
+        appearance_data: list of tuples (tracking_id, cam_id, first_seen, last_seen, embedding bytes)
+        """
+        try:
+            query = """
+                INSERT INTO track_appearance (tracking_id, cam_id, first_seen, last_seen, embedding)
+                VALUES %s
+                ON CONFLICT (tracking_id) DO UPDATE SET
+                    first_seen = LEAST(track_appearance.first_seen, EXCLUDED.first_seen),
+                    last_seen = GREATEST(track_appearance.last_seen, EXCLUDED.last_seen),
+                    embedding = EXCLUDED.embedding
+            """
+            execute_values(self.cursor, query, [row[:4] + (psycopg2.Binary(row[4]),) for row in appearance_data])
+            self.conn.commit()
+        except Exception as e:
+            self.conn.rollback()
+            print(f"Error upserting track appearances: {e}")
+
+    def get_recent_track_appearances(self, window_seconds):
+        """Track appearances of the last window_seconds before the newest one, with their canonical ID if aliased."""
+        try:
+            with self.conn.cursor(cursor_factory=DictCursor) as cur:
+                cur.execute("""
+                    SELECT a.tracking_id, a.cam_id, a.first_seen, a.last_seen, a.embedding, ta.canonical_id
+                    FROM track_appearance a
+                    LEFT JOIN track_alias ta ON ta.tracking_id = a.tracking_id
+                    WHERE a.last_seen >= (SELECT MAX(last_seen) FROM track_appearance) - make_interval(secs => %s)
+                """, (window_seconds,))
+                return cur.fetchall()
+        except Exception as e:
+            self.conn.rollback()
+            print(f"Error getting track appearances: {e}")
+            return []
+
     def get_bounding_boxes_by_tracking_id(self, tracking_id):
         query = "SELECT * FROM bounding_box WHERE tracking_id = %s"
         self.cursor.execute(query, (tracking_id,))
         return self.cursor.fetchall()
 
     # --- Region Defined CRUD ---
-    def add_region(self, region_id, region_name, x1, x2, y1, y2, cam_id):
+    def add_region(self, region_id, region_name, x1, x2, y1, y2, cam_id, polygon=None):
+        """
+        polygon: optional list of [x, y] vertices for non-rectangular regions.
+        x1..y2 should then be the polygon's bounding box. The region's presence
+        rows are built from the boxes already stored for its camera.
+        Requires the polygon column and region_presence from migration_region_index.py.
+        """
         try:
-            query = """
-                INSERT INTO region_defined (region_id, region_name, x1, x2, y1, y2, cam_id)
-                VALUES (%s, %s, %s, %s, %s, %s, %s)
-            """
-            self.cursor.execute(query, (region_id, region_name, x1, x2, y1, y2, cam_id))
+            if polygon:
+                query = """
+                    INSERT INTO region_defined (region_id, region_name, x1, x2, y1, y2, cam_id, polygon)
+                    VALUES (%s, %s, %s, %s, %s, %s, %s, %s)
+                """
+                self.cursor.execute(query, (region_id, region_name, x1, x2, y1, y2, cam_id, json.dumps(polygon)))
+            else:
+                query = """
+                    INSERT INTO region_defined (region_id, region_name, x1, x2, y1, y2, cam_id)
+                    VALUES (%s, %s, %s, %s, %s, %s, %s)
+                """
+                self.cursor.execute(query, (region_id, region_name, x1, x2, y1, y2, cam_id))
+            self._rebuild_region_presence(self.cursor, region_id, polygon)
+            region_catalog.notify(self.cursor, region_id)
             self.conn.commit()
+            region_catalog.invalidate()
+            analytics_cache.invalidate_region(region_id)
             print(f"Region {region_id} added.")
         except Exception as e:
             self.conn.rollback()
@@ -190,35 +320,96 @@ class DataBaseOrm:
 
     def get_region(self, region_id):
         try:
-            with self.conn.cursor(cursor_factory=DictCursor) as cur:
-                query = "SELECT * FROM region_defined WHERE region_id = %s"
-                cur.execute(query, (region_id,))
-                row = cur.fetchone()
-                return dict(row) if row else None
+            return region_catalog.get(self.conn, region_id)
         except Exception as e:
             self.conn.rollback()
             print(f"Error getting region: {e}")
             return None
 
-    def update_region(self, region_id, region_name, x1, x2, y1, y2):
+    def update_region(self, region_id, region_name, x1, x2, y1, y2, polygon=POLYGON_UNCHANGED):
+        """
+        polygon: new list of [x, y] vertices, None to make the region a plain
+        rectangle again, or left out to keep the current one. The region's
+        presence rows are rebuilt for its new shape.
+        """
         try:
-            query = """
-                UPDATE region_defined
-                SET region_name = %s, x1 = %s, x2 = %s, y1 = %s, y2 = %s
-                WHERE region_id = %s
-            """
-            self.cursor.execute(query, (region_name, x1, x2, y1, y2, region_id))
+            if polygon is POLYGON_UNCHANGED:
+                query = """
+                    UPDATE region_defined
+                    SET region_name = %s, x1 = %s, x2 = %s, y1 = %s, y2 = %s
+                    WHERE region_id = %s
+                    RETURNING polygon
+                """
+                self.cursor.execute(query, (region_name, x1, x2, y1, y2, region_id))
+            else:
+                query = """
+                    UPDATE region_defined
+                    SET region_name = %s, x1 = %s, x2 = %s, y1 = %s, y2 = %s, polygon = %s
+                    WHERE region_id = %s
+                    RETURNING polygon
+                """
+                self.cursor.execute(query, (region_name, x1, x2, y1, y2,
+                                            json.dumps(polygon) if polygon else None, region_id))
+            row = self.cursor.fetchone()
+            if row is not None:
+                self._rebuild_region_presence(self.cursor, region_id, row['polygon'])
+            region_catalog.notify(self.cursor, region_id)
             self.conn.commit()
+            region_catalog.invalidate()
+            analytics_cache.invalidate_region(region_id)
             print(f"Region {region_id} updated.")
         except Exception as e:
             self.conn.rollback()
             print(f"Error updating region: {e}")
 
+    def _rebuild_region_presence(self, cur, region_id, polygon):
+        """
+        Replace the region's region_presence rows with the boxes of its camera
+        whose centre falls in the region, as assign_shard_regions does at ingest.
+        Runs in the caller's transaction.
+        """
+        cur.execute("DELETE FROM region_presence WHERE region_id = %s", (region_id,))
+        points = region_polygon({'polygon': polygon})
+        if points is None:
+            inside = """(b.x1 + b.x2) / 2.0 BETWEEN r.x1 AND r.x2
+                        AND (b.y1 + b.y2) / 2.0 BETWEEN r.y1 AND r.y2"""
+            params = (region_id,)
+        else:
+            inside = "point((b.x1 + b.x2) / 2.0, (b.y1 + b.y2) / 2.0) <@ %s::polygon"
+            params = (region_id, "(" + ",".join(f"({x},{y})" for x, y in points) + ")")
+        cur.execute(f"""
+            INSERT INTO region_presence (region_id, tracking_id, video_shard, first_seen, last_seen, frames)
+            SELECT r.region_id, b.tracking_id, b.video_shard, MIN(b."timestamp"), MAX(b."timestamp"), COUNT(*)
+            FROM region_defined r
+            JOIN (SELECT DISTINCT video_shard, cam_id FROM tracking) s ON s.cam_id = r.cam_id
+            JOIN bounding_box b ON b.video_shard = s.video_shard
+            WHERE r.region_id = %s AND {inside}
+            GROUP BY r.region_id, b.tracking_id, b.video_shard
+        """, params)
+
+    def rebuild_region_presence(self, region_id):
+        """Rebuild one region's presence rows from the stored boxes (see migration_region_index.py)."""
+        try:
+            with self.conn.cursor(cursor_factory=DictCursor) as cur:
+                cur.execute("SELECT polygon FROM region_defined WHERE region_id = %s", (region_id,))
+                row = cur.fetchone()
+                if row is None:
+                    return
+                self._rebuild_region_presence(cur, region_id, row['polygon'])
+            self.conn.commit()
+            analytics_cache.invalidate_region(region_id)
+        except Exception as e:
+            self.conn.rollback()
+            print(f"Error rebuilding region presence: {e}")
+
     def delete_region(self, region_id):
         try:
             query = "DELETE FROM region_defined WHERE region_id = %s"
             self.cursor.execute(query, (region_id,))
+            region_catalog.notify(self.cursor, region_id)
             self.conn.commit()
+            region_catalog.invalidate()
+            analytics_cache.invalidate_region(region_id)
             print(f"Region {region_id} deleted.")
         except Exception as e:
             self.conn.rollback()
@@ -237,9 +428,31 @@ class DataBaseOrm:
             self.cursor.execute(query, (alert_id, type, time, region_id))
             self.conn.commit()
             print(f"Alert {alert_id} added.")
+            return True
         except Exception as e:
             self.conn.rollback()
             print(f"Error adding alert: {e}")
+            return False
+
+    def batch_insert_alerts(self, alert_data):
+        """
+        Batch insert alerts.
+        alert_data: list of tuples (alert_id, type, time, region_id)
+        Returns True if the batch was committed.
+        """
+        try:
+            query = """
+                INSERT INTO alert (alert_id, type, "time", region_id)
+                VALUES %s
+            """
+            execute_values(self.cursor, query, alert_data)
+            self.conn.commit()
+            print(f"Batch inserted {len(alert_data)} alert records.")
+            return True
+        except Exception as e:
+            self.conn.rollback()
+            print(f"Error batch inserting alerts: {e}")
+            return False
 
     def get_alerts_by_region(self, region_id):
         query = "SELECT * FROM alert WHERE region_id = %s"
@@ -247,10 +460,11 @@ class DataBaseOrm:
         return self.cursor.fetchall()
 
     # --- Analytics Queries ---
+    @cached_analytics(store_wide=True)
     def get_footfall_by_region(self, region_id):
         """
         Calculate unique footfall in a region per shard.
-        Checks if bounding box center is within region coordinates.
+        Reads the region's presence rows (box centres inside the rectangle or polygon).
         Only counts each tracking_id ONCE per shard (not per frame).
         """
         try:
@@ -259,26 +473,25 @@ class DataBaseOrm:
             if not region:
                 return []
             
-            rx1, rx2, ry1, ry2 = region['x1'], region['x2'], region['y1'], region['y2']
-            
             with self.conn.cursor(cursor_factory=DictCursor) as cur:
-                # Query to count unique tracking_ids whose bounding box center falls within region
                 # Uses DISTINCT to count each person only once, regardless of how many frames
                 query = """
-                    SELECT video_shard, COUNT(DISTINCT tracking_id) as footfall
-                    FROM bounding_box
-                    WHERE (x1 + x2) / 2 BETWEEN %s AND %s
-                    AND (y1 + y2) / 2 BETWEEN %s AND %s
-                    GROUP BY video_shard
+                    SELECT rp.video_shard, COUNT(DISTINCT COALESCE(ta.canonical_id, rp.tracking_id)) as footfall
+                    FROM region_presence rp
+                    LEFT JOIN track_alias ta ON ta.tracking_id = rp.tracking_id
+                    WHERE rp.region_id = %s
+                    GROUP BY rp.video_shard
                 """
-                cur.execute(query, (rx1, rx2, ry1, ry2))
+                cur.execute(query, (region_id,))
                 # Return list of tuples (shard_id, count)
                 return [(row['video_shard'], row['footfall']) for row in cur.fetchall()]
         except Exception as e:
             self.conn.rollback()
             print(f"Error getting footfall: {e}")
+            analytics_cache.skip_store()
             return []
     
+    @cached_analytics(store_wide=True)
     def get_total_unique_footfall(self, region_id):
         """
         Get total unique visitors to a region across ALL shards.
@@ -289,24 +502,24 @@ class DataBaseOrm:
             if not region:
                 return 0
             
-            rx1, rx2, ry1, ry2 = region['x1'], region['x2'], region['y1'], region['y2']
-            
             with self.conn.cursor(cursor_factory=DictCursor) as cur:
                 # Count unique tracking_ids across ALL shards (not per-shard)
                 query = """
-                    SELECT COUNT(DISTINCT tracking_id) as total_footfall
-                    FROM bounding_box
-                    WHERE (x1 + x2) / 2 BETWEEN %s AND %s
-                    AND (y1 + y2) / 2 BETWEEN %s AND %s
+                    SELECT COUNT(DISTINCT COALESCE(ta.canonical_id, rp.tracking_id)) as total_footfall
+                    FROM region_presence rp
+                    LEFT JOIN track_alias ta ON ta.tracking_id = rp.tracking_id
+                    WHERE rp.region_id = %s
                 """
-                cur.execute(query, (rx1, rx2, ry1, ry2))
+                cur.execute(query, (region_id,))
                 result = cur.fetchone()
                 return result['total_footfall'] if result else 0
         except Exception as e:
             self.conn.rollback()
             print(f"Error getting total footfall: {e}")
+            analytics_cache.skip_store()
             return 0
 
+    @cached_analytics
     def get_time_spent_in_region(self, region_id):
         """
         Calculate average time spent by tracking_ids in a region per shard.
@@ -316,43 +529,47 @@ class DataBaseOrm:
             if not region:
                 return []
             
-            rx1, rx2, ry1, ry2 = region['x1'], region['x2'], region['y1'], region['y2']
-            
             with self.conn.cursor(cursor_factory=DictCursor) as cur:
-                # Calculate duration for each track in each shard, then average per shard
+                # Each presence row is one track's time in the region in one shard; average per shard
                 query = """
-                    WITH TrackDurations AS (
-                        SELECT 
-                            video_shard,
-                            tracking_id,
-                            EXTRACT(EPOCH FROM (MAX("timestamp") - MIN("timestamp"))) as duration
-                        FROM bounding_box
-                        WHERE (x1 + x2) / 2 BETWEEN %s AND %s
-                        AND (y1 + y2) / 2 BETWEEN %s AND %s
-                        GROUP BY video_shard, tracking_id
-                    )
-                    SELECT video_shard, AVG(duration) as avg_time
-                    FROM TrackDurations
+                    SELECT video_shard, AVG(EXTRACT(EPOCH FROM (last_seen - first_seen))) as avg_time
+                    FROM region_presence
+                    WHERE region_id = %s
                     GROUP BY video_shard
                 """
-                cur.execute(query, (rx1, rx2, ry1, ry2))
+                cur.execute(query, (region_id,))
                 return [(row['video_shard'], row['avg_time']) for row in cur.fetchall()]
         except Exception as e:
             self.conn.rollback()
             print(f"Error getting time spent: {e}")
+            analytics_cache.skip_store()
             return []
 
     def get_all_regions(self):
         try:
-            with self.conn.cursor(cursor_factory=DictCursor) as cur:
-                query = "SELECT * FROM region_defined"
-                cur.execute(query)
-                return [dict(row) for row in cur.fetchall()]
+            return region_catalog.all(self.conn)
         except Exception as e:
             self.conn.rollback()
             print(f"Error getting all regions: {e}")
             return []
 
+    def get_regions_by_camera(self, cam_id):
+        try:
+            return region_catalog.for_camera(self.conn, cam_id)
+        except Exception as e:
+            self.conn.rollback()
+            print(f"Error getting regions for camera: {e}")
+            return []
+
+    def get_region_index(self, cam_id):
+        """Spatial index over a camera's regions (see region_index.RegionIndex)"""
+        try:
+            return region_catalog.index_for_camera(self.conn, cam_id)
+        except Exception as e:
+            self.conn.rollback()
+            print(f"Error building region index: {e}")
+            return RegionIndex([])
+
     def get_shards_by_camera(self, cam_id):
         """
         Get all unique video shards for a specific camera, ordered by time.
@@ -373,6 +590,176 @@ class DataBaseOrm:
             print(f"Error getting shards: {e}")
             return []
 
+    # --- Processing jobs (table created by migration_jobs.py) ---
+
+    def create_job(self, job_id, kind, source, cam_id, shard_duration, options=None):
+        """
+        Queue a processing job. Returns the job row, or None if it could not be
+        created (e.g. the camera already has a queued or running job).
+        """
+        try:
+            with self.conn.cursor(cursor_factory=DictCursor) as cur:
+                cur.execute("""
+                    INSERT INTO processing_job (job_id, kind, source, cam_id, shard_duration, options)
+                    VALUES (%s, %s, %s, %s, %s, %s)
+                    RETURNING *
+                """, (job_id, kind, source, cam_id, shard_duration, json.dumps(options or {})))
+                row = dict(cur.fetchone())
+            self.conn.commit()
+            return row
+        except Exception as e:
+            self.conn.rollback()
+            print(f"Error creating job: {e}")
+            return None
+
+    def get_job(self, job_id):
+        try:
+            with self.conn.cursor(cursor_factory=DictCursor) as cur:
+                cur.execute("SELECT * FROM processing_job WHERE job_id = %s", (job_id,))
+                row = cur.fetchone()
+                return dict(row) if row else None
+        except Exception as e:
+            self.conn.rollback()
+            print(f"Error getting job: {e}")
+            return None
+
+    def get_active_job_for_camera(self, cam_id):
+        try:
+            with self.conn.cursor(cursor_factory=DictCursor) as cur:
+                cur.execute("SELECT * FROM processing_job WHERE cam_id = %s AND state IN ('queued', 'running')", (cam_id,))
+                row = cur.fetchone()
+                return dict(row) if row else None
+        except Exception as e:
+            self.conn.rollback()
+            print(f"Error getting active job: {e}")
+            return None
+
+    def list_jobs(self, state=None, limit=50):
+        try:
+            with self.conn.cursor(cursor_factory=DictCursor) as cur:
+                if state:
+                    cur.execute("SELECT * FROM processing_job WHERE state = %s ORDER BY created_at DESC LIMIT %s", (state, limit))
+                else:
+                    cur.execute("SELECT * FROM processing_job ORDER BY created_at DESC LIMIT %s", (limit,))
+                return [dict(row) for row in cur.fetchall()]
+        except Exception as e:
+            self.conn.rollback()
+            print(f"Error listing jobs: {e}")
+            return []
+
+    def claim_next_job(self, worker):
+        """
+        Atomically move the oldest queued job to 'running' for this worker, with a new
+        claim_token that identifies this claim in progress and finish writes.
+        SKIP LOCKED lets several worker processes claim jobs without blocking each other.
+        """
+        try:
+            with self.conn.cursor(cursor_factory=DictCursor) as cur:
+                cur.execute("""
+                    UPDATE processing_job
+                    SET state = 'running', worker = %s, claim_token = %s, started_at = COALESCE(started_at, NOW()),
+                        time_origin = COALESCE(time_origin, NOW()), updated_at = NOW()
+                    WHERE job_id = (
+                        SELECT job_id FROM processing_job
+                        WHERE state = 'queued' AND NOT cancel_requested
+                        ORDER BY created_at
+                        FOR UPDATE SKIP LOCKED
+                        LIMIT 1
+                    )
+                    RETURNING *
+                """, (worker, str(uuid.uuid4())))
+                row = cur.fetchone()
+            self.conn.commit()
+            return dict(row) if row else None
+        except Exception as e:
+            self.conn.rollback()
+            print(f"Error claiming job: {e}")
+            return None
+
+    def update_job_progress(self, job_id, frames_processed, shards_persisted, fps, resume_frame, claim_token):
+        """
+        Record progress (also the worker's heartbeat) of the claim with this claim_token.
+        Returns True if cancellation was requested, or None if the job is no longer
+        running under this claim (requeued, finished or claimed by another worker).
+        """
+        try:
+            with self.conn.cursor() as cur:
+                cur.execute("""
+                    UPDATE processing_job
+                    SET frames_processed = %s, shards_persisted = %s, fps = %s, resume_frame = %s, updated_at = NOW()
+                    WHERE job_id = %s AND claim_token = %s AND state = 'running'
+                    RETURNING cancel_requested
+                """, (frames_processed, shards_persisted, fps, resume_frame, job_id, claim_token))
+                row = cur.fetchone()
+            self.conn.commit()
+            if row is None:
+                return None
+            return bool(row[0])
+        except Exception as e:
+            self.conn.rollback()
+            print(f"Error updating job progress: {e}")
+            return False
+
+    def finish_job(self, job_id, state, error=None, claim_token=None):
+        """Set the final state; with a claim_token only while the job is still under that claim."""
+        try:
+            with self.conn.cursor() as cur:
+                cur.execute("""
+                    UPDATE processing_job
+                    SET state = %s, error = %s, finished_at = NOW(), updated_at = NOW()
+                    WHERE job_id = %s AND (%s IS NULL OR claim_token = %s)
+                """, (state, error, job_id, claim_token, claim_token))
+            self.conn.commit()
+        except Exception as e:
+            self.conn.rollback()
+            print(f"Error finishing job: {e}")
+
+    def request_job_cancel(self, job_id):
+        """
+        Flag a job for cancellation. A queued job is cancelled right away; a running
+        one stops at its next progress update. Returns the updated job row or None.
+        """
+        try:
+            with self.conn.cursor(cursor_factory=DictCursor) as cur:
+                cur.execute("""
+                    UPDATE processing_job
+                    SET cancel_requested = TRUE,
+                        state = CASE WHEN state = 'queued' THEN 'cancelled' ELSE state END,
+                        finished_at = CASE WHEN state = 'queued' THEN NOW() ELSE finished_at END,
+                        updated_at = NOW()
+                    WHERE job_id = %s
+                    RETURNING *
+                """, (job_id,))
+                row = cur.fetchone()
+            self.conn.commit()
+            return dict(row) if row else None
+        except Exception as e:
+            self.conn.rollback()
+            print(f"Error cancelling job: {e}")
+            return None
+
+    def requeue_stale_jobs(self, stale_seconds):
+        """
+        Put 'running' jobs whose worker stopped reporting (crash, deploy) back in the
+        queue; they resume from their resume_frame. Returns the number requeued.
+        """
+        try:
+            with self.conn.cursor() as cur:
+                cur.execute("""
+                    UPDATE processing_job
+                    SET state = CASE WHEN cancel_requested THEN 'cancelled' ELSE 'queued' END,
+                        worker = NULL, claim_token = NULL, updated_at = NOW()
+                    WHERE state = 'running' AND updated_at < NOW() - make_interval(secs => %s)
+                """, (stale_seconds,))
+                count = cur.rowcount
+            self.conn.commit()
+            return count
+        except Exception as e:
+            self.conn.rollback()
+            print(f"Error requeueing jobs: {e}")
+            return 0
+
+    @cached_analytics(store_wide=True)
     def get_demographics_stats(self, region_id):
         """
         Get gender distribution for a region.
@@ -382,24 +769,24 @@ class DataBaseOrm:
             if not region:
                 return []
             
-            rx1, rx2, ry1, ry2 = region['x1'], region['x2'], region['y1'], region['y2']
-            
             with self.conn.cursor(cursor_factory=DictCursor) as cur:
                 query = """
-                    SELECT t.gender, COUNT(DISTINCT t.tracking_id) as count
-                    FROM tracking t
-                    JOIN bounding_box b ON t.tracking_id = b.tracking_id AND t.video_shard = b.video_shard
-                    WHERE (b.x1 + b.x2) / 2 BETWEEN %s AND %s
-                    AND (b.y1 + b.y2) / 2 BETWEEN %s AND %s
+                    SELECT t.gender, COUNT(DISTINCT COALESCE(ta.canonical_id, t.tracking_id)) as count
+                    FROM region_presence rp
+                    JOIN tracking t ON t.tracking_id = rp.tracking_id AND t.video_shard = rp.video_shard
+                    LEFT JOIN track_alias ta ON ta.tracking_id = t.tracking_id
+                    WHERE rp.region_id = %s
                     GROUP BY t.gender
                 """
-                cur.execute(query, (rx1, rx2, ry1, ry2))
+                cur.execute(query, (region_id,))
                 return [dict(row) for row in cur.fetchall()]
         except Exception as e:
             self.conn.rollback()
             print(f"Error getting demographics: {e}")
+            analytics_cache.skip_store()
             return []
 
+    @cached_analytics
     def get_tracking_duration_stats(self, region_id):
         """
         Get average confusion time (tracking duration) stats.
@@ -409,22 +796,21 @@ class DataBaseOrm:
             if not region:
                 return []
             
-            rx1, rx2, ry1, ry2 = region['x1'], region['x2'], region['y1'], region['y2']
-            
             with self.conn.cursor(cursor_factory=DictCursor) as cur:
+                # Weighted by frames in the region, as the per-box join used to weight it
                 query = """
-                    SELECT t.video_shard, AVG(t.confusion_time) as avg_confusion_time
-                    FROM tracking t
-                    JOIN bounding_box b ON t.tracking_id = b.tracking_id AND t.video_shard = b.video_shard
-                    WHERE (b.x1 + b.x2) / 2 BETWEEN %s AND %s
-                    AND (b.y1 + b.y2) / 2 BETWEEN %s AND %s
+                    SELECT t.video_shard, SUM(t.confusion_time * rp.frames)::numeric / SUM(rp.frames) as avg_confusion_time
+                    FROM region_presence rp
+                    JOIN tracking t ON t.tracking_id = rp.tracking_id AND t.video_shard = rp.video_shard
+                    WHERE rp.region_id = %s
                     GROUP BY t.video_shard
                 """
-                cur.execute(query, (rx1, rx2, ry1, ry2))
+                cur.execute(query, (region_id,))
                 return [dict(row) for row in cur.fetchall()]
         except Exception as e:
             self.conn.rollback()
             print(f"Error getting tracking stats: {e}")
+            analytics_cache.skip_store()
             return []
 
     # --- Region Insights CRUD ---
@@ -471,7 +857,17 @@ class DataBaseOrm:
                                    public.camera 
                     CASCADE;
                 """)
+                # Tables of migration_reid.py and migration_heatmap_tiles.py, once they have run
+                for table in ("track_alias", "track_appearance", "heatmap_shard", "heatmap_day"):
+                    cur.execute("SELECT to_regclass(%s)", (f"public.{table}",))
+                    if cur.fetchone()[0]:
+                        cur.execute(f"TRUNCATE TABLE public.{table}")
+                # TRUNCATE does not fire row notifications, so tell other workers explicitly
+                region_catalog.notify(cur, "*")
                 self.conn.commit()
+                region_catalog.invalidate()
+                analytics_cache.clear()
+                reid_service.clear()
                 print("Database reset successfully.")
         except Exception as e:
             self.conn.rollback()
@@ -490,9 +886,10 @@ class DataBaseOrm:
                     rx1, rx2, ry1, ry2 = region['x1'], region['x2'], region['y1'], region['y2']
                     
                     query = """
-                        SELECT DATE(t.time) as date, COUNT(DISTINCT t.tracking_id) as footfall
+                        SELECT DATE(t.time) as date, COUNT(DISTINCT COALESCE(ta.canonical_id, t.tracking_id)) as footfall
                         FROM tracking t
                         JOIN bounding_box b ON t.tracking_id = b.tracking_id AND t.video_shard = b.video_shard
+                        LEFT JOIN track_alias ta ON ta.tracking_id = t.tracking_id
                         WHERE DATE(t.time) >= CURRENT_DATE - INTERVAL '%s days'
                         AND (b.x1 + b.x2) / 2 BETWEEN %s AND %s
                         AND (b.y1 + b.y2) / 2 BETWEEN %s AND %s
@@ -502,8 +899,9 @@ class DataBaseOrm:
                     cur.execute(query, (days, rx1, rx2, ry1, ry2))
                 else:
                     query = """
-                        SELECT DATE(time) as date, COUNT(DISTINCT tracking_id) as footfall
-                        FROM tracking
+                        SELECT DATE(time) as date, COUNT(DISTINCT COALESCE(ta.canonical_id, t.tracking_id)) as footfall
+                        FROM tracking t
+                        LEFT JOIN track_alias ta ON ta.tracking_id = t.tracking_id
                         WHERE DATE(time) >= CURRENT_DATE - INTERVAL '%s days'
                         GROUP BY DATE(time)
                         ORDER BY date DESC
@@ -526,9 +924,10 @@ class DataBaseOrm:
                     rx1, rx2, ry1, ry2 = region['x1'], region['x2'], region['y1'], region['y2']
                     
                     query = """
-                        SELECT DATE_TRUNC('week', t.time) as week, COUNT(DISTINCT t.tracking_id) as footfall
+                        SELECT DATE_TRUNC('week', t.time) as week, COUNT(DISTINCT COALESCE(ta.canonical_id, t.tracking_id)) as footfall
                         FROM tracking t
                         JOIN bounding_box b ON t.tracking_id = b.tracking_id AND t.video_shard = b.video_shard
+                        LEFT JOIN track_alias ta ON ta.tracking_id = t.tracking_id
                         WHERE DATE(t.time) >= CURRENT_DATE - INTERVAL '%s weeks'
                         AND (b.x1 + b.x2) / 2 BETWEEN %s AND %s
                         AND (b.y1 + b.y2) / 2 BETWEEN %s AND %s
@@ -538,8 +937,9 @@ class DataBaseOrm:
                     cur.execute(query, (weeks, rx1, rx2, ry1, ry2))
                 else:
                     query = """
-                        SELECT DATE_TRUNC('week', time) as week, COUNT(DISTINCT tracking_id) as footfall
-                        FROM tracking
+                        SELECT DATE_TRUNC('week', time) as week, COUNT(DISTINCT COALESCE(ta.canonical_id, t.tracking_id)) as footfall
+                        FROM tracking t
+                        LEFT JOIN track_alias ta ON ta.tracking_id = t.tracking_id
                         WHERE DATE(time) >= CURRENT_DATE - INTERVAL '%s weeks'
                         GROUP BY week
                         ORDER BY week DESC
@@ -562,9 +962,10 @@ class DataBaseOrm:
                     rx1, rx2, ry1, ry2 = region['x1'], region['x2'], region['y1'], region['y2']
                     
                     query = """
-                        SELECT DATE_TRUNC('month', t.time) as month, COUNT(DISTINCT t.tracking_id) as footfall
+                        SELECT DATE_TRUNC('month', t.time) as month, COUNT(DISTINCT COALESCE(ta.canonical_id, t.tracking_id)) as footfall
                         FROM tracking t
                         JOIN bounding_box b ON t.tracking_id = b.tracking_id AND t.video_shard = b.video_shard
+                        LEFT JOIN track_alias ta ON ta.tracking_id = t.tracking_id
                         WHERE DATE(t.time) >= CURRENT_DATE - INTERVAL '%s months'
                         AND (b.x1 + b.x2) / 2 BETWEEN %s AND %s
                         AND (b.y1 + b.y2) / 2 BETWEEN %s AND %s
@@ -574,8 +975,9 @@ class DataBaseOrm:
                     cur.execute(query, (months, rx1, rx2, ry1, ry2))
                 else:
                     query = """
-                        SELECT DATE_TRUNC('month', time) as month, COUNT(DISTINCT tracking_id) as footfall
-                        FROM tracking
+                        SELECT DATE_TRUNC('month', time) as month, COUNT(DISTINCT COALESCE(ta.canonical_id, t.tracking_id)) as footfall
+                        FROM tracking t
+                        LEFT JOIN track_alias ta ON ta.tracking_id = t.tracking_id
                         WHERE DATE(time) >= CURRENT_DATE - INTERVAL '%s months'
                         GROUP BY month
                         ORDER BY month DESC
@@ -587,66 +989,135 @@ class DataBaseOrm:
             print(f"Error getting monthly trends: {e}")
             return []
 
+    def save_heatmap_tiles(self, cam_id, shard_id, shard_tile, day_tiles):
+        """
+        Store a shard's heatmap tile and add it to the camera's daily rollups, in
+        one transaction. A shard already stored is skipped, so re-ingesting it
+        does not count its boxes twice.
+        """
+        try:
+            with self.conn.cursor() as cur:
+                cells, counts = shard_tile.to_bytes()
+                cur.execute("""
+                    INSERT INTO heatmap_shard (video_shard, cam_id, cells, counts, boxes)
+                    VALUES (%s, %s, %s, %s, %s)
+                    ON CONFLICT (video_shard) DO NOTHING
+                """, (shard_id, cam_id, psycopg2.Binary(cells), psycopg2.Binary(counts), shard_tile.boxes))
+                if cur.rowcount == 0:
+                    self.conn.rollback()
+                    return
+                for day, tile in sorted(day_tiles.items()):
+                    # Make sure the row exists, then merge under its row lock
+                    cur.execute("""
+                        INSERT INTO heatmap_day (cam_id, day, cells, counts, boxes)
+                        VALUES (%s, %s, '', '', 0)
+                        ON CONFLICT (cam_id, day) DO NOTHING
+                    """, (cam_id, day))
+                    cur.execute("SELECT cells, counts FROM heatmap_day WHERE cam_id = %s AND day = %s FOR UPDATE",
+                                (cam_id, day))
+                    merged = HeatmapTile.merge([HeatmapTile.from_bytes(*cur.fetchone()), tile])
+                    cells, counts = merged.to_bytes()
+                    cur.execute("""
+                        UPDATE heatmap_day SET cells = %s, counts = %s, boxes = %s
+                        WHERE cam_id = %s AND day = %s
+                    """, (psycopg2.Binary(cells), psycopg2.Binary(counts), merged.boxes, cam_id, day))
+            self.conn.commit()
+        except Exception as e:
+            self.conn.rollback()
+            print(f"Error saving heatmap tiles: {e}")
+
+    def get_heatmap_tiles(self, cam_id, shard_id=None):
+        """
+        Heatmap tiles of one shard, or every daily rollup of a camera. None if
+        the tiles can't be read (migration_heatmap_tiles.py has not run).
+        """
+        try:
+            with self.conn.cursor() as cur:
+                if shard_id:
+                    cur.execute("SELECT cells, counts FROM heatmap_shard WHERE video_shard = %s", (shard_id,))
+                else:
+                    cur.execute("SELECT cells, counts FROM heatmap_day WHERE cam_id = %s", (cam_id,))
+                return [HeatmapTile.from_bytes(cells, counts) for cells, counts in cur.fetchall()]
+        except Exception as e:
+            self.conn.rollback()
+            print(f"Error getting heatmap tiles: {e}")
+            return None
+
+    @cached_analytics
     def get_heatmap_data(self, region_id, shard_id=None, resolution=20):
-        """Generate heat map data based on bounding box density"""
+        """
+        Heat map of bounding box density over a region, summed from the heatmap
+        tiles stored at shard ingest (see heatmap_tiles) for the region's camera.
+        """
         try:
             region = self.get_region(region_id)
             if not region:
                 return {"grid_size": {"width": resolution, "height": resolution}, "region_bounds": {}, "cells": []}
-            
+
             rx1, rx2, ry1, ry2 = region['x1'], region['x2'], region['y1'], region['y2']
-            width = max(rx2 - rx1, 1)
-            height = max(ry2 - ry1, 1)
-            cell_width = max(width / resolution, 1)
-            cell_height = max(height / resolution, 1)
-            
-            with self.conn.cursor(cursor_factory=DictCursor) as cur:
-                if shard_id:
-                    query = """
-                        SELECT 
-                            LEAST(GREATEST(FLOOR(((x1 + x2) / 2.0 - %s) / %s), 0), %s - 1) as grid_x,
-                            LEAST(GREATEST(FLOOR(((y1 + y2) / 2.0 - %s) / %s), 0), %s - 1) as grid_y,
-                            COUNT(*) as density
-                        FROM bounding_box
-                        WHERE video_shard = %s
-                        AND (x1 + x2) / 2 BETWEEN %s AND %s
-                        AND (y1 + y2) / 2 BETWEEN %s AND %s
-                        GROUP BY grid_x, grid_y
-                        ORDER BY density DESC
-                    """
-                    cur.execute(query, (rx1, cell_width, resolution, ry1, cell_height, resolution, shard_id, rx1, rx2, ry1, ry2))
-                else:
-                    query = """
-                        SELECT 
-                            LEAST(GREATEST(FLOOR(((x1 + x2) / 2.0 - %s) / %s), 0), %s - 1) as grid_x,
-                            LEAST(GREATEST(FLOOR(((y1 + y2) / 2.0 - %s) / %s), 0), %s - 1) as grid_y,
-                            COUNT(*) as density
-                        FROM bounding_box
-                        WHERE (x1 + x2) / 2 BETWEEN %s AND %s
-                        AND (y1 + y2) / 2 BETWEEN %s AND %s
-                        GROUP BY grid_x, grid_y
-                        ORDER BY density DESC
-                    """
-                    cur.execute(query, (rx1, cell_width, resolution, ry1, cell_height, resolution, rx1, rx2, ry1, ry2))
-                
-                heatmap_data = [
-                    {
-                        "x": int(row['grid_x']), 
-                        "y": int(row['grid_y']), 
-                        "density": int(row['density'])
-                    } 
-                    for row in cur.fetchall()
-                ]
-                
-                return {
-                    "grid_size": {"width": resolution, "height": resolution},
-                    "region_bounds": {"x1": int(rx1), "x2": int(rx2), "y1": int(ry1), "y2": int(ry2)},
-                    "cells": heatmap_data
-                }
+            tiles = self.get_heatmap_tiles(region['cam_id'], shard_id)
+            if tiles is None:
+                # Raw boxes of every camera until migration_heatmap_tiles.py has run; not cached per camera
+                analytics_cache.skip_store()
+                heatmap_data = self._heatmap_cells_from_boxes(rx1, rx2, ry1, ry2, shard_id, resolution)
+            else:
+                heatmap_data = render_region(tiles, (rx1, rx2, ry1, ry2), resolution)
+
+            return {
+                "grid_size": {"width": resolution, "height": resolution},
+                "region_bounds": {"x1": int(rx1), "x2": int(rx2), "y1": int(ry1), "y2": int(ry2)},
+                "cells": heatmap_data
+            }
         except Exception as e:
             print(f"Error generating heatmap: {e}")
+            analytics_cache.skip_store()
             return {"grid_size": {"width": resolution, "height": resolution}, "region_bounds": {}, "cells": []}
 
+    def _heatmap_cells_from_boxes(self, rx1, rx2, ry1, ry2, shard_id, resolution):
+        """Heat map cells binned from the raw bounding boxes, for databases without heatmap tiles"""
+        width = max(rx2 - rx1, 1)
+        height = max(ry2 - ry1, 1)
+        cell_width = max(width / resolution, 1)
+        cell_height = max(height / resolution, 1)
+
+        with self.conn.cursor(cursor_factory=DictCursor) as cur:
+            if shard_id:
+                query = """
+                    SELECT 
+                        LEAST(GREATEST(FLOOR(((x1 + x2) / 2.0 - %s) / %s), 0), %s - 1) as grid_x,
+                        LEAST(GREATEST(FLOOR(((y1 + y2) / 2.0 - %s) / %s), 0), %s - 1) as grid_y,
+                        COUNT(*) as density
+                    FROM bounding_box
+                    WHERE video_shard = %s
+                    AND (x1 + x2) / 2 BETWEEN %s AND %s
+                    AND (y1 + y2) / 2 BETWEEN %s AND %s
+                    GROUP BY grid_x, grid_y
+                    ORDER BY density DESC
+                """
+                cur.execute(query, (rx1, cell_width, resolution, ry1, cell_height, resolution, shard_id, rx1, rx2, ry1, ry2))
+            else:
+                query = """
+                    SELECT 
+                        LEAST(GREATEST(FLOOR(((x1 + x2) / 2.0 - %s) / %s), 0), %s - 1) as grid_x,
+                        LEAST(GREATEST(FLOOR(((y1 + y2) / 2.0 - %s) / %s), 0), %s - 1) as grid_y,
+                        COUNT(*) as density
+                    FROM bounding_box
+                    WHERE (x1 + x2) / 2 BETWEEN %s AND %s
+                    AND (y1 + y2) / 2 BETWEEN %s AND %s
+                    GROUP BY grid_x, grid_y
+                    ORDER BY density DESC
+                """
+                cur.execute(query, (rx1, cell_width, resolution, ry1, cell_height, resolution, rx1, rx2, ry1, ry2))
+
+            return [
+                {
+                    "x": int(row['grid_x']), 
+                    "y": int(row['grid_y']), 
+                    "density": int(row['density'])
+                } 
+                for row in cur.fetchall()
+            ]
+
     # ==================== AI REPORT GENERATION ====================
     
     def get_recent_alerts(self, limit=50, region_id=None):
@@ -695,9 +1166,10 @@ class DataBaseOrm:
                 
                 # Total footfall
                 cur.execute("""
-                    SELECT COUNT(DISTINCT t.tracking_id) as total_footfall
+                    SELECT COUNT(DISTINCT COALESCE(ta.canonical_id, t.tracking_id)) as total_footfall
                     FROM tracking t
                     JOIN bounding_box b ON t.tracking_id = b.tracking_id AND t.video_shard = b.video_shard
+                    LEFT JOIN track_alias ta ON ta.tracking_id = t.tracking_id
                     WHERE t.time >= NOW() - INTERVAL %s
                     AND (b.x1 + b.x2) / 2 BETWEEN %s AND %s
                     AND (b.y1 + b.y2) / 2 BETWEEN %s AND %s
@@ -719,9 +1191,10 @@ class DataBaseOrm:
                 
                 # Gender distribution
                 cur.execute("""
-                    SELECT t.gender, COUNT(DISTINCT t.tracking_id) as count
+                    SELECT t.gender, COUNT(DISTINCT COALESCE(ta.canonical_id, t.tracking_id)) as count
                     FROM tracking t
                     JOIN bounding_box b ON t.tracking_id = b.tracking_id AND t.video_shard = b.video_shard
+                    LEFT JOIN track_alias ta ON ta.tracking_id = t.tracking_id
                     WHERE t.time >= NOW() - INTERVAL %s
                     AND (b.x1 + b.x2) / 2 BETWEEN %s AND %s
                     AND (b.y1 + b.y2) / 2 BETWEEN %s AND %s
@@ -731,9 +1204,10 @@ class DataBaseOrm:
                 
                 # Peak hours (if we have hourly data)
                 cur.execute("""
-                    SELECT EXTRACT(HOUR FROM t.time) as hour, COUNT(DISTINCT t.tracking_id) as count
+                    SELECT EXTRACT(HOUR FROM t.time) as hour, COUNT(DISTINCT COALESCE(ta.canonical_id, t.tracking_id)) as count
                     FROM tracking t
                     JOIN bounding_box b ON t.tracking_id = b.tracking_id AND t.video_shard = b.video_shard
+                    LEFT JOIN track_alias ta ON ta.tracking_id = t.tracking_id
                     WHERE t.time >= NOW() - INTERVAL %s
                     AND (b.x1 + b.x2) / 2 BETWEEN %s AND %s
                     AND (b.y1 + b.y2) / 2 BETWEEN %s AND %s
@@ -926,8 +1400,9 @@ Respond in this exact JSON format:
                 
                 # Today's footfall
                 cur.execute(f"""
-                    SELECT COUNT(DISTINCT tracking_id) as today_footfall
+                    SELECT COUNT(DISTINCT COALESCE(ta.canonical_id, t.tracking_id)) as today_footfall
                     FROM tracking t
+                    LEFT JOIN track_alias ta ON ta.tracking_id = t.tracking_id
                     {cam_filter}
                     {"AND" if cam_filter else "WHERE"} DATE(time) = CURRENT_DATE
                 """, params)
@@ -936,8 +1411,9 @@ Respond in this exact JSON format:
                 
                 # Yesterday's footfall for comparison
                 cur.execute(f"""
-                    SELECT COUNT(DISTINCT tracking_id) as yesterday_footfall
+                    SELECT COUNT(DISTINCT COALESCE(ta.canonical_id, t.tracking_id)) as yesterday_footfall
                     FROM tracking t
+                    LEFT JOIN track_alias ta ON ta.tracking_id = t.tracking_id
                     {cam_filter}
                     {"AND" if cam_filter else "WHERE"} DATE(time) = CURRENT_DATE - INTERVAL '1 day'
                 """, params)
@@ -946,8 +1422,9 @@ Respond in this exact JSON format:
                 
                 # Week's footfall
                 cur.execute(f"""
-                    SELECT COUNT(DISTINCT tracking_id) as week_footfall
+                    SELECT COUNT(DISTINCT COALESCE(ta.canonical_id, t.tracking_id)) as week_footfall
                     FROM tracking t
+                    LEFT JOIN track_alias ta ON ta.tracking_id = t.tracking_id
                     {cam_filter}
                     {"AND" if cam_filter else "WHERE"} time >= NOW() - INTERVAL '7 days'
                 """, params)
@@ -963,19 +1440,18 @@ Respond in this exact JSON format:
                 alerts = cur.fetchone()
                 alert_count = alerts['alert_count'] if alerts else 0
                 
-                # Busiest region
-                cur.execute("""
-                    SELECT r.region_name, COUNT(DISTINCT t.tracking_id) as visitors
-                    FROM tracking t
-                    JOIN bounding_box b ON t.tracking_id = b.tracking_id AND t.video_shard = b.video_shard
-                    JOIN region_defined r ON 
-                        (b.x1 + b.x2) / 2 BETWEEN r.x1 AND r.x2
-                        AND (b.y1 + b.y2) / 2 BETWEEN r.y1 AND r.y2
-                    WHERE t.time >= NOW() - INTERVAL '1 day'
-                    GROUP BY r.region_name
+                # Busiest region, from the per-region presence rows (own camera, real polygon)
+                cur.execute(f"""
+                    SELECT r.region_name, COUNT(DISTINCT COALESCE(ta.canonical_id, rp.tracking_id)) as visitors
+                    FROM region_presence rp
+                    JOIN region_defined r ON r.region_id = rp.region_id
+                    LEFT JOIN track_alias ta ON ta.tracking_id = rp.tracking_id
+                    WHERE rp.last_seen >= NOW() - INTERVAL '1 day'
+                    {"AND r.cam_id = %s" if cam_id else ""}
+                    GROUP BY r.region_id, r.region_name
                     ORDER BY visitors DESC
                     LIMIT 1
-                """)
+                """, params)
                 busiest = cur.fetchone()
                 
                 # Calculate change percentage
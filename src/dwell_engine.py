@@ -0,0 +1,93 @@
+import numpy as np
+
+
+class DwellEngine:
+    """
+    Vectorized region-membership and dwell-time tracking for one camera.
+
+    Regions come compiled as a RegionIndex (see region_index.py). On every
+    frame all track centers are resolved against the index in one array op,
+    and dwell start times / alert flags live in (slots, R) arrays indexed by
+    a per-track slot instead of nested dicts.
+
+    Alert semantics match the original per-region loop in frame_sender:
+    - a track's timer for a region starts on the first frame it is inside it
+    - an alert fires once when (frame_time - start) > alert_threshold
+    - leaving a region it is being timed in resets both the timer and the alert flag
+    - a track missing from a frame loses its timers but keeps its alert flags
+    """
+
+    INITIAL_SLOTS = 64
+
+    def __init__(self, region_index, alert_threshold):
+        self.alert_threshold = float(alert_threshold)
+        self.index = region_index
+        self.regions = self.index.regions
+        num_regions = len(self.regions)
+
+        self._slots = {}  # track_id -> row in the state arrays
+        self._free_slots = []
+        self._start = np.full((self.INITIAL_SLOTS, num_regions), np.nan)
+        self._alerted = np.zeros((self.INITIAL_SLOTS, num_regions), dtype=bool)
+
+    def _slot_for(self, track_id):
+        slot = self._slots.get(track_id)
+        if slot is not None:
+            return slot
+        if self._free_slots:
+            slot = self._free_slots.pop()
+        else:
+            slot = len(self._slots)
+            if slot >= self._start.shape[0]:
+                grow = self._start.shape[0]
+                self._start = np.vstack([self._start, np.full((grow, self._start.shape[1]), np.nan)])
+                self._alerted = np.vstack([self._alerted, np.zeros((grow, self._alerted.shape[1]), dtype=bool)])
+        self._slots[track_id] = slot
+        return slot
+
+    def _release_absent(self, active_slots):
+        absent = [(t_id, slot) for t_id, slot in self._slots.items() if slot not in active_slots]
+        for t_id, slot in absent:
+            self._start[slot] = np.nan
+            # Only recycle the slot once nothing about the track is left to remember
+            if not self._alerted[slot].any():
+                del self._slots[t_id]
+                self._free_slots.append(slot)
+
+    def update(self, tracks):
+        """
+        Advance dwell state by one frame.
+        tracks: list of dicts with 'track_id', 'bbox' [x1, y1, x2, y2] and 'frame_timestamp'.
+        Returns a list of (track_id, region, duration) for alerts that fire on this frame,
+        in track order then region order.
+        """
+        if not self.regions:
+            return []
+
+        rows = np.fromiter((self._slot_for(t['track_id']) for t in tracks), dtype=np.intp, count=len(tracks))
+        self._release_absent(set(rows.tolist()))
+        if not tracks:
+            return []
+
+        times = np.array([t['frame_timestamp'] for t in tracks], dtype=np.float64)[:, None]
+        inside = self.index.assign_boxes([t['bbox'] for t in tracks])  # (N, R)
+
+        start = self._start[rows]
+        alerted = self._alerted[rows]
+
+        timing = ~np.isnan(start)
+        entering = inside & ~timing
+        leaving = ~inside & timing
+        start = np.where(entering, times, start)
+        duration = times - start
+        fire = inside & ~entering & (duration > self.alert_threshold) & ~alerted
+
+        alerted = (alerted | fire) & ~leaving
+        start = np.where(inside, start, np.nan)
+        self._start[rows] = start
+        self._alerted[rows] = alerted
+
+        events = []
+        for track_idx, region_idx in zip(*np.nonzero(fire)):
+            events.append((tracks[track_idx]['track_id'], self.regions[region_idx], float(duration[track_idx, region_idx])))
+        return events
@@ -0,0 +1,254 @@
+import argparse
+import os
+import statistics
+import sys
+import time
+import numpy as np
+import torch
+from torch.nn import Module, Conv2d, MaxPool2d, Linear
+
+GENDER_CLASSES = ['Male', 'Female'] # 0: man, 1: woman (mapped to Male/Female)
+GENDER_INPUT_SIZE = 64  # crops are resized to GENDER_INPUT_SIZE x GENDER_INPUT_SIZE RGB
+
+# Optimizations applied by load_gender_classifier, comma-separated (empty = eager fp32):
+#   int8          dynamic int8 quantization of the linear layers (fc1 holds most weights and FLOPs)
+#   channels_last NHWC memory format for the convolutions
+#   torchscript   trace, freeze and cache the result next to the weights (fast reload)
+#   compile       torch.compile; compiles at load time, so loading is slower
+GENDER_CNN_OPTIMIZATIONS = ""
+GENDER_CNN_OPTIONS = ("int8", "channels_last", "torchscript", "compile")
+WARMUP_CALLS = 2  # TorchScript's profiling executor specialises on its first calls
+BENCHMARK_BATCH_SIZES = (1, 2, 4, 8, 16, 32, 64)
+
+# --- CNN Model Definition ---
+class CnnBase(Module):
+    def __init__(self):
+        super(CnnBase , self).__init__()
+        self.conv1 = Conv2d(3,16,3,padding=1)
+        self.pool = MaxPool2d(2,2)
+        self.conv2 = Conv2d(16,32,3,padding=1)
+        self.conv3 = Conv2d(32,64,3,padding=1)
+        self.fc1 = Linear(64*8*8 , 512)
+        self.fc2 = Linear(512 , 2)
+
+    def forward(self,x):
+        x = self.pool(torch.relu(self.conv1(x)))
+        x = self.pool(torch.relu(self.conv2(x)))
+        x = self.pool(torch.relu(self.conv3(x)))
+        x = x.reshape(-1 , 64*8*8)
+        x = torch.relu(self.fc1(x))
+        x = self.fc2(x)
+        return x
+
+
+class ChannelsLastInput(Module):
+    """Feeds the wrapped model NHWC tensors, so its convolutions run in channels-last kernels."""
+
+    def __init__(self, model):
+        super().__init__()
+        self.model = model
+
+    def forward(self, x):
+        return self.model(x.contiguous(memory_format=torch.channels_last))
+
+
+def parse_optimizations(optimizations):
+    """'int8,torchscript' -> a sorted tuple of known option names."""
+    if isinstance(optimizations, str):
+        optimizations = optimizations.split(",")
+    options = sorted({o.strip() for o in optimizations or () if o.strip()})
+    unknown = [o for o in options if o not in GENDER_CNN_OPTIONS]
+    if unknown:
+        raise ValueError(f"Unknown Gender CNN optimization(s): {', '.join(unknown)}")
+    if "torchscript" in options and "compile" in options:
+        raise ValueError("Choose either torchscript or compile")
+    return tuple(options)
+
+
+def optimize_gender_model(model, optimizations):
+    """Apply the parsed optimizations to an eval-mode CnnBase."""
+    if "int8" in optimizations:
+        model = torch.ao.quantization.quantize_dynamic(model, {Linear}, dtype=torch.qint8)
+    if "channels_last" in optimizations:
+        model = ChannelsLastInput(model.to(memory_format=torch.channels_last))
+    model.eval()
+    example = torch.zeros(1, 3, GENDER_INPUT_SIZE, GENDER_INPUT_SIZE)
+    if "torchscript" in optimizations:
+        with torch.no_grad():
+            model = torch.jit.freeze(torch.jit.trace(model, example))
+    elif "compile" in optimizations:
+        model = torch.compile(model, dynamic=True)
+    return model
+
+
+def _warm_up(model):
+    example = torch.zeros(1, 3, GENDER_INPUT_SIZE, GENDER_INPUT_SIZE)
+    with torch.no_grad():
+        for _ in range(WARMUP_CALLS):
+            model(example)
+
+
+def load_gender_classifier(weights_path, optimizations=None):
+    """
+    CnnBase with its weights, in eval mode, optimized as GENDER_CNN_OPTIMIZATIONS
+    (or the optimizations given) says. TorchScript variants are cached next to the
+    weights, and optimized models are warmed up here rather than on the first frame.
+    """
+    if not os.path.exists(weights_path):
+        print(f"Warning: CNN weights not found at {weights_path}")
+        return None
+
+    try:
+        options = parse_optimizations(GENDER_CNN_OPTIMIZATIONS if optimizations is None else optimizations)
+    except ValueError as e:
+        print(f"Error: {e}; loading the eager Gender CNN")
+        options = ()
+
+    cache_path = None
+    if "torchscript" in options:
+        cache_path = f"{os.path.splitext(weights_path)[0]}.{'-'.join(options)}.ts"
+        if os.path.exists(cache_path) and os.path.getmtime(cache_path) >= os.path.getmtime(weights_path):
+            try:
+                model = torch.jit.load(cache_path, map_location="cpu")
+                _warm_up(model)
+                print(f"Loaded Gender CNN ({', '.join(options)}) from {cache_path}")
+                return model
+            except Exception as e:
+                print(f"Error loading cached Gender CNN, rebuilding: {e}")
+
+    model = CnnBase()
+    try:
+        state_dict = torch.load(weights_path, map_location="cpu")
+        model.load_state_dict(state_dict)
+        model.eval()
+        print(f"Loaded Gender CNN from {weights_path}")
+    except Exception as e:
+        print(f"Error loading CNN weights: {e}")
+        return None
+    if not options:
+        return model
+
+    try:
+        model = optimize_gender_model(model, options)
+        if cache_path:
+            tmp_path = f"{cache_path}.{os.getpid()}.tmp"
+            torch.jit.save(model, tmp_path)
+            os.replace(tmp_path, cache_path)
+        _warm_up(model)
+        print(f"Optimized Gender CNN: {', '.join(options)}")
+    except Exception as e:
+        print(f"Error optimizing Gender CNN, using the eager model: {e}")
+        model = CnnBase()
+        model.load_state_dict(state_dict)
+        model.eval()
+    return model
+
+
+def check_accuracy(reference, candidate, crops):
+    """
+    Compare two models on the same (N, 3, 64, 64) crops: prediction agreement,
+    logit drift and softmax drift of the candidate against the reference.
+    """
+    batch = torch.from_numpy(np.ascontiguousarray(crops, dtype=np.float32))
+    with torch.no_grad():
+        expected = reference(batch)
+        actual = candidate(batch)
+    return {
+        "crops": len(crops),
+        "agreement": round(float((expected.argmax(1) == actual.argmax(1)).float().mean()), 4),
+        "logit_max_abs_diff": round(float((expected - actual).abs().max()), 6),
+        "prob_max_abs_diff": round(float((expected.softmax(1) - actual.softmax(1)).abs().max()), 6),
+    }
+
+
+def benchmark_crops(model, crops, batch_sizes=BENCHMARK_BATCH_SIZES, seconds=1.0):
+    """Crops per second at each batch size, from repeated calls for about 'seconds' each."""
+    pool = torch.from_numpy(np.ascontiguousarray(crops, dtype=np.float32))
+    results = {}
+    with torch.no_grad():
+        for batch_size in batch_sizes:
+            batch = pool[torch.arange(batch_size) % len(pool)]
+            model(batch)  # shape warm-up
+            calls = []
+            deadline = time.perf_counter() + seconds
+            while time.perf_counter() < deadline or len(calls) < 3:
+                started = time.perf_counter()
+                model(batch)
+                calls.append(time.perf_counter() - started)
+            results[batch_size] = {
+                "crops_per_second": round(batch_size / statistics.median(calls), 1),
+                "median_ms": round(statistics.median(calls) * 1000, 3),
+            }
+    return results
+
+
+def measure_load(weights_path, optimizations, cold=False):
+    """(model, load seconds, first call ms, cached) for one variant; cold drops its TorchScript cache first."""
+    options = parse_optimizations(optimizations)
+    cache_path = f"{os.path.splitext(weights_path)[0]}.{'-'.join(options)}.ts"
+    if cold and os.path.exists(cache_path):
+        os.remove(cache_path)
+    started = time.perf_counter()
+    model = load_gender_classifier(weights_path, options)
+    loaded = time.perf_counter() - started
+    example = torch.zeros(1, 3, GENDER_INPUT_SIZE, GENDER_INPUT_SIZE)
+    started = time.perf_counter()
+    with torch.no_grad():
+        model(example)
+    return model, loaded, (time.perf_counter() - started) * 1000, os.path.exists(cache_path)
+
+
+if __name__ == "__main__":
+    import json
+    from benchmark import load_corpus, BENCHMARK_CORPUS
+    from inference_backends import load_detector, _sample_frames, _crops
+
+    parser = argparse.ArgumentParser(description="Accuracy and speed of Gender CNN variants against eager fp32")
+    parser.add_argument("--cnn-weights", default="../train/cnn_weights.pth")
+    parser.add_argument("--variants", default="int8;channels_last;torchscript;int8,torchscript;int8,channels_last,torchscript",
+                        help="semicolon-separated variants, each a comma-separated optimization list")
+    parser.add_argument("--model", default="yolo12s.pt", help="detector used to cut crops from the sample shards")
+    parser.add_argument("--corpus", default=BENCHMARK_CORPUS)
+    parser.add_argument("--videos", type=int, default=5)
+    parser.add_argument("--frames-per-video", type=int, default=10)
+    parser.add_argument("--threads", type=int, default=None)
+    parser.add_argument("--min-agreement", type=float, default=0.99)
+    parser.add_argument("--output", default=None, help="write the results as JSON")
+    args = parser.parse_args()
+
+    if args.threads:
+        torch.set_num_threads(args.threads)
+    detector = load_detector(args.model)
+    crops = [c for frame in _sample_frames(load_corpus(args.corpus, args.videos), args.frames_per_video)
+             for c in [_crops(frame, detector.predict(frame, classes=[0], verbose=False)[0].boxes.xyxy.cpu().numpy())]
+             if c is not None]
+    if not crops:
+        print("No person crops found in the corpus")
+        sys.exit(1)
+    crops = np.concatenate(crops)
+    print(f"{len(crops)} crops from the sample shards")
+
+    reference, load_s, first_ms, _ = measure_load(args.cnn_weights, "")
+    results = {"eager": {"load_s": round(load_s, 3), "first_call_ms": round(first_ms, 2),
+                         "throughput": benchmark_crops(reference, crops)}}
+    passed = True
+    for variant in [v for v in args.variants.split(";") if v]:
+        model, load_s, first_ms, cached = measure_load(args.cnn_weights, variant, cold=True)
+        accuracy = check_accuracy(reference, model, crops)
+        passed = passed and accuracy["agreement"] >= args.min_agreement
+        results[variant] = {"load_s": round(load_s, 3), "first_call_ms": round(first_ms, 2), "cached": cached,
+                            "accuracy": accuracy, "throughput": benchmark_crops(model, crops)}
+        if cached:
+            # Second load comes from the TorchScript cache
+            _, reload_s, reload_first_ms, _ = measure_load(args.cnn_weights, variant)
+            results[variant].update(reload_s=round(reload_s, 3), reload_first_call_ms=round(reload_first_ms, 2))
+
+    for variant, result in results.items():
+        rates = ", ".join(f"{b}: {r['crops_per_second']}" for b, r in result["throughput"].items())
+        print(f"{variant}: load {result['load_s']}s, first call {result['first_call_ms']} ms, "
+              f"agreement {result.get('accuracy', {}).get('agreement', 1.0)}, crops/s by batch {{{rates}}}")
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+    print("PASS" if passed else "FAIL")
+    sys.exit(0 if passed else 1)
@@ -0,0 +1,116 @@
+from datetime import date
+import numpy as np
+
+HEATMAP_CELL_PX = 8  # side of a stored grid cell in frame pixels
+HEATMAP_GRID_COLS = 4096 // HEATMAP_CELL_PX  # frames up to 4096 px wide; wider boxes clamp to the last column
+
+
+class HeatmapTile:
+    """
+    Box-centre counts on the fixed HEATMAP_CELL_PX grid of a camera, stored
+    sparsely: flat cell indices (row * HEATMAP_GRID_COLS + col) and their counts.
+    Tiles of any number of shards or days add up by concatenation.
+    """
+
+    __slots__ = ("cells", "counts")
+
+    def __init__(self, cells, counts):
+        self.cells = np.asarray(cells, dtype=np.int32)
+        self.counts = np.asarray(counts, dtype=np.uint32)
+
+    @classmethod
+    def from_centres(cls, cx, cy):
+        col = np.clip(np.asarray(cx) // HEATMAP_CELL_PX, 0, HEATMAP_GRID_COLS - 1).astype(np.int64)
+        row = np.maximum(np.asarray(cy) // HEATMAP_CELL_PX, 0).astype(np.int64)
+        cells, counts = np.unique(row * HEATMAP_GRID_COLS + col, return_counts=True)
+        return cls(cells, counts)
+
+    @classmethod
+    def from_bytes(cls, cells, counts):
+        return cls(np.frombuffer(bytes(cells), dtype=np.int32), np.frombuffer(bytes(counts), dtype=np.uint32))
+
+    def to_bytes(self):
+        return self.cells.tobytes(), self.counts.tobytes()
+
+    @classmethod
+    def merge(cls, tiles):
+        cells = np.concatenate([t.cells for t in tiles])
+        counts = np.concatenate([t.counts for t in tiles])
+        unique, inverse = np.unique(cells, return_inverse=True)
+        return cls(unique, np.bincount(inverse, weights=counts, minlength=len(unique)))
+
+    @property
+    def boxes(self):
+        return int(self.counts.sum())
+
+    def __len__(self):
+        return len(self.cells)
+
+
+def shard_tiles(data):
+    """
+    Tiles of one shard as yielded by process_video_shards: (whole shard tile,
+    {day: tile}) for the camera's daily rollups.
+    """
+    if not data:
+        return None, {}
+    boxes = np.array([d["bbox"] for d in data], dtype=np.float64).astype(np.int64)
+    # Integer centres, the same as (x1 + x2) / 2 on the stored integer box columns
+    cx = (boxes[:, 0] + boxes[:, 2]) // 2
+    cy = (boxes[:, 1] + boxes[:, 3]) // 2
+    days = np.array([d["timestamp"][:10] for d in data])  # 'YYYY-MM-DD'
+
+    day_tiles = {}
+    for day in np.unique(days):
+        mask = days == day
+        day_tiles[date.fromisoformat(str(day))] = HeatmapTile.from_centres(cx[mask], cy[mask])
+    return HeatmapTile.from_centres(cx, cy), day_tiles
+
+
+def _axis_weights(first_cell, cells, low, high, resolution):
+    """
+    (cells, resolution) share of the pixel positions of each of cells stored
+    cells from first_cell on, along one axis, that falls in each output cell of
+    the inclusive pixel range [low, high].
+    """
+    starts = (first_cell + np.arange(cells)) * HEATMAP_CELL_PX
+    cell_size = max(max(high - low, 1) / resolution, 1)
+    edges = np.minimum(low + np.arange(resolution + 1) * cell_size, high + 1)
+    edges[-1] = high + 1
+    edges = np.ceil(edges)  # first whole pixel of each output cell
+    left = np.maximum(starts[:, None], edges[None, :-1])
+    right = np.minimum(starts[:, None] + HEATMAP_CELL_PX, edges[None, 1:])
+    return np.maximum(right - left, 0) / HEATMAP_CELL_PX
+
+
+def render_region(tiles, bounds, resolution):
+    """
+    Sum the tiles and resample them onto a resolution x resolution grid over
+    bounds (x1, x2, y1, y2), binning like get_heatmap_data did over raw box
+    centres. A stored cell's count is split between the output cells it
+    overlaps, in proportion to the overlap. Returns the cells with a count,
+    densest first.
+    """
+    rx1, rx2, ry1, ry2 = (int(v) for v in bounds)
+    if not tiles or rx2 < 0 or ry2 < 0:
+        return []
+    # Dense window of the stored grid under the region
+    col0, col1 = max(rx1, 0) // HEATMAP_CELL_PX, min(rx2 // HEATMAP_CELL_PX, HEATMAP_GRID_COLS - 1)
+    row0, row1 = max(ry1, 0) // HEATMAP_CELL_PX, ry2 // HEATMAP_CELL_PX
+    if col1 < col0:
+        return []
+    cols, rows = col1 - col0 + 1, row1 - row0 + 1
+    cells = np.concatenate([t.cells for t in tiles]).astype(np.int64)
+    counts = np.concatenate([t.counts for t in tiles])
+    col, row = cells % HEATMAP_GRID_COLS - col0, cells // HEATMAP_GRID_COLS - row0
+    inside = (col >= 0) & (col < cols) & (row >= 0) & (row < rows)
+    window = np.bincount(row[inside] * cols + col[inside], weights=counts[inside],
+                         minlength=rows * cols).reshape(rows, cols)
+
+    wx = _axis_weights(col0, cols, rx1, rx2, resolution)
+    wy = _axis_weights(row0, rows, ry1, ry2, resolution)
+    density = np.rint(wy.T @ window @ wx).astype(np.int64).ravel()
+
+    filled = np.flatnonzero(density)
+    filled = filled[np.argsort(-density[filled], kind="stable")]
+    return [{"x": int(i % resolution), "y": int(i // resolution), "density": int(density[i])} for i in filled]
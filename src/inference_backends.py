@@ -0,0 +1,408 @@
+import argparse
+import glob
+import os
+import shutil
+import sys
+from contextlib import contextmanager
+import numpy as np
+import cv2
+
+BACKEND_TORCH = "torch"
+BACKEND_ONNXRUNTIME = "onnxruntime"
+BACKEND_OPENVINO = "openvino"
+INFERENCE_BACKENDS = (BACKEND_TORCH, BACKEND_ONNXRUNTIME, BACKEND_OPENVINO)
+PRECISION_FP32 = "fp32"
+PRECISION_INT8 = "int8"
+
+# Defaults for process_video_shards; the exported models are cached next to the weights
+INFERENCE_BACKEND = BACKEND_TORCH
+INFERENCE_PRECISION = PRECISION_FP32
+INFERENCE_THREADS = None  # None = the runtime's default (one per physical core)
+DETECTOR_IMGSZ = 640  # exported detectors have a fixed input size
+ONNX_OPSET = 17
+DETECTOR_INT8_CALIBRATION = "coco8.yaml"  # dataset ultralytics calibrates int8 OpenVINO exports with
+
+# verify_backend() tolerances, per precision
+EQUIVALENCE_MIN_BOX_IOU = 0.9  # a detection matches the PyTorch one at or above this IoU
+EQUIVALENCE_TOLERANCES = {
+    PRECISION_FP32: {"box_match_rate": 0.98, "gender_agreement": 0.99, "logit_max_abs_diff": 1e-3},
+    PRECISION_INT8: {"box_match_rate": 0.90, "gender_agreement": 0.95, "logit_max_abs_diff": None},
+}
+
+
+def _is_fresh(path, source_path):
+    """An exported file is reused while it is newer than the weights it came from."""
+    return os.path.exists(path) and os.path.getmtime(path) >= os.path.getmtime(source_path)
+
+
+def _replace(produced, target):
+    """Move an export into place; exports are directories for OpenVINO."""
+    if os.path.isdir(target):
+        shutil.rmtree(target)
+    os.replace(produced, target)
+
+
+@contextmanager
+def _export_lock(target):
+    """
+    Exclusive lock on target + '.lock' across processes (batch chunks and job
+    workers may load the same backend at once). fcntl is POSIX-only; elsewhere
+    the per-process export directory alone keeps exports apart.
+    """
+    try:
+        import fcntl
+    except ImportError:
+        yield
+        return
+    with open(f"{target}.lock", "w") as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock, fcntl.LOCK_UN)
+
+
+# --- Gender CNN ---
+
+def export_gender_onnx(weights_path, precision=PRECISION_FP32):
+    """
+    Export CnnBase weights to ONNX (dynamic batch) and, for int8, quantize the
+    weights of its linear layers with ONNX Runtime's dynamic quantization.
+    Returns the .onnx path, or None if the weights can't be loaded.
+    """
+    import torch
+    from gender_classifier import load_gender_classifier, GENDER_INPUT_SIZE
+
+    root = os.path.splitext(weights_path)[0]
+    fp32_path = f"{root}.{PRECISION_FP32}.onnx"
+    if not _is_fresh(fp32_path, weights_path):
+        model = load_gender_classifier(weights_path)
+        if model is None:
+            return None
+        tmp_path = f"{fp32_path}.{os.getpid()}.tmp"
+        dummy = torch.zeros(1, 3, GENDER_INPUT_SIZE, GENDER_INPUT_SIZE)
+        torch.onnx.export(model, dummy, tmp_path, input_names=["crops"], output_names=["logits"],
+                          dynamic_axes={"crops": {0: "batch"}, "logits": {0: "batch"}}, opset_version=ONNX_OPSET)
+        _replace(tmp_path, fp32_path)
+        print(f"Exported Gender CNN to {fp32_path}")
+    if precision != PRECISION_INT8:
+        return fp32_path
+
+    int8_path = f"{root}.{PRECISION_INT8}.onnx"
+    if not _is_fresh(int8_path, fp32_path):
+        from onnxruntime.quantization import quantize_dynamic, QuantType
+        tmp_path = f"{int8_path}.{os.getpid()}.tmp"
+        quantize_dynamic(fp32_path, tmp_path, weight_type=QuantType.QInt8)
+        _replace(tmp_path, int8_path)
+        print(f"Quantized Gender CNN to {int8_path}")
+    return int8_path
+
+
+class TorchGenderBackend:
+    """Eager PyTorch CnnBase."""
+
+    name = BACKEND_TORCH
+
+    def __init__(self, model, threads=None):
+        import torch
+        self._torch = torch
+        self.model = model
+        if threads:
+            torch.set_num_threads(threads)
+
+    def predict(self, crops):
+        """crops: float32 (N, 3, 64, 64) RGB in [0, 1]. Returns (N, 2) logits."""
+        with self._torch.no_grad():
+            return self.model(self._torch.from_numpy(np.ascontiguousarray(crops, dtype=np.float32))).numpy()
+
+
+class OnnxGenderBackend:
+    """CnnBase exported to ONNX, run by ONNX Runtime on the CPU."""
+
+    name = BACKEND_ONNXRUNTIME
+
+    def __init__(self, onnx_path, threads=None):
+        import onnxruntime as ort
+        options = ort.SessionOptions()
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        options.inter_op_num_threads = 1
+        if threads:
+            options.intra_op_num_threads = threads
+        self.session = ort.InferenceSession(onnx_path, options, providers=["CPUExecutionProvider"])
+        self.input_name = self.session.get_inputs()[0].name
+
+    def predict(self, crops):
+        return self.session.run(None, {self.input_name: np.ascontiguousarray(crops, dtype=np.float32)})[0]
+
+
+class OpenVinoGenderBackend:
+    """CnnBase exported to ONNX, compiled by OpenVINO for the CPU."""
+
+    name = BACKEND_OPENVINO
+
+    def __init__(self, onnx_path, threads=None, precision=PRECISION_FP32):
+        import openvino as ov
+        core = ov.Core()
+        model = core.read_model(onnx_path)
+        if precision == PRECISION_INT8:
+            try:
+                import nncf
+                model = nncf.compress_weights(model)  # int8 weights
+            except ImportError:
+                print("Warning: int8 OpenVINO needs nncf; running the Gender CNN in fp32")
+        config = {"PERFORMANCE_HINT": "LATENCY"}
+        if threads:
+            config["INFERENCE_NUM_THREADS"] = threads
+        self.compiled = core.compile_model(model, "CPU", config)
+        # An infer request is not thread-safe; each pipeline loads its own backend
+        self.request = self.compiled.create_infer_request()
+        self.output = self.compiled.output(0)
+
+    def predict(self, crops):
+        results = self.request.infer({0: np.ascontiguousarray(crops, dtype=np.float32)})
+        return np.array(results[self.output])
+
+
+def load_gender_backend(weights_path, backend=None, precision=None, threads=None):
+    """
+    Gender CNN on the chosen runtime, with a predict(crops) -> logits method.
+    Falls back to PyTorch when the runtime isn't installed; None if there are no weights.
+    """
+    from gender_classifier import load_gender_classifier, parse_optimizations, GENDER_CNN_OPTIMIZATIONS
+
+    backend = backend or INFERENCE_BACKEND
+    precision = precision or INFERENCE_PRECISION
+    threads = threads or INFERENCE_THREADS
+    if backend != BACKEND_TORCH:
+        if not os.path.exists(weights_path):
+            print(f"Warning: CNN weights not found at {weights_path}")
+            return None
+        try:
+            # OpenVINO compresses the fp32 graph itself; ONNX Runtime runs the quantized export
+            onnx_path = export_gender_onnx(weights_path, precision if backend == BACKEND_ONNXRUNTIME else PRECISION_FP32)
+            if onnx_path is not None:
+                if backend == BACKEND_ONNXRUNTIME:
+                    return OnnxGenderBackend(onnx_path, threads)
+                return OpenVinoGenderBackend(onnx_path, threads, precision)
+        except Exception as e:
+            print(f"Error loading {backend} Gender CNN, falling back to PyTorch: {e}")
+
+    # PyTorch int8 is dynamic quantization of the linear layers, on top of GENDER_CNN_OPTIMIZATIONS
+    optimizations = parse_optimizations(GENDER_CNN_OPTIMIZATIONS)
+    if backend == BACKEND_TORCH and precision == PRECISION_INT8:
+        optimizations = parse_optimizations(optimizations + ("int8",))
+    model = load_gender_classifier(weights_path, optimizations)
+    return TorchGenderBackend(model, threads) if model is not None else None
+
+
+# --- Detector ---
+
+def detector_export_path(model_path, backend, precision, imgsz):
+    root = os.path.splitext(model_path)[0]
+    if backend == BACKEND_ONNXRUNTIME:
+        return f"{root}_{imgsz}_{precision}.onnx"
+    # ultralytics recognises OpenVINO models by this directory suffix
+    return f"{root}_{imgsz}_{precision}_openvino_model"
+
+
+def load_detector(model_path, backend=None, precision=None, imgsz=None, threads=None):
+    """
+    ultralytics YOLO on the chosen runtime. Non-PyTorch backends export the .pt
+    weights once (ONNX, or an OpenVINO IR, at a fixed imgsz) and load the export;
+    tracking works the same on every backend. int8 is supported for OpenVINO
+    (calibrated on DETECTOR_INT8_CALIBRATION); ONNX exports stay fp32, since dynamic
+    int8 convolutions are slower than fp32 on ONNX Runtime's CPU provider.
+    threads sets torch's thread count, or the ONNX Runtime / OpenVINO session's.
+    """
+    from ultralytics import YOLO
+
+    backend = backend or INFERENCE_BACKEND
+    precision = precision or INFERENCE_PRECISION
+    threads = threads or INFERENCE_THREADS
+    if backend == BACKEND_TORCH:
+        if threads:
+            import torch
+            torch.set_num_threads(threads)
+        return YOLO(model_path)
+    if backend not in INFERENCE_BACKENDS:
+        raise ValueError(f"Unknown inference backend '{backend}'")
+
+    imgsz = imgsz or DETECTOR_IMGSZ
+    if backend == BACKEND_ONNXRUNTIME and precision == PRECISION_INT8:
+        print("Note: the ONNX detector is exported in fp32; int8 applies to the Gender CNN only")
+        precision = PRECISION_FP32
+    exported = detector_export_path(model_path, backend, precision, imgsz)
+    with _export_lock(exported):
+        # ultralytics downloads stock weights on first use, so model_path may not exist yet
+        stale = not os.path.exists(exported) or (os.path.exists(model_path) and not _is_fresh(exported, model_path))
+        if stale:
+            _export_detector(model_path, exported, backend, precision, imgsz)
+        model = YOLO(exported, task="detect")
+    if threads:
+        try:
+            _set_detector_threads(model, exported, backend, threads, imgsz)
+        except Exception as e:
+            print(f"Warning: could not set {threads} threads on the {backend} detector: {e}")
+    return model
+
+
+def _export_detector(model_path, exported, backend, precision, imgsz):
+    """
+    ultralytics always exports next to the weights it is given, so the weights
+    are copied into a directory of this process first: concurrent exports never
+    write the same files, and the finished one is moved into place.
+    """
+    from ultralytics import YOLO
+
+    source = YOLO(model_path)  # downloads stock weights on first use
+    weights = getattr(source, "ckpt_path", None) or model_path
+    tmp_dir = f"{exported}.{os.getpid()}.tmp"
+    os.makedirs(tmp_dir, exist_ok=True)
+    try:
+        tmp_weights = os.path.join(tmp_dir, os.path.basename(weights))
+        shutil.copy2(weights, tmp_weights)
+        options = {"format": "onnx" if backend == BACKEND_ONNXRUNTIME else "openvino", "imgsz": imgsz}
+        if backend == BACKEND_ONNXRUNTIME:
+            options["opset"] = ONNX_OPSET
+        if precision == PRECISION_INT8:
+            options.update(int8=True, data=DETECTOR_INT8_CALIBRATION)
+        produced = YOLO(tmp_weights).export(**options)
+        _replace(produced, exported)
+        print(f"Exported {model_path} to {exported}")
+    finally:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+
+
+def _set_detector_threads(model, exported, backend, threads, imgsz):
+    """
+    ultralytics creates the ONNX Runtime session / OpenVINO compiled model itself,
+    with the runtime's default threading. A first predict sets up the predictor,
+    whose runtime handle is then rebuilt with the thread count; track() reuses it.
+    """
+    model.predict(np.zeros((imgsz, imgsz, 3), dtype=np.uint8), imgsz=imgsz, verbose=False)
+    runtime = model.predictor.model
+    if backend == BACKEND_ONNXRUNTIME:
+        import onnxruntime as ort
+        options = ort.SessionOptions()
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        options.inter_op_num_threads = 1
+        options.intra_op_num_threads = threads
+        runtime.session = ort.InferenceSession(exported, options, providers=runtime.session.get_providers())
+    else:
+        import openvino as ov
+        core = ov.Core()
+        xml_path = glob.glob(os.path.join(exported, "*.xml"))[0]
+        runtime.ov_compiled_model = core.compile_model(
+            core.read_model(xml_path), "CPU", {"PERFORMANCE_HINT": "LATENCY", "INFERENCE_NUM_THREADS": threads})
+
+
+# --- Equivalence check ---
+
+def _sample_frames(videos, frames_per_video):
+    for video in videos:
+        cap = cv2.VideoCapture(video)
+        total = int(cap.get(cv2.CAP_PROP_FRAME_COUNT) or 0)
+        for position in np.linspace(0, max(total - 1, 0), frames_per_video).astype(int):
+            cap.set(cv2.CAP_PROP_POS_FRAMES, int(position))
+            ok, frame = cap.read()
+            if ok:
+                yield frame
+        cap.release()
+
+
+def _crops(frame, boxes):
+    """CnnBase inputs for the boxes, preprocessed like process_video_shards does."""
+    from crop_preprocessing import CropBatcher
+    crops, kept = CropBatcher(capacity=max(1, len(boxes))).fill(frame, boxes)
+    return crops if kept else None
+
+
+def verify_backend(model_path, cnn_weights_path, videos, backend, precision=PRECISION_FP32,
+                   frames_per_video=5, imgsz=DETECTOR_IMGSZ):
+    """
+    Compare a backend with PyTorch on frames sampled from the videos: detections
+    are matched by IoU, and the Gender CNN is run on the PyTorch detections'
+    crops by both. Returns (report, passed) against EQUIVALENCE_TOLERANCES.
+    """
+    from batch_processing import _iou_matrix
+
+    reference = load_detector(model_path, BACKEND_TORCH)
+    candidate = load_detector(model_path, backend, precision, imgsz)
+    reference_cnn = load_gender_backend(cnn_weights_path, BACKEND_TORCH)
+    candidate_cnn = load_gender_backend(cnn_weights_path, backend, precision)
+
+    frames = reference_boxes = candidate_boxes = matched = 0
+    ious, conf_diffs = [], []
+    crops_compared = agreed = 0
+    logit_diff = 0.0
+    for frame in _sample_frames(videos, frames_per_video):
+        frames += 1
+        ref = reference.predict(frame, imgsz=imgsz, classes=[0], verbose=False)[0].boxes
+        cand = candidate.predict(frame, imgsz=imgsz, classes=[0], verbose=False)[0].boxes
+        ref_xyxy, cand_xyxy = ref.xyxy.cpu().numpy(), cand.xyxy.cpu().numpy()
+        reference_boxes += len(ref_xyxy)
+        candidate_boxes += len(cand_xyxy)
+        if len(ref_xyxy) and len(cand_xyxy):
+            iou = _iou_matrix(ref_xyxy.astype(np.float64), cand_xyxy.astype(np.float64))
+            best = iou.argmax(axis=1)
+            for i, j in enumerate(best):
+                if iou[i, j] >= EQUIVALENCE_MIN_BOX_IOU:
+                    matched += 1
+                    ious.append(float(iou[i, j]))
+                    conf_diffs.append(abs(float(ref.conf[i]) - float(cand.conf[j])))
+
+        if reference_cnn is not None and candidate_cnn is not None and len(ref_xyxy):
+            crops = _crops(frame, ref_xyxy)
+            if crops is not None:
+                ref_logits = reference_cnn.predict(crops)
+                cand_logits = candidate_cnn.predict(crops)
+                crops_compared += len(crops)
+                agreed += int((ref_logits.argmax(axis=1) == cand_logits.argmax(axis=1)).sum())
+                logit_diff = max(logit_diff, float(np.abs(ref_logits - cand_logits).max()))
+
+    report = {
+        "backend": backend,
+        "precision": precision,
+        "frames": frames,
+        "reference_boxes": reference_boxes,
+        "candidate_boxes": candidate_boxes,
+        "box_match_rate": round(matched / reference_boxes, 4) if reference_boxes else None,
+        "mean_matched_iou": round(float(np.mean(ious)), 4) if ious else None,
+        "max_conf_diff": round(max(conf_diffs), 4) if conf_diffs else None,
+        "crops": crops_compared,
+        "gender_agreement": round(agreed / crops_compared, 4) if crops_compared else None,
+        "logit_max_abs_diff": round(logit_diff, 6) if crops_compared else None,
+    }
+
+    tolerances = EQUIVALENCE_TOLERANCES[precision]
+    passed = True
+    if report["box_match_rate"] is not None and report["box_match_rate"] < tolerances["box_match_rate"]:
+        passed = False
+    if report["gender_agreement"] is not None and report["gender_agreement"] < tolerances["gender_agreement"]:
+        passed = False
+    if (tolerances["logit_max_abs_diff"] is not None and report["logit_max_abs_diff"] is not None
+            and report["logit_max_abs_diff"] > tolerances["logit_max_abs_diff"]):
+        passed = False
+    return report, passed
+
+
+if __name__ == "__main__":
+    from benchmark import load_corpus, BENCHMARK_CORPUS
+
+    parser = argparse.ArgumentParser(description="Check an inference backend against PyTorch on the sample shards")
+    parser.add_argument("--backend", default=BACKEND_ONNXRUNTIME, choices=INFERENCE_BACKENDS[1:])
+    parser.add_argument("--precision", default=PRECISION_FP32, choices=(PRECISION_FP32, PRECISION_INT8))
+    parser.add_argument("--model", default="yolo12s.pt")
+    parser.add_argument("--cnn-weights", default="../train/cnn_weights.pth")
+    parser.add_argument("--corpus", default=BENCHMARK_CORPUS)
+    parser.add_argument("--videos", type=int, default=5)
+    parser.add_argument("--frames-per-video", type=int, default=5)
+    parser.add_argument("--imgsz", type=int, default=DETECTOR_IMGSZ)
+    args = parser.parse_args()
+
+    report, passed = verify_backend(args.model, args.cnn_weights, load_corpus(args.corpus, args.videos),
+                                    args.backend, args.precision, args.frames_per_video, args.imgsz)
+    for key, value in report.items():
+        print(f"{key}: {value}")
+    print("PASS" if passed else "FAIL")
+    sys.exit(0 if passed else 1)
@@ -0,0 +1,199 @@
+import os
+import socket
+import threading
+import time
+
+JOB_WORKERS = 2  # jobs processed concurrently by this process
+JOB_POLL_INTERVAL = 2.0  # seconds between checks for queued jobs
+JOB_PROGRESS_INTERVAL = 2.0  # seconds between progress writes (also the heartbeat)
+JOB_STALE_AFTER = 120  # seconds without a heartbeat before a running job is requeued
+
+# Job kinds and states
+JOB_KIND_STREAM = "stream"  # sequential process_video_shards (files and live sources)
+JOB_KIND_BATCH = "batch"  # parallel offline reprocessing of a recorded file
+# Job states: queued -> running -> completed | failed | cancelled
+
+
+class JobContext:
+    """
+    Handed to the job runner. progress() only records frames/shards; a
+    heartbeat thread of its own writes them to the job row every
+    JOB_PROGRESS_INTERVAL seconds (right away when a shard was persisted,
+    since that moves the resume point), also while the pipeline is busy in a
+    batch chunk, reconnecting or waiting for upload data. It sets
+    cancel_token when cancellation was requested, from any process, and
+    also when the job was requeued and claimed by another worker (lost).
+    orm is the worker's connection for the runner (shard ingest); progress
+    goes through heartbeat_orm so its commits never land inside an ingest
+    transaction.
+    """
+
+    def __init__(self, orm, job, cancel_token, heartbeat_orm=None):
+        self.orm = orm
+        self.heartbeat_orm = heartbeat_orm or orm
+        self.job = job
+        self.cancel_token = cancel_token
+        self.frames_processed = job['frames_processed']
+        self.shards_persisted = job['shards_persisted']
+        self.resume_frame = job['resume_frame']
+        self.fps = None
+        self.lost = False
+        self._rate_frames = 0
+        self._rate_started = time.monotonic()
+        self._lock = threading.Lock()
+        self._flush = threading.Event()
+        self._stopped = threading.Event()
+        self._thread = None
+
+    def progress(self, frames=0, shards=0, resume_frame=None):
+        with self._lock:
+            self.frames_processed += frames
+            self.shards_persisted += shards
+            self._rate_frames += frames
+            if resume_frame is not None:
+                self.resume_frame = resume_frame
+        if shards:
+            self._flush.set()
+        return not self.cancel_token.is_set()
+
+    def start_heartbeat(self):
+        self._thread = threading.Thread(target=self._heartbeat, daemon=True)
+        self._thread.start()
+
+    def stop_heartbeat(self):
+        """Stop the heartbeat thread; the caller writes the final progress itself."""
+        self._stopped.set()
+        self._flush.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def _heartbeat(self):
+        while True:
+            self._flush.wait(JOB_PROGRESS_INTERVAL)
+            self._flush.clear()
+            if self._stopped.is_set():
+                return
+            self.write_progress()
+
+    def write_progress(self):
+        """Write progress to the job row. Returns False once the job is no longer this worker's."""
+        with self._lock:
+            now = time.monotonic()
+            elapsed = now - self._rate_started
+            if elapsed > 0:
+                self.fps = round(self._rate_frames / elapsed, 2)
+            self._rate_frames = 0
+            self._rate_started = now
+            frames, shards, resume_frame = self.frames_processed, self.shards_persisted, self.resume_frame
+        cancel_requested = self.heartbeat_orm.update_job_progress(self.job['job_id'], frames, shards, self.fps, resume_frame,
+                                                        self.job['claim_token'])
+        if cancel_requested is None:
+            if not self.lost:
+                print(f"Job {self.job['job_id']}: claimed by another worker, stopping")
+            self.lost = True
+            self.cancel_token.set()
+            return False
+        if cancel_requested:
+            self.cancel_token.set()
+        return True
+
+
+class JobQueue:
+    """
+    Durable processing queue on the processing_job table.
+
+    Jobs survive restarts: a worker claims a queued job with SELECT ... FOR
+    UPDATE SKIP LOCKED, reports progress as a heartbeat, and a job whose
+    worker stopped reporting is requeued and resumes from the frame after its
+    last persisted shard. Each claim gets a claim_token; progress and the final
+    state are only written while the job still carries it, so a worker whose
+    job was requeued and claimed elsewhere stops instead of running it twice.
+    At most JOB_WORKERS jobs run in this process and at most one job per
+    camera is queued or running (unique index).
+    """
+
+    def __init__(self, workers=JOB_WORKERS):
+        self.workers = workers
+        self.worker_prefix = f"{socket.gethostname()}:{os.getpid()}"
+        self._wake = threading.Event()
+        self._tokens = {}  # job_id -> cancel token of jobs running in this process
+        self._lock = threading.Lock()
+        self._threads = []
+
+    def start(self, orm_factory, runner):
+        """
+        Start the worker threads. Each opens its own DataBaseOrm with orm_factory(),
+        plus one for its heartbeat;
+        runner(job, context) processes one job and returns normally when done or cancelled.
+        """
+        with self._lock:
+            if self._threads:
+                return
+            for i in range(self.workers):
+                thread = threading.Thread(target=self._run, args=(f"{self.worker_prefix}:{i}", orm_factory, runner), daemon=True)
+                thread.start()
+                self._threads.append(thread)
+
+    def notify(self):
+        """Wake the workers, e.g. after a job was queued."""
+        self._wake.set()
+
+    def cancel_local(self, job_id):
+        """Set the cancel token of a job running in this process (others see the DB flag)."""
+        with self._lock:
+            token = self._tokens.get(str(job_id))
+        if token is not None:
+            token.set()
+            return True
+        return False
+
+    def running_jobs(self):
+        with self._lock:
+            return list(self._tokens)
+
+    def _run(self, worker, orm_factory, runner):
+        try:
+            orm = orm_factory()
+            heartbeat_orm = orm_factory()
+        except Exception as e:
+            print(f"Job worker {worker} could not open a DB connection: {e}")
+            return
+
+        while True:
+            requeued = orm.requeue_stale_jobs(JOB_STALE_AFTER)
+            if requeued:
+                print(f"Requeued {requeued} interrupted job(s)")
+            job = orm.claim_next_job(worker)
+            if job is None:
+                self._wake.wait(JOB_POLL_INTERVAL)
+                self._wake.clear()
+                continue
+            self._execute(orm, heartbeat_orm, job, runner)
+
+    def _execute(self, orm, heartbeat_orm, job, runner):
+        job_id = str(job['job_id'])
+        cancel_token = threading.Event()
+        with self._lock:
+            self._tokens[job_id] = cancel_token
+        context = JobContext(orm, job, cancel_token, heartbeat_orm)
+        print(f"Job {job_id}: {job['kind']} {job['source']} on cam {job['cam_id']} from frame {job['resume_frame']}")
+        context.start_heartbeat()
+        try:
+            runner(job, context)
+            context.stop_heartbeat()
+            # Final progress write, which also picks up a late cancel request
+            if context.write_progress():
+                orm.finish_job(job['job_id'], "cancelled" if cancel_token.is_set() else "completed", claim_token=job['claim_token'])
+        except Exception as e:
+            context.stop_heartbeat()
+            print(f"Job {job_id} failed: {e}")
+            if not context.lost:
+                orm.finish_job(job['job_id'], "failed", str(e), claim_token=job['claim_token'])
+        finally:
+            with self._lock:
+                self._tokens.pop(job_id, None)
+
+
+# Shared by the API of this process
+job_queue = JobQueue()
@@ -0,0 +1,112 @@
+import bisect
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+import cv2
+
+# PyTurboJPEG is optional (pip install PyTurboJPEG, needs libturbojpeg); OpenCV is the fallback
+try:
+    from turbojpeg import TurboJPEG, TJPF_BGR, TJSAMP_420
+except ImportError:
+    TurboJPEG = None
+
+PREVIEW_ENCODER_WORKERS = max(1, min(4, (os.cpu_count() or 4) // 4))
+# Upper bounds (ms) of the encode latency histogram buckets; the last bucket is open-ended
+LATENCY_BUCKETS_MS = (1, 2, 5, 10, 20, 50, 100, 200)
+
+
+class LatencyHistogram:
+    def __init__(self, buckets=LATENCY_BUCKETS_MS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.total = 0
+        self.sum_ms = 0.0
+        self._lock = threading.Lock()
+
+    def observe(self, ms):
+        with self._lock:
+            self.counts[bisect.bisect_left(self.buckets, ms)] += 1
+            self.total += 1
+            self.sum_ms += ms
+
+    def raw(self):
+        """(per-bucket counts, total count, sum in ms), read consistently."""
+        with self._lock:
+            return list(self.counts), self.total, self.sum_ms
+
+    def snapshot(self):
+        with self._lock:
+            labels = [f"<={b}ms" for b in self.buckets] + [f">{self.buckets[-1]}ms"]
+            return {
+                "count": self.total,
+                "avg_ms": round(self.sum_ms / self.total, 3) if self.total else None,
+                "buckets": dict(zip(labels, self.counts)),
+            }
+
+
+class JpegEncoderPool:
+    """
+    Bounded pool of JPEG encoder threads shared by every camera's preview.
+    Uses libjpeg-turbo through PyTurboJPEG when it is available and falls back
+    to cv2.imencode otherwise. The worker count caps how many cores previews can
+    take away from inference; both encoders release the GIL while encoding.
+    """
+
+    def __init__(self, workers=PREVIEW_ENCODER_WORKERS):
+        self.workers = workers
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="jpeg-encoder")
+        self._turbo = None
+        if TurboJPEG is not None:
+            try:
+                self._turbo = TurboJPEG()
+            except Exception as e:
+                print(f"TurboJPEG unavailable, using OpenCV for previews: {e}")
+        self.backend = "turbojpeg" if self._turbo is not None else "opencv"
+        self.latency = LatencyHistogram()
+        self._local = threading.local()
+
+    def _encode(self, frame, quality):
+        started = time.perf_counter()
+        if self._turbo is not None:
+            data = self._turbo.encode(frame, quality=quality, pixel_format=TJPF_BGR, jpeg_subsample=TJSAMP_420)
+        else:
+            ret, buffer = cv2.imencode('.jpg', frame, [cv2.IMWRITE_JPEG_QUALITY, quality])
+            data = buffer.tobytes() if ret else None
+        self.latency.observe((time.perf_counter() - started) * 1000)
+        return data
+
+    def submit(self, frame, quality):
+        """Encode on the pool; returns a Future with the JPEG bytes (or None on failure)."""
+        return self._executor.submit(self._encode, frame, quality)
+
+    def encode(self, frame, quality):
+        return self.submit(frame, quality).result()
+
+    def resize(self, frame, size):
+        """
+        Downscale into a per-thread buffer that is reused while the output size is unchanged.
+        The result is only valid until the next resize() on the same thread.
+        """
+        buffers = getattr(self._local, "buffers", None)
+        if buffers is None:
+            buffers = self._local.buffers = {}
+        key = (size, frame.shape[2:], frame.dtype)
+        dst = buffers.get(key)
+        if dst is None:
+            dst = cv2.resize(frame, size, interpolation=cv2.INTER_AREA)
+            buffers[key] = dst
+        else:
+            cv2.resize(frame, size, dst=dst, interpolation=cv2.INTER_AREA)
+        return dst
+
+    def stats(self):
+        return {
+            "backend": self.backend,
+            "workers": self.workers,
+            "encode_latency": self.latency.snapshot(),
+        }
+
+
+# Shared by every PreviewBroadcaster in this process
+encoder_pool = JpegEncoderPool()
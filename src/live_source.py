@@ -0,0 +1,331 @@
+import random
+import threading
+import time
+from collections import deque
+from datetime import datetime, timedelta
+import cv2
+
+LIVE_PREFIXES = ("rtsp://", "rtsps://", "rtmp://", "http://", "https://", "udp://", "tcp://")
+LIVE_BUFFER_SIZE = 8  # frames; the oldest is dropped when inference falls behind
+RECONNECT_INITIAL_DELAY = 0.5  # seconds
+RECONNECT_MAX_DELAY = 15.0  # seconds
+RECONNECT_JITTER = 0.2  # +/- fraction of the delay
+READ_POLL_INTERVAL = 0.5  # seconds between cancellation checks while waiting for a frame
+# Frames older than this are skipped in favour of newer ones (drop-to-latest); 0 always takes
+# the newest frame, None reads every buffered frame in order
+LIVE_MAX_LATENCY = 0.5  # seconds
+RATE_WINDOW = 5.0  # seconds over which processed/dropped fps are measured
+
+_active_sources = {}  # cam_id -> frame source currently feeding that camera's pipeline
+_active_lock = threading.Lock()
+
+
+def is_live_source(source):
+    """Camera index or network stream URL; anything else is treated as a file."""
+    if isinstance(source, int) or (isinstance(source, str) and source.isdigit()):
+        return True
+    return isinstance(source, str) and source.lower().startswith(LIVE_PREFIXES)
+
+
+def _capture_arg(source):
+    return int(source) if isinstance(source, str) and source.isdigit() else source
+
+
+def _stream_properties(cap):
+    fps = cap.get(cv2.CAP_PROP_FPS)
+    if not fps or fps > 240:
+        fps = 30  # Default fallback; some network streams report 0 or 90000
+    return fps, int(cap.get(cv2.CAP_PROP_FRAME_WIDTH)), int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
+
+
+class RateMeter:
+    """Events per second over the last RATE_WINDOW seconds."""
+
+    def __init__(self, window=RATE_WINDOW):
+        self.window = window
+        self._events = deque()
+
+    def mark(self, now, count=1):
+        self._events.append((now, count))
+
+    def rate(self, now):
+        while self._events and now - self._events[0][0] > self.window:
+            self._events.popleft()
+        return sum(c for _, c in self._events) / self.window
+
+
+class FileFrameSource:
+    """
+    Reads a video file frame by frame on the caller's thread; nothing is dropped.
+    Capture time is media time anchored at time_origin (default: when the file
+    was opened). start_frame/end_frame restrict reading to [start_frame, end_frame).
+    """
+
+    live = False
+
+    def __init__(self, cap, start_frame=0, end_frame=None, time_origin=None):
+        self.cap = cap
+        self.fps, self.width, self.height = _stream_properties(cap)
+        self.started_at = time_origin or datetime.now()
+        self.start_frame = start_frame
+        self.end_frame = end_frame
+        if start_frame and not self.cap.set(cv2.CAP_PROP_POS_FRAMES, start_frame):
+            # Not seekable (e.g. a pipe): skip ahead by decoding
+            for _ in range(start_frame):
+                if not self.cap.grab():
+                    break
+        self.frames_read = 0
+        self._read_rate = RateMeter()
+
+    def read(self):
+        """Returns (ok, frame, captured_at, media_time_seconds)."""
+        position = self.start_frame + self.frames_read
+        if self.end_frame is not None and position >= self.end_frame:
+            return False, None, None, None
+        ret, frame = self.cap.read()
+        if not ret:
+            return False, None, None, None
+        media_time = position / self.fps
+        self.frames_read += 1
+        self._read_rate.mark(time.monotonic())
+        return True, frame, self.started_at + timedelta(seconds=media_time), media_time
+
+    def queue_depth(self):
+        return 0  # frames are decoded on demand
+
+    def release(self):
+        self.cap.release()
+        forget_frame_source(self)
+
+    def stats(self):
+        return {
+            "live": False,
+            "frames_read": self.frames_read,
+            "processed_fps": round(self._read_rate.rate(time.monotonic()), 2),
+        }
+
+
+class LiveFrameSource:
+    """
+    Live camera/stream reader.
+
+    A capture thread grabs frames as fast as the source delivers them and
+    stamps each with its capture time, so a slow consumer never delays the
+    socket (which is what makes RTSP streams stall or smear). Frames go into a
+    bounded buffer that keeps the newest ones. When a read fails, the thread
+    reconnects with exponential backoff and jitter instead of ending the stream.
+    read() skips frames older than max_latency, so when inference can't keep
+    up it works on the newest frame instead of falling further behind.
+    A local file passed here is played back at its own frame rate and looped,
+    which stands in for a camera when testing.
+    """
+
+    live = True
+
+    def __init__(self, source, cap, buffer_size=LIVE_BUFFER_SIZE, cancel_token=None, max_latency=LIVE_MAX_LATENCY):
+        self.source = source
+        self.cap = cap
+        self.fps, self.width, self.height = _stream_properties(cap)
+        self.cancel_token = cancel_token
+        self.max_latency = max_latency
+        self._paced = not is_live_source(source)
+        self._buffer = deque(maxlen=buffer_size)
+        self._cond = threading.Condition()
+        self._closed = False
+        self._stopping = threading.Event()  # wakes a reconnect backoff early on release()
+        self._started = time.monotonic()
+        self.started_at = datetime.now()
+        self.frames_captured = 0
+        self.frames_dropped = 0  # overwritten in the buffer before anyone read them
+        self.frames_stale = 0  # skipped by read() for being older than max_latency
+        self.frames_read = 0
+        self.lag = None  # seconds between capture and hand-off of the last frame read
+        self._last_capture = None  # monotonic capture time of the last frame read
+        self._read_rate = RateMeter()
+        self._drop_rate = RateMeter()
+        self.reconnects = 0
+        self.connected = True
+        self.last_error = None
+        if not self.width or not self.height:
+            # Some RTSP streams report 0x0 until the first frame; callers need the geometry up front
+            ret, frame = cap.read()
+            if ret:
+                self.height, self.width = frame.shape[:2]
+                self._buffer.append((frame, datetime.now(), time.monotonic() - self._started))
+                self.frames_captured += 1
+        self._thread = threading.Thread(target=self._capture, daemon=True)
+        self._thread.start()
+
+    def _reconnect(self):
+        self.connected = False
+        delay = RECONNECT_INITIAL_DELAY
+        while not self._closed:
+            try:
+                self.cap.release()
+            except Exception:
+                pass
+            jittered = delay * random.uniform(1 - RECONNECT_JITTER, 1 + RECONNECT_JITTER)
+            print(f"Live source {self.source} lost, reconnecting in {jittered:.1f}s")
+            self._stopping.wait(jittered)
+            if self._closed:
+                return False
+            self.cap = cv2.VideoCapture(_capture_arg(self.source))
+            if self.cap.isOpened():
+                self.reconnects += 1
+                self.connected = True
+                print(f"Live source {self.source} reconnected")
+                return True
+            delay = min(delay * 2, RECONNECT_MAX_DELAY)
+        return False
+
+    def _capture(self):
+        interval = 1.0 / self.fps
+        next_due = time.monotonic()
+        try:
+            while not self._closed:
+                try:
+                    ret, frame = self.cap.read()
+                except Exception as e:
+                    self.last_error = str(e)
+                    ret, frame = False, None
+                if not ret:
+                    if not self._reconnect():
+                        break
+                    continue
+
+                now = time.monotonic()
+                captured_at = datetime.now()
+                if not self.width or not self.height:
+                    # The stream reported no geometry and __init__ got no frame: the first one sets it
+                    self.height, self.width = frame.shape[:2]
+                elif frame.shape[1] != self.width or frame.shape[0] != self.height:
+                    # Keep the stream geometry stable across reconnects; shard writers depend on it
+                    frame = cv2.resize(frame, (self.width, self.height))
+                with self._cond:
+                    if len(self._buffer) == self._buffer.maxlen:
+                        self.frames_dropped += 1
+                        self._drop_rate.mark(now)
+                    self._buffer.append((frame, captured_at, now - self._started))
+                    self.frames_captured += 1
+                    self._cond.notify()
+
+                if self._paced:
+                    next_due = max(next_due + interval, now)
+                    time.sleep(max(0.0, next_due - time.monotonic()))
+        except Exception as e:
+            self.last_error = str(e)
+            print(f"Live source {self.source} capture failed: {e}")
+        finally:
+            # Whatever ended the loop, read() must see the reader closed instead of waiting forever
+            with self._cond:
+                self._closed = True
+                self._cond.notify_all()
+
+    def read(self):
+        """
+        Next frame as (ok, frame, captured_at, media_time_seconds): the oldest buffered
+        frame that is no older than max_latency, or the newest one if all are stale.
+        Blocks while the buffer is empty (e.g. during a reconnect); returns ok=False only
+        once the reader is released or the cancel token is set.
+        """
+        with self._cond:
+            while not self._buffer:
+                if self._closed or (self.cancel_token is not None and self.cancel_token.is_set()):
+                    return False, None, None, None
+                self._cond.wait(READ_POLL_INTERVAL)
+            now = time.monotonic()
+            if self.max_latency is not None:
+                skipped = 0
+                while len(self._buffer) > 1 and now - (self._started + self._buffer[0][2]) > self.max_latency:
+                    self._buffer.popleft()
+                    skipped += 1
+                if skipped:
+                    self.frames_stale += skipped
+                    self._drop_rate.mark(now, skipped)
+            frame, captured_at, media_time = self._buffer.popleft()
+            self.frames_read += 1
+            self._read_rate.mark(now)
+            self._last_capture = self._started + media_time
+            self.lag = now - self._last_capture
+        return True, frame, captured_at, media_time
+
+    def queue_depth(self):
+        return len(self._buffer)
+
+    def release(self):
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+        self._stopping.set()
+        self._thread.join(timeout=RECONNECT_MAX_DELAY)
+        try:
+            self.cap.release()
+        except Exception:
+            pass
+        forget_frame_source(self)
+
+    def stats(self):
+        with self._cond:
+            buffered = len(self._buffer)
+            now = time.monotonic()
+            processed_fps = self._read_rate.rate(now)
+            dropped_fps = self._drop_rate.rate(now)
+        return {
+            "live": True,
+            "source_fps": self.fps,
+            "max_latency": self.max_latency,
+            "connected": self.connected,
+            "reconnects": self.reconnects,
+            "frames_captured": self.frames_captured,
+            "frames_read": self.frames_read,
+            "frames_dropped": self.frames_dropped + self.frames_stale,
+            "processed_fps": round(processed_fps, 2),
+            "dropped_fps": round(dropped_fps, 2),
+            # Lag at hand-off, and age of that frame now (grows while inference is busy with it)
+            "lag_ms": round(self.lag * 1000, 1) if self.lag is not None else None,
+            "current_lag_ms": round((now - self._last_capture) * 1000, 1) if self._last_capture is not None else None,
+            "buffered": buffered,
+            "last_error": self.last_error,
+        }
+
+
+def open_frame_source(source, live=None, cancel_token=None, max_latency=LIVE_MAX_LATENCY, cam_id=None,
+                      start_frame=0, end_frame=None, time_origin=None):
+    """
+    Open a video file or live stream. live=None decides from the source
+    (camera index or stream URL); live=True forces the live reader, e.g. for a
+    local file standing in for a camera. Returns None if the source can't be opened.
+    With a cam_id the source is registered for ingest_stats() until it is released.
+    start_frame, end_frame and time_origin apply to files only (see FileFrameSource).
+    """
+    cap = cv2.VideoCapture(_capture_arg(source))
+    if not cap.isOpened():
+        return None
+    if live is None:
+        live = is_live_source(source)
+    if live:
+        reader = LiveFrameSource(source, cap, cancel_token=cancel_token, max_latency=max_latency)
+    else:
+        reader = FileFrameSource(cap, start_frame, end_frame, time_origin)
+    if cam_id is not None:
+        reader.cam_id = cam_id
+        with _active_lock:
+            _active_sources[cam_id] = reader
+    return reader
+
+
+def forget_frame_source(reader):
+    cam_id = getattr(reader, "cam_id", None)
+    with _active_lock:
+        if cam_id is not None and _active_sources.get(cam_id) is reader:
+            del _active_sources[cam_id]
+
+
+def ingest_stats(cam_id=None):
+    """Reader stats of the cameras being processed, keyed by cam_id (or just one camera's)."""
+    with _active_lock:
+        sources = dict(_active_sources)
+    if cam_id is not None:
+        reader = sources.get(cam_id)
+        return reader.stats() if reader is not None else None
+    return {cam: reader.stats() for cam, reader in sources.items()}
@@ -0,0 +1,30 @@
+import psycopg2
+from database import DB_CONFIG
+
+def migrate():
+    try:
+        conn = psycopg2.connect(**DB_CONFIG)
+        cur = conn.cursor()
+
+        # Gender of a track is voted over several crops: averaged probability and crops used
+        columns = {
+            "gender_confidence": "REAL DEFAULT 0",
+            "gender_samples": "SMALLINT DEFAULT 0",
+        }
+        for column, definition in columns.items():
+            cur.execute("SELECT column_name FROM information_schema.columns WHERE table_name='tracking' AND column_name=%s;", (column,))
+            if not cur.fetchone():
+                print(f"Adding {column} column...")
+                cur.execute(f"ALTER TABLE tracking ADD COLUMN {column} {definition};")
+                print(f"Column '{column}' added successfully.")
+            else:
+                print(f"Column '{column}' already exists.")
+        conn.commit()
+
+        cur.close()
+        conn.close()
+    except Exception as e:
+        print(f"Error: {e}")
+
+if __name__ == "__main__":
+    migrate()
@@ -0,0 +1,72 @@
+import psycopg2
+from database import DB_CONFIG, DataBaseOrm
+from heatmap_tiles import HEATMAP_CELL_PX, HEATMAP_GRID_COLS, HeatmapTile
+
+def migrate():
+    try:
+        conn = psycopg2.connect(**DB_CONFIG)
+        cur = conn.cursor()
+
+        # Box-centre counts per HEATMAP_CELL_PX cell of each shard, stored sparsely (see heatmap_tiles)
+        cur.execute("""
+            CREATE TABLE IF NOT EXISTS heatmap_shard (
+                video_shard UUID PRIMARY KEY,
+                cam_id INTEGER NOT NULL,
+                cells BYTEA NOT NULL,
+                counts BYTEA NOT NULL,
+                boxes INTEGER NOT NULL
+            );
+        """)
+        print("Table 'heatmap_shard' is ready.")
+
+        # The same counts summed per camera and day, read by get_heatmap_data without a shard
+        cur.execute("""
+            CREATE TABLE IF NOT EXISTS heatmap_day (
+                cam_id INTEGER NOT NULL,
+                day DATE NOT NULL,
+                cells BYTEA NOT NULL,
+                counts BYTEA NOT NULL,
+                boxes BIGINT NOT NULL,
+                PRIMARY KEY (cam_id, day)
+            );
+        """)
+        conn.commit()
+        print("Table 'heatmap_day' is ready.")
+
+        # Backfill the shards ingested before this migration
+        cur.execute("""
+            SELECT DISTINCT t.video_shard, t.cam_id
+            FROM tracking t
+            WHERE NOT EXISTS (SELECT 1 FROM heatmap_shard h WHERE h.video_shard = t.video_shard)
+        """)
+        shards = cur.fetchall()
+        print(f"Backfilling heatmap tiles of {len(shards)} shards...")
+        orm = DataBaseOrm()
+        for shard_id, cam_id in shards:
+            cur.execute("""
+                SELECT "timestamp"::date AS day,
+                       GREATEST((y1 + y2) / 2 / %s, 0) * %s + LEAST(GREATEST((x1 + x2) / 2 / %s, 0), %s) AS cell,
+                       COUNT(*)
+                FROM bounding_box
+                WHERE video_shard = %s
+                GROUP BY day, cell
+                ORDER BY day, cell
+            """, (HEATMAP_CELL_PX, HEATMAP_GRID_COLS, HEATMAP_CELL_PX, HEATMAP_GRID_COLS - 1, shard_id))
+            day_cells = {}
+            for day, cell, count in cur.fetchall():
+                day_cells.setdefault(day, ([], []))
+                day_cells[day][0].append(cell)
+                day_cells[day][1].append(count)
+            if not day_cells:
+                continue
+            day_tiles = {day: HeatmapTile(cells, counts) for day, (cells, counts) in day_cells.items()}
+            orm.save_heatmap_tiles(cam_id, shard_id, HeatmapTile.merge(list(day_tiles.values())), day_tiles)
+        print("Heatmap tiles backfilled.")
+
+        cur.close()
+        conn.close()
+    except Exception as e:
+        print(f"Error: {e}")
+
+if __name__ == "__main__":
+    migrate()
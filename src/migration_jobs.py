@@ -0,0 +1,54 @@
+import psycopg2
+from database import DB_CONFIG
+
+def migrate():
+    try:
+        conn = psycopg2.connect(**DB_CONFIG)
+        cur = conn.cursor()
+        
+        # Durable processing jobs (see job_queue.py)
+        cur.execute("""
+            CREATE TABLE IF NOT EXISTS processing_job (
+                job_id UUID PRIMARY KEY,
+                kind VARCHAR(16) NOT NULL,
+                source TEXT NOT NULL,
+                cam_id INTEGER NOT NULL,
+                shard_duration INTEGER NOT NULL,
+                options JSONB NOT NULL DEFAULT '{}',
+                state VARCHAR(16) NOT NULL DEFAULT 'queued',
+                cancel_requested BOOLEAN NOT NULL DEFAULT FALSE,
+                frames_processed BIGINT NOT NULL DEFAULT 0,
+                shards_persisted INTEGER NOT NULL DEFAULT 0,
+                fps REAL,
+                resume_frame BIGINT NOT NULL DEFAULT 0,
+                time_origin TIMESTAMP,
+                worker VARCHAR(64),
+                error TEXT,
+                created_at TIMESTAMP NOT NULL DEFAULT NOW(),
+                started_at TIMESTAMP,
+                finished_at TIMESTAMP,
+                updated_at TIMESTAMP NOT NULL DEFAULT NOW()
+            );
+        """)
+        # At most one queued or running job per camera
+        cur.execute("""
+            CREATE UNIQUE INDEX IF NOT EXISTS idx_processing_job_active_cam
+            ON processing_job (cam_id) WHERE state IN ('queued', 'running');
+        """)
+        cur.execute("CREATE INDEX IF NOT EXISTS idx_processing_job_state ON processing_job (state, created_at);")
+        # Identifies the current claim of a running job, so a requeued job's old worker stops writing
+        cur.execute("SELECT column_name FROM information_schema.columns WHERE table_name='processing_job' AND column_name='claim_token';")
+        if not cur.fetchone():
+            print("Adding claim_token column...")
+            cur.execute("ALTER TABLE processing_job ADD COLUMN claim_token UUID;")
+            print("Column 'claim_token' added successfully.")
+        conn.commit()
+        print("Table 'processing_job' is ready.")
+            
+        cur.close()
+        conn.close()
+    except Exception as e:
+        print(f"Error: {e}")
+
+if __name__ == "__main__":
+    migrate()
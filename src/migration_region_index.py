@@ -0,0 +1,52 @@
+import psycopg2
+from database import DB_CONFIG, DataBaseOrm
+
+def migrate():
+    try:
+        conn = psycopg2.connect(**DB_CONFIG)
+        cur = conn.cursor()
+        
+        # Optional polygon outline for non-rectangular regions, as a JSON list of [x, y]
+        cur.execute("SELECT column_name FROM information_schema.columns WHERE table_name='region_defined' AND column_name='polygon';")
+        if not cur.fetchone():
+            print("Adding polygon column...")
+            cur.execute("ALTER TABLE region_defined ADD COLUMN polygon JSONB;")
+            print("Column 'polygon' added successfully.")
+        else:
+            print("Column 'polygon' already exists.")
+        
+        # Region membership computed at shard ingest (one row per track, region and shard)
+        cur.execute("""
+            CREATE TABLE IF NOT EXISTS region_presence (
+                region_id INTEGER NOT NULL REFERENCES region_defined(region_id) ON DELETE CASCADE,
+                tracking_id UUID NOT NULL,
+                video_shard UUID NOT NULL,
+                first_seen TIMESTAMP NOT NULL,
+                last_seen TIMESTAMP NOT NULL,
+                frames INTEGER NOT NULL,
+                PRIMARY KEY (region_id, tracking_id, video_shard)
+            );
+        """)
+        cur.execute("CREATE INDEX IF NOT EXISTS idx_region_presence_shard ON region_presence (video_shard);")
+        conn.commit()
+        print("Table 'region_presence' is ready.")
+
+        # The region analytics read region_presence; build it for regions without rows yet
+        cur.execute("""
+            SELECT region_id FROM region_defined r
+            WHERE NOT EXISTS (SELECT 1 FROM region_presence rp WHERE rp.region_id = r.region_id)
+        """)
+        region_ids = [row[0] for row in cur.fetchall()]
+        print(f"Backfilling region presence of {len(region_ids)} regions...")
+        orm = DataBaseOrm()
+        for region_id in region_ids:
+            orm.rebuild_region_presence(region_id)
+        print("Region presence backfilled.")
+            
+        cur.close()
+        conn.close()
+    except Exception as e:
+        print(f"Error: {e}")
+
+if __name__ == "__main__":
+    migrate()
@@ -0,0 +1,41 @@
+import psycopg2
+from database import DB_CONFIG
+
+def migrate():
+    try:
+        conn = psycopg2.connect(**DB_CONFIG)
+        cur = conn.cursor()
+
+        # Re-identified tracks: tracking_id is the same person as canonical_id (never itself an alias)
+        cur.execute("""
+            CREATE TABLE IF NOT EXISTS track_alias (
+                tracking_id UUID PRIMARY KEY,
+                canonical_id UUID NOT NULL,
+                similarity REAL NOT NULL,
+                created_at TIMESTAMP NOT NULL DEFAULT NOW()
+            );
+        """)
+        cur.execute("CREATE INDEX IF NOT EXISTS idx_track_alias_canonical ON track_alias (canonical_id);")
+        print("Table 'track_alias' is ready.")
+
+        # Latest appearance embedding of each track (float16), to rebuild the re-ID window after a restart
+        cur.execute("""
+            CREATE TABLE IF NOT EXISTS track_appearance (
+                tracking_id UUID PRIMARY KEY,
+                cam_id INTEGER NOT NULL,
+                first_seen TIMESTAMP NOT NULL,
+                last_seen TIMESTAMP NOT NULL,
+                embedding BYTEA NOT NULL
+            );
+        """)
+        cur.execute("CREATE INDEX IF NOT EXISTS idx_track_appearance_last_seen ON track_appearance (last_seen);")
+        conn.commit()
+        print("Table 'track_appearance' is ready.")
+
+        cur.close()
+        conn.close()
+    except Exception as e:
+        print(f"Error: {e}")
+
+if __name__ == "__main__":
+    migrate()
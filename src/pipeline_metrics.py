@@ -0,0 +1,209 @@
+import threading
+import time
+from jpeg_encoder import LatencyHistogram
+from live_source import RateMeter
+
+# Set to False to turn every timer into a no-op (counters are still kept; they cost one add)
+METRICS_ENABLED = True
+STAGE_BUCKETS_MS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000)
+
+# Stages of process_video_shards, in pipeline order, plus ingest of finished shards
+STAGES = ("decode", "track", "gender_crop", "gender_cnn", "annotate", "write", "encode", "callback", "persist")
+
+
+class _NoopTimer:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+_NOOP_TIMER = _NoopTimer()
+
+
+class _StageTimer:
+    __slots__ = ("histogram", "started")
+
+    def __init__(self, histogram):
+        self.histogram = histogram
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.histogram.observe((time.perf_counter() - self.started) * 1000)
+        return False
+
+
+class CameraMetrics:
+    """Counters, stage latency histograms and queue-depth gauges of one camera's pipeline."""
+
+    def __init__(self, cam_id):
+        self.cam_id = cam_id
+        self.stages = {stage: LatencyHistogram(STAGE_BUCKETS_MS) for stage in STAGES}
+        self.frames = 0
+        self.gender_cache_hits = 0
+        self.gender_cache_misses = 0
+        self.db_rows = {}  # table -> rows inserted
+        self.db_seconds = {}  # table -> seconds spent inserting
+        self._fps = RateMeter()
+        self._queues = {}  # name -> callable returning the current depth
+        self._lock = threading.Lock()
+
+    def stage(self, name):
+        """Context manager timing one pass through a stage."""
+        if not METRICS_ENABLED:
+            return _NOOP_TIMER
+        return _StageTimer(self.stages[name])
+
+    def observe(self, name, seconds):
+        if METRICS_ENABLED:
+            self.stages[name].observe(seconds * 1000)
+
+    def frame_done(self):
+        self.frames += 1
+        if METRICS_ENABLED:
+            self._fps.mark(time.monotonic())
+
+    def gender_cache(self, hit):
+        """One track on one frame; a hit needed no Gender CNN sample."""
+        if hit:
+            self.gender_cache_hits += 1
+        else:
+            self.gender_cache_misses += 1
+
+    def db_insert(self, table, rows, seconds):
+        with self._lock:
+            self.db_rows[table] = self.db_rows.get(table, 0) + rows
+            self.db_seconds[table] = self.db_seconds.get(table, 0.0) + seconds
+
+    def db_totals(self):
+        """table -> (rows inserted, seconds spent)"""
+        with self._lock:
+            return {table: (rows, self.db_seconds[table]) for table, rows in self.db_rows.items()}
+
+    def track_queue(self, name, depth):
+        """Report depth() as the '<name>' queue gauge until untrack_queue(name)."""
+        with self._lock:
+            self._queues[name] = depth
+
+    def untrack_queue(self, name):
+        with self._lock:
+            self._queues.pop(name, None)
+
+    def queue_depths(self):
+        with self._lock:
+            queues = dict(self._queues)
+        depths = {}
+        for name, depth in queues.items():
+            try:
+                depths[name] = depth()
+            except Exception:
+                pass
+        return depths
+
+    def fps(self):
+        return self._fps.rate(time.monotonic())
+
+    def snapshot(self):
+        lookups = self.gender_cache_hits + self.gender_cache_misses
+        db = {
+            table: {
+                "rows": rows,
+                "seconds": round(seconds, 3),
+                "rows_per_second": round(rows / seconds, 1) if seconds else None,
+            }
+            for table, (rows, seconds) in self.db_totals().items()
+        }
+        return {
+            "cam_id": self.cam_id,
+            "enabled": METRICS_ENABLED,
+            "frames": self.frames,
+            "fps": round(self.fps(), 2),
+            "stages": {name: histogram.snapshot() for name, histogram in self.stages.items()},
+            "queues": self.queue_depths(),
+            "gender_cache": {
+                "hits": self.gender_cache_hits,
+                "misses": self.gender_cache_misses,
+                "hit_rate": round(self.gender_cache_hits / lookups, 3) if lookups else None,
+            },
+            "db_inserts": db,
+        }
+
+
+class PipelineMetrics:
+    def __init__(self):
+        self._cameras = {}
+        self._lock = threading.Lock()
+
+    def camera(self, cam_id):
+        with self._lock:
+            metrics = self._cameras.get(cam_id)
+            if metrics is None:
+                metrics = self._cameras[cam_id] = CameraMetrics(cam_id)
+            return metrics
+
+    def cameras(self):
+        with self._lock:
+            return list(self._cameras.values())
+
+    def render_prometheus(self, extra_gauges=None):
+        """
+        All cameras in the Prometheus text exposition format.
+        extra_gauges: {metric name: value} for process-wide gauges (e.g. alert bus queue).
+        """
+        lines = []
+
+        def metric(name, kind, help_text):
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} {kind}")
+
+        cameras = self.cameras()
+        metric("pipeline_stage_latency_seconds", "histogram", "Time spent per pipeline stage")
+        for cam in cameras:
+            for stage, histogram in cam.stages.items():
+                counts, total, sum_ms = histogram.raw()
+                if not total:
+                    continue
+                labels = f'cam_id="{cam.cam_id}",stage="{stage}"'
+                cumulative = 0
+                for bound, count in zip(histogram.buckets, counts):
+                    cumulative += count
+                    lines.append(f'pipeline_stage_latency_seconds_bucket{{{labels},le="{bound / 1000}"}} {cumulative}')
+                lines.append(f'pipeline_stage_latency_seconds_bucket{{{labels},le="+Inf"}} {total}')
+                lines.append(f"pipeline_stage_latency_seconds_sum{{{labels}}} {sum_ms / 1000:.6f}")
+                lines.append(f"pipeline_stage_latency_seconds_count{{{labels}}} {total}")
+
+        metric("pipeline_frames_total", "counter", "Frames processed")
+        for cam in cameras:
+            lines.append(f'pipeline_frames_total{{cam_id="{cam.cam_id}"}} {cam.frames}')
+        metric("pipeline_fps", "gauge", "Frames processed per second over the last few seconds")
+        for cam in cameras:
+            lines.append(f'pipeline_fps{{cam_id="{cam.cam_id}"}} {cam.fps():.2f}')
+        metric("pipeline_gender_cache_lookups_total", "counter", "Gender cache lookups by result")
+        for cam in cameras:
+            lines.append(f'pipeline_gender_cache_lookups_total{{cam_id="{cam.cam_id}",result="hit"}} {cam.gender_cache_hits}')
+            lines.append(f'pipeline_gender_cache_lookups_total{{cam_id="{cam.cam_id}",result="miss"}} {cam.gender_cache_misses}')
+        metric("pipeline_queue_depth", "gauge", "Items waiting in pipeline queues")
+        for cam in cameras:
+            for name, depth in cam.queue_depths().items():
+                lines.append(f'pipeline_queue_depth{{cam_id="{cam.cam_id}",queue="{name}"}} {depth}')
+        metric("pipeline_db_rows_inserted_total", "counter", "Rows bulk-inserted at shard ingest")
+        for cam in cameras:
+            for table, (rows, _) in cam.db_totals().items():
+                lines.append(f'pipeline_db_rows_inserted_total{{cam_id="{cam.cam_id}",table="{table}"}} {rows}')
+        metric("pipeline_db_insert_seconds_total", "counter", "Time spent in shard ingest inserts")
+        for cam in cameras:
+            for table, (_, seconds) in cam.db_totals().items():
+                lines.append(f'pipeline_db_insert_seconds_total{{cam_id="{cam.cam_id}",table="{table}"}} {seconds:.6f}')
+
+        for name, value in (extra_gauges or {}).items():
+            metric(name, "gauge", name.replace("_", " "))
+            lines.append(f"{name} {value}")
+        return "\n".join(lines) + "\n"
+
+
+# Shared by every pipeline of this process
+pipeline_metrics = PipelineMetrics()
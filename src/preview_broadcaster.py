@@ -0,0 +1,332 @@
+import asyncio
+import json
+import struct
+import threading
+import time
+from collections import deque
+from jpeg_encoder import encoder_pool
+
+# Subscribers start at the old FRAME_SKIP = 5 / JPEG_QUALITY = 60 behaviour (~6 fps at 30 fps input)
+PREVIEW_MAX_FPS = 6.0
+PREVIEW_MIN_FPS = 1.0
+PREVIEW_QUALITY_TIERS = (60, 45, 30)  # JPEG quality, best first
+ADAPT_EVERY_N_SENDS = 5
+LATENCY_EWMA_ALPHA = 0.3
+
+# Preview modes
+PREVIEW_MODE_FULL = "full"  # full-resolution annotated JPEG (original behaviour)
+PREVIEW_MODE_OVERLAY = "overlay"  # downscaled clean JPEG + track metadata, client draws overlays
+PREVIEW_OVERLAY_WIDTH = 640  # pixels; frames narrower than this are not upscaled
+
+# Recent full-mode frames kept per camera for viewers that attach mid-stream
+PREVIEW_RING_SIZE = 30
+
+
+GENDER_CODES = {"Male": "M", "Female": "F"}
+
+
+def overlay_metadata(tracks, scale, width, height):
+    """
+    Compact per-frame description of the tracks for client-side drawing.
+    Boxes stay in full-resolution pixel coordinates (the coordinate space regions
+    are defined in); 'scale' maps them onto the downscaled JPEG.
+    """
+    return {
+        "scale": scale,
+        "width": width,
+        "height": height,
+        "tracks": [
+            [round(t['bbox'][0]), round(t['bbox'][1]), round(t['bbox'][2]), round(t['bbox'][3]),
+             t.get('yolo_id'), GENDER_CODES.get(t.get('gender'), "U")]
+            for t in tracks
+        ],
+    }
+
+
+def pack_overlay_message(metadata, jpeg):
+    """Binary message: 4-byte big-endian JSON length, the JSON metadata, then the JPEG bytes."""
+    header = json.dumps(metadata, separators=(',', ':')).encode('utf-8')
+    return struct.pack('>I', len(header)) + header + jpeg
+
+
+class PreviewSubscriber:
+    """
+    One viewer of a camera preview. Holds a single slot with the latest encoded
+    frame: if the viewer is still sending when a newer frame arrives, the older
+    one is overwritten instead of queued, so a slow client drops frames rather
+    than building a backlog. Frame rate and JPEG quality adapt to the measured
+    send latency.
+    """
+
+    def __init__(self, loop, mode=PREVIEW_MODE_FULL):
+        self.loop = loop
+        self.mode = mode
+        self.fps = PREVIEW_MAX_FPS
+        self.tier = 0
+        self.latency = None  # EWMA of send latency, seconds
+        self.frames_sent = 0
+        self.frames_dropped = 0
+        self.closed = False
+        self._latest = None
+        self._last_offer = 0.0
+        self._event = asyncio.Event()
+
+    @property
+    def quality(self):
+        return PREVIEW_QUALITY_TIERS[self.tier]
+
+    def wants_frame(self, now):
+        return not self.closed and now - self._last_offer >= 1.0 / self.fps
+
+    def offer(self, data, now):
+        """Called from the broadcaster thread."""
+        self._last_offer = now
+        if self._latest is not None:
+            self.frames_dropped += 1
+        self._latest = data
+        self.loop.call_soon_threadsafe(self._event.set)
+
+    def _record_latency(self, seconds):
+        if self.latency is None:
+            self.latency = seconds
+        else:
+            self.latency = LATENCY_EWMA_ALPHA * seconds + (1 - LATENCY_EWMA_ALPHA) * self.latency
+        if self.frames_sent % ADAPT_EVERY_N_SENDS:
+            return
+
+        interval = 1.0 / self.fps
+        if self.latency > 0.5 * interval:
+            # Too slow: shed bytes first, then frames
+            if self.tier < len(PREVIEW_QUALITY_TIERS) - 1:
+                self.tier += 1
+            else:
+                self.fps = max(PREVIEW_MIN_FPS, self.fps * 0.7)
+        elif self.latency < 0.2 * interval:
+            # Headroom: recover frames first, then quality
+            if self.fps < PREVIEW_MAX_FPS:
+                self.fps = min(PREVIEW_MAX_FPS, self.fps * 1.2)
+            elif self.tier > 0:
+                self.tier -= 1
+
+    async def next_frame(self):
+        """Wait for the newest frame offered since the last call; None once closed."""
+        while not self.closed:
+            await self._event.wait()
+            self._event.clear()
+            data, self._latest = self._latest, None
+            if data is not None:
+                return data
+        return None
+
+    def record_sent(self, seconds):
+        """Report how long delivering one frame took."""
+        self.frames_sent += 1
+        self._record_latency(seconds)
+
+    async def run(self, send):
+        """Deliver frames with the coroutine send(bytes) until closed or send fails."""
+        try:
+            while True:
+                data = await self.next_frame()
+                if data is None:
+                    break
+                started = time.monotonic()
+                await send(data)
+                self.record_sent(time.monotonic() - started)
+        finally:
+            self.closed = True
+
+    def close(self):
+        self.closed = True
+        self.loop.call_soon_threadsafe(self._event.set)
+
+    def stats(self):
+        return {
+            "mode": self.mode,
+            "fps": round(self.fps, 2),
+            "quality": self.quality,
+            "send_latency_ms": round(self.latency * 1000, 1) if self.latency is not None else None,
+            "frames_sent": self.frames_sent,
+            "frames_dropped": self.frames_dropped,
+        }
+
+
+class FrameRing:
+    """Fixed-size ring of the most recent encoded frames as (seq, wall time, jpeg)."""
+
+    def __init__(self, size=PREVIEW_RING_SIZE):
+        self._frames = deque(maxlen=size)
+        self._seq = 0
+        self._lock = threading.Lock()
+
+    def append(self, jpeg):
+        with self._lock:
+            self._seq += 1
+            self._frames.append((self._seq, time.time(), jpeg))
+
+    def latest(self):
+        with self._lock:
+            return self._frames[-1] if self._frames else None
+
+    def recent(self):
+        with self._lock:
+            return list(self._frames)
+
+
+class PreviewBroadcaster:
+    """
+    Per-camera live preview. The processing thread only hands over its latest
+    frame; a dedicated thread has it encoded once per (mode, quality tier) in
+    use on the shared encoder pool and offers the bytes to every subscriber
+    that is due for a frame. While frames keep arriving, full-mode frames are
+    also recorded into a ring at PREVIEW_MAX_FPS, so a viewer that attaches
+    gets the most recent frame immediately.
+    """
+
+    def __init__(self, cam_id, encoder=encoder_pool):
+        self.cam_id = cam_id
+        self.encoder = encoder
+        self.frames_submitted = 0
+        self.frames_encoded = 0
+        self._subscribers = []
+        self.ring = FrameRing()
+        self._last_ring = 0.0
+        self._frame = None
+        self._cond = threading.Condition()
+        self._closed = False
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def submit(self, frame, raw_frame=None, tracks=None):
+        """
+        Called from the processing thread for every frame; never encodes or blocks.
+        frame is the annotated frame; raw_frame and tracks feed overlay-mode viewers.
+        Frames must not be modified afterwards (process_video_shards builds new ones
+        every time).
+        """
+        with self._cond:
+            self._frame = (frame, raw_frame, tracks or [])
+            self.frames_submitted += 1
+            self._cond.notify()
+
+    def subscribe(self, loop, mode=PREVIEW_MODE_FULL):
+        subscriber = PreviewSubscriber(loop, mode)
+        with self._cond:
+            self._subscribers.append(subscriber)
+        return subscriber
+
+    def unsubscribe(self, subscriber):
+        subscriber.close()
+        with self._cond:
+            if subscriber in self._subscribers:
+                self._subscribers.remove(subscriber)
+
+    def close(self):
+        with self._cond:
+            self._closed = True
+            self._cond.notify()
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while self._frame is None and not self._closed:
+                    self._cond.wait()
+                if self._closed:
+                    return
+                frame, self._frame = self._frame, None
+                self._subscribers = [s for s in self._subscribers if not s.closed]
+                subscribers = list(self._subscribers)
+
+            now = time.monotonic()
+            due = [s for s in subscribers if s.wants_frame(now)]
+            keys = {(s.mode, s.quality) for s in due}
+            ring_key = (PREVIEW_MODE_FULL, PREVIEW_QUALITY_TIERS[0])
+            record = now - self._last_ring >= 1.0 / PREVIEW_MAX_FPS
+            if record:
+                keys.add(ring_key)
+                self._last_ring = now
+            if not keys:
+                continue
+
+            rendered = _FrameRenderer(self.encoder, *frame)
+            payloads = rendered.render(keys)
+            if record and payloads.get(ring_key) is not None:
+                self.ring.append(payloads[ring_key])
+            for subscriber in due:
+                data = payloads.get((subscriber.mode, subscriber.quality))
+                if data is not None:
+                    subscriber.offer(data, now)
+            self.frames_encoded += len(payloads)
+
+    def stats(self):
+        with self._cond:
+            subscribers = list(self._subscribers)
+        return {
+            "cam_id": self.cam_id,
+            "frames_submitted": self.frames_submitted,
+            "frames_encoded": self.frames_encoded,
+            "ring_frames": len(self.ring.recent()),
+            "subscribers": [s.stats() for s in subscribers],
+        }
+
+
+class _FrameRenderer:
+    """Produces the (mode, quality) payloads of one frame, encoding each one once and in parallel."""
+
+    def __init__(self, encoder, frame, raw_frame, tracks):
+        self.encoder = encoder
+        self.frame = frame
+        self.raw_frame = raw_frame if raw_frame is not None else frame
+        self.tracks = tracks
+        self._small = None
+        self._metadata = None
+
+    def _downscaled(self):
+        if self._small is None:
+            height, width = self.raw_frame.shape[:2]
+            scale = min(1.0, PREVIEW_OVERLAY_WIDTH / width)
+            if scale < 1.0:
+                size = (int(round(width * scale)), int(round(height * scale)))
+                self._small = self.encoder.resize(self.raw_frame, size)
+            else:
+                self._small = self.raw_frame
+            self._metadata = overlay_metadata(self.tracks, round(scale, 6), width, height)
+        return self._small
+
+    def render(self, keys):
+        futures = {}
+        for mode, quality in keys:
+            image = self._downscaled() if mode == PREVIEW_MODE_OVERLAY else self.frame
+            futures[(mode, quality)] = self.encoder.submit(image, quality)
+
+        # Wait for every encode before returning: the downscaled buffer is reused on the next frame
+        payloads = {}
+        for (mode, quality), future in futures.items():
+            try:
+                jpeg = future.result()
+            except Exception as e:
+                print(f"Preview encode error: {e}")
+                jpeg = None
+            if jpeg is not None and mode == PREVIEW_MODE_OVERLAY:
+                jpeg = pack_overlay_message(self._metadata, jpeg)
+            payloads[(mode, quality)] = jpeg
+        return payloads
+
+
+_broadcasters = {}
+_broadcasters_lock = threading.Lock()
+
+
+def get_broadcaster(cam_id):
+    """Per-camera broadcaster, created on first use and shared by every viewer of the camera."""
+    with _broadcasters_lock:
+        broadcaster = _broadcasters.get(cam_id)
+        if broadcaster is None:
+            broadcaster = PreviewBroadcaster(cam_id)
+            _broadcasters[cam_id] = broadcaster
+        return broadcaster
+
+
+def all_broadcasters():
+    with _broadcasters_lock:
+        return list(_broadcasters.values())
@@ -0,0 +1,237 @@
+import argparse
+import json
+import statistics
+import time
+from datetime import datetime, timedelta
+
+QUERY_BENCHMARK_SCALES = (1_000_000, 10_000_000, 100_000_000)  # bounding_box rows
+QUERY_BENCHMARK_REPEATS = 3
+
+
+class RecordingCursor:
+    """Cursor wrapper that keeps the SQL (with parameters bound) of every execute()."""
+
+    def __init__(self, cursor, log):
+        self._cursor = cursor
+        self._log = log
+
+    def execute(self, query, vars=None):
+        self._log.append(self._cursor.mogrify(query, vars).decode())
+        return self._cursor.execute(query, vars)
+
+    def __getattr__(self, name):
+        return getattr(self._cursor, name)
+
+    def __iter__(self):
+        return iter(self._cursor)
+
+    def __enter__(self):
+        self._cursor.__enter__()
+        return self
+
+    def __exit__(self, *exc):
+        return self._cursor.__exit__(*exc)
+
+
+class RecordingConnection:
+    """Connection wrapper whose cursors record their statements into .statements."""
+
+    def __init__(self, conn):
+        self._conn = conn
+        self.statements = []
+
+    def cursor(self, *args, **kwargs):
+        return RecordingCursor(self._conn.cursor(*args, **kwargs), self.statements)
+
+    def __getattr__(self, name):
+        return getattr(self._conn, name)
+
+
+def analytics_queries(region_id, cam_id):
+    """(name, call) for every DataBaseOrm analytics method, with the benchmark region/camera."""
+    return [
+        ("get_footfall_by_region", lambda orm: orm.get_footfall_by_region(region_id)),
+        ("get_total_unique_footfall", lambda orm: orm.get_total_unique_footfall(region_id)),
+        ("get_time_spent_in_region", lambda orm: orm.get_time_spent_in_region(region_id)),
+        ("get_demographics_stats", lambda orm: orm.get_demographics_stats(region_id)),
+        ("get_tracking_duration_stats", lambda orm: orm.get_tracking_duration_stats(region_id)),
+        ("get_daily_trends", lambda orm: orm.get_daily_trends()),
+        ("get_daily_trends_region", lambda orm: orm.get_daily_trends(region_id)),
+        ("get_weekly_trends", lambda orm: orm.get_weekly_trends()),
+        ("get_weekly_trends_region", lambda orm: orm.get_weekly_trends(region_id)),
+        ("get_monthly_trends", lambda orm: orm.get_monthly_trends()),
+        ("get_monthly_trends_region", lambda orm: orm.get_monthly_trends(region_id)),
+        ("get_heatmap_data", lambda orm: orm.get_heatmap_data(region_id, None, 50)),
+        ("get_shards_by_camera", lambda orm: orm.get_shards_by_camera(cam_id)),
+        ("get_business_insights", lambda orm: orm.get_business_insights()),
+        ("get_business_insights_camera", lambda orm: orm.get_business_insights(cam_id)),
+        ("generate_ai_report", lambda orm: orm.generate_ai_report(region_id, "weekly")),
+    ]
+
+
+def explain_analyze(conn, sql):
+    """EXPLAIN ANALYZE output of one statement, rolled back so it has no side effects."""
+    try:
+        with conn.cursor() as cur:
+            cur.execute("EXPLAIN (ANALYZE, BUFFERS) " + sql)
+            return "\n".join(row[0] for row in cur.fetchall())
+    except Exception as e:
+        return f"EXPLAIN failed: {e}"
+    finally:
+        conn.rollback()
+
+
+def benchmark_queries(orm, region_id, cam_id, repeats=QUERY_BENCHMARK_REPEATS, explain=True):
+    """
+    Time every analytics method with the analytics cache cleared before each call,
+    and EXPLAIN ANALYZE the statements it ran. generate_ai_report uses the rule-based
+    insights instead of the LLM, so only its SQL is timed.
+    """
+    from analytics_cache import analytics_cache
+    from region_catalog import region_catalog
+
+    # Instance attributes shadow the methods for this ORM only
+    orm._generate_insights = orm._fallback_insights
+    real_conn = orm.conn
+    results = {}
+    try:
+        for name, call in analytics_queries(region_id, cam_id):
+            timings = []
+            statements = []
+            for attempt in range(repeats):
+                analytics_cache.clear()
+                region_catalog.get(real_conn, region_id)  # keep catalog loading out of the timing
+                recorder = RecordingConnection(real_conn)
+                orm.conn = recorder
+                started = time.perf_counter()
+                call(orm)
+                timings.append((time.perf_counter() - started) * 1000)
+                orm.conn = real_conn
+                if attempt == 0:
+                    statements = recorder.statements
+
+            entry = {
+                "runs_ms": [round(t, 2) for t in timings],
+                "min_ms": round(min(timings), 2),
+                "median_ms": round(statistics.median(timings), 2),
+                "statements": len(statements),
+            }
+            if explain:
+                entry["plans"] = [
+                    {"sql": sql, "plan": explain_analyze(real_conn, sql)}
+                    for sql in statements if sql.lstrip().upper().startswith(("SELECT", "WITH"))
+                ]
+            results[name] = entry
+            print(f"{name}: median {entry['median_ms']} ms over {repeats} runs")
+    finally:
+        orm.conn = real_conn
+        del orm._generate_insights
+    return results
+
+
+def table_rows(orm, table):
+    with orm.conn.cursor() as cur:
+        cur.execute(f"SELECT COUNT(*) FROM {table}")
+        return cur.fetchone()[0]
+
+
+def analyze_tables(orm):
+    """Refresh planner statistics after a bulk load, as autovacuum would eventually."""
+    with orm.conn.cursor() as cur:
+        for table in ("bounding_box", "tracking", "region_presence"):
+            cur.execute(f"ANALYZE {table}")
+    orm.conn.commit()
+
+
+def run_query_benchmark(orm, workload, scales=QUERY_BENCHMARK_SCALES, repeats=QUERY_BENCHMARK_REPEATS, explain=True):
+    """
+    Grow the synthetic data one day at a time (newest first) until bounding_box holds
+    each scale's number of rows, then benchmark the analytics queries at that size.
+    Returns the report dict.
+    """
+    from synthetic_workload import ensure_cameras_and_regions, load_day
+    from benchmark import git_revision
+
+    ensure_cameras_and_regions(orm, workload)
+    region_id = workload.regions(workload.cameras[0])[0]["region_id"]
+    cam_id = workload.cameras[0]
+    boxes = table_rows(orm, "bounding_box")
+    offset = 0
+    load_seconds = 0.0
+    loaded_boxes = 0
+    report_scales = []
+
+    for scale in sorted(scales):
+        started = time.perf_counter()
+        while boxes < scale:
+            day = workload.end_date - timedelta(days=offset)
+            shards, tracks, day_boxes = load_day(orm, workload, day)
+            boxes += day_boxes
+            loaded_boxes += day_boxes
+            offset += 1
+            print(f"Loaded {day}: {day_boxes} boxes, {boxes:,} in total")
+        load_seconds += time.perf_counter() - started
+        analyze_tables(orm)
+
+        print(f"--- {boxes:,} bounding boxes ---")
+        report_scales.append({
+            "target_rows": scale,
+            "bounding_box_rows": boxes,
+            "tracking_rows": table_rows(orm, "tracking"),
+            "days_loaded": offset,
+            "load_seconds": round(load_seconds, 1),
+            "load_boxes_per_second": round(loaded_boxes / load_seconds, 1) if load_seconds else None,
+            "queries": benchmark_queries(orm, region_id, cam_id, repeats, explain),
+        })
+
+    return {
+        "created_at": datetime.now().isoformat(),
+        "revision": git_revision(),
+        "workload": {
+            "cameras": len(workload.cameras),
+            "visitors_per_hour": workload.visitors_per_hour,
+            "box_rate": workload.box_rate,
+            "regions_per_camera": workload.regions_per_camera,
+            "end_date": workload.end_date.isoformat(),
+            "seed": workload.seed,
+        },
+        "region_id": region_id,
+        "cam_id": cam_id,
+        "scales": report_scales,
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Time the DataBaseOrm analytics queries at growing bounding_box volumes. "
+                    "Run it against a scratch database: set SALESLOSS_DB_NAME.")
+    parser.add_argument("--scales", default=",".join(str(s) for s in QUERY_BENCHMARK_SCALES),
+                        help="comma-separated bounding_box row counts")
+    parser.add_argument("--cameras", type=int, default=4)
+    parser.add_argument("--visitors-per-hour", type=float, default=60)
+    parser.add_argument("--box-rate", type=float, default=5)
+    parser.add_argument("--regions", type=int, default=4)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--repeats", type=int, default=QUERY_BENCHMARK_REPEATS)
+    parser.add_argument("--no-explain", action="store_true", help="skip EXPLAIN ANALYZE")
+    parser.add_argument("--reset", action="store_true", help="empty the database first")
+    parser.add_argument("--output", default=None, help="JSON report path (default: query_benchmark_<time>.json)")
+    args = parser.parse_args()
+
+    from synthetic_workload import SyntheticWorkload, require_scratch_database
+
+    require_scratch_database()
+    from database import DataBaseOrm
+
+    orm = DataBaseOrm()
+    if args.reset:
+        orm.reset_database()
+    workload = SyntheticWorkload(args.cameras, 0, args.visitors_per_hour, args.box_rate, args.regions, seed=args.seed)
+    scales = [int(s) for s in args.scales.split(",") if s]
+    print(f"About {workload.estimated_boxes_per_day():,} bounding boxes per simulated day")
+
+    report = run_query_benchmark(orm, workload, scales, args.repeats, not args.no_explain)
+    output = args.output or f"query_benchmark_{datetime.now():%Y%m%d_%H%M%S}.json"
+    with open(output, "w") as f:
+        json.dump(report, f, indent=2, default=str)
+    print(f"Report written to {output}")
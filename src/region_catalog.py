@@ -0,0 +1,148 @@
+import select
+import threading
+import time
+from psycopg2.extras import DictCursor
+from analytics_cache import analytics_cache
+from region_index import RegionIndex
+
+# Postgres channel used to tell other worker processes that region_defined changed
+REGION_CHANNEL = "region_changed"
+# Fallback reload interval in case the LISTEN connection is down
+REGION_CATALOG_MAX_AGE = 60  # seconds
+LISTEN_POLL_TIMEOUT = 5  # seconds
+LOAD_ATTEMPTS = 3
+
+
+class RegionCatalog:
+    """
+    In-process copy of region_defined, indexed by region_id and cam_id.
+    Loaded once on first use and reloaded when a region is added, updated
+    or deleted, either by this process or (through LISTEN/NOTIFY) by another.
+    """
+
+    def __init__(self, max_age=REGION_CATALOG_MAX_AGE):
+        self.max_age = max_age
+        self._by_id = {}
+        self._by_cam = {}
+        self._indexes = {}  # cam_id -> RegionIndex, built on demand
+        self._loaded_at = None
+        self._stale = True
+        self._generation = 0  # bumped by invalidate(); a load that overlaps a bump is not installed
+        self._lock = threading.Lock()
+        self._listener = None
+
+    def _ensure_loaded(self, conn):
+        if self._stale or self._loaded_at is None or time.monotonic() - self._loaded_at > self.max_age:
+            # A load discarded by a concurrent invalidation is retried a few times
+            for _ in range(LOAD_ATTEMPTS):
+                self.load(conn)
+                if not self._stale:
+                    break
+
+    def load(self, conn):
+        """
+        Reload the whole catalog. Region tables are small, so a full reload is cheap.
+        If the catalog is invalidated during the read, the snapshot may predate the
+        change, so it is discarded and the catalog stays stale.
+        """
+        generation = self._generation
+        with conn.cursor(cursor_factory=DictCursor) as cur:
+            cur.execute("SELECT * FROM region_defined ORDER BY region_id")
+            rows = [dict(row) for row in cur.fetchall()]
+
+        by_id = {}
+        by_cam = {}
+        for row in rows:
+            by_id[row['region_id']] = row
+            by_cam.setdefault(row['cam_id'], []).append(row)
+
+        with self._lock:
+            if generation != self._generation:
+                return
+            self._by_id = by_id
+            self._by_cam = by_cam
+            self._indexes = {}
+            self._loaded_at = time.monotonic()
+            self._stale = False
+
+    def invalidate(self):
+        """Mark the catalog stale; the next lookup reloads it."""
+        with self._lock:
+            self._generation += 1
+            self._stale = True
+
+    def get(self, conn, region_id):
+        self._ensure_loaded(conn)
+        row = self._by_id.get(region_id)
+        # Hand out copies so callers can't modify the shared catalog
+        return dict(row) if row else None
+
+    def for_camera(self, conn, cam_id):
+        self._ensure_loaded(conn)
+        return [dict(row) for row in self._by_cam.get(cam_id, [])]
+
+    def index_for_camera(self, conn, cam_id):
+        """Spatial index over the camera's regions, shared until the catalog reloads."""
+        self._ensure_loaded(conn)
+        index = self._indexes.get(cam_id)
+        if index is None:
+            index = RegionIndex(self.for_camera(conn, cam_id))
+            self._indexes[cam_id] = index
+        return index
+
+    def all(self, conn):
+        self._ensure_loaded(conn)
+        return [dict(row) for row in self._by_id.values()]
+
+    @staticmethod
+    def notify(cur, region_id):
+        """Queue a change notification; Postgres delivers it when the transaction commits."""
+        cur.execute("SELECT pg_notify(%s, %s)", (REGION_CHANNEL, str(region_id)))
+
+    def start_listener(self, connect):
+        """
+        Start a daemon thread that LISTENs on REGION_CHANNEL with its own connection
+        (from the connect() factory) and invalidates the catalog on every notification.
+        Safe to call more than once; only one listener runs per process.
+        """
+        with self._lock:
+            if self._listener is not None and self._listener.is_alive():
+                return
+            self._listener = threading.Thread(target=self._listen, args=(connect,), daemon=True)
+            self._listener.start()
+
+    def _listen(self, connect):
+        while True:
+            conn = None
+            try:
+                conn = connect()
+                conn.autocommit = True
+                with conn.cursor() as cur:
+                    cur.execute(f"LISTEN {REGION_CHANNEL}")
+                # Anything may have changed while we were not listening
+                self.invalidate()
+
+                while True:
+                    if select.select([conn], [], [], LISTEN_POLL_TIMEOUT) == ([], [], []):
+                        continue
+                    conn.poll()
+                    while conn.notifies:
+                        note = conn.notifies.pop(0)
+                        self.invalidate()
+                        try:
+                            analytics_cache.invalidate_region(int(note.payload))
+                        except ValueError:
+                            analytics_cache.clear()
+            except Exception as e:
+                print(f"Region catalog listener error, retrying: {e}")
+                time.sleep(LISTEN_POLL_TIMEOUT)
+            finally:
+                if conn is not None:
+                    try:
+                        conn.close()
+                    except Exception:
+                        pass
+
+
+# Shared by every DataBaseOrm instance in this process
+region_catalog = RegionCatalog()
@@ -0,0 +1,171 @@
+import json
+import numpy as np
+
+DEFAULT_CELL_SIZE = 64  # pixels
+
+
+def region_polygon(region):
+    """
+    Return the region's polygon as an (V, 2) float array, or None for a plain rectangle.
+    The polygon column is optional; it may arrive as a JSON string or an already decoded list.
+    """
+    polygon = region.get('polygon') if isinstance(region, dict) else None
+    if not polygon:
+        return None
+    if isinstance(polygon, str):
+        polygon = json.loads(polygon)
+    points = np.asarray(polygon, dtype=np.float64).reshape(-1, 2)
+    return points if len(points) >= 3 else None
+
+
+class RegionIndex:
+    """
+    Uniform grid over a camera's regions (rectangles and polygons).
+
+    Each grid cell stores the regions whose bounding box overlaps it, in CSR form
+    (cell_start / cell_regions), so a point only ever tests the handful of regions
+    around it instead of every region of the camera. Polygons are tested with an
+    even-odd ray cast after their bounding box matches; rectangle bounds are
+    inclusive, like the BETWEEN filters of the analytics queries.
+    """
+
+    def __init__(self, regions, cell_size=DEFAULT_CELL_SIZE):
+        self.regions = list(regions)
+        self.cell_size = float(cell_size)
+        num_regions = len(self.regions)
+
+        self.bounds = np.zeros((num_regions, 4), dtype=np.float64)  # x1, x2, y1, y2
+        self.polygon_slot = np.full(num_regions, -1, dtype=np.intp)
+        polygons = []
+        for i, region in enumerate(self.regions):
+            polygon = region_polygon(region)
+            if polygon is None:
+                self.bounds[i] = (region['x1'], region['x2'], region['y1'], region['y2'])
+            else:
+                self.bounds[i] = (polygon[:, 0].min(), polygon[:, 0].max(), polygon[:, 1].min(), polygon[:, 1].max())
+                self.polygon_slot[i] = len(polygons)
+                polygons.append(polygon)
+
+        # Pad polygons to a common vertex count by repeating their last vertex;
+        # the padding only adds zero-length edges, which never cross a ray
+        max_vertices = max((len(p) for p in polygons), default=0)
+        self.polygon_vertices = np.zeros((len(polygons), max_vertices, 2), dtype=np.float64)
+        for slot, polygon in enumerate(polygons):
+            self.polygon_vertices[slot, :len(polygon)] = polygon
+            self.polygon_vertices[slot, len(polygon):] = polygon[-1]
+
+        self._build_grid()
+
+    def _build_grid(self):
+        if not self.regions:
+            self.origin = (0.0, 0.0)
+            self.cols = self.rows = 0
+            self.cell_start = np.zeros(1, dtype=np.intp)
+            self.cell_regions = np.zeros(0, dtype=np.intp)
+            return
+
+        cs = self.cell_size
+        ox = self.bounds[:, 0].min()
+        oy = self.bounds[:, 2].min()
+        self.origin = (ox, oy)
+        self.cols = int((self.bounds[:, 1].max() - ox) // cs) + 1
+        self.rows = int((self.bounds[:, 3].max() - oy) // cs) + 1
+
+        cells = [[] for _ in range(self.cols * self.rows)]
+        for i, (x1, x2, y1, y2) in enumerate(self.bounds):
+            gx1, gx2 = int((x1 - ox) // cs), int((x2 - ox) // cs)
+            gy1, gy2 = int((y1 - oy) // cs), int((y2 - oy) // cs)
+            for gy in range(gy1, gy2 + 1):
+                row = gy * self.cols
+                for gx in range(gx1, gx2 + 1):
+                    cells[row + gx].append(i)
+
+        counts = np.array([len(c) for c in cells], dtype=np.intp)
+        self.cell_start = np.zeros(len(cells) + 1, dtype=np.intp)
+        np.cumsum(counts, out=self.cell_start[1:])
+        self.cell_regions = np.fromiter((i for c in cells for i in c), dtype=np.intp, count=int(counts.sum()))
+
+    def _cells_of(self, xs, ys):
+        ox, oy = self.origin
+        gx = np.floor((xs - ox) / self.cell_size).astype(np.intp)
+        gy = np.floor((ys - oy) / self.cell_size).astype(np.intp)
+        valid = (gx >= 0) & (gx < self.cols) & (gy >= 0) & (gy < self.rows)
+        return gy * self.cols + gx, valid
+
+    def _in_polygons(self, px, py, slots):
+        verts = self.polygon_vertices[slots]  # (M, V, 2)
+        xi, yi = verts[..., 0], verts[..., 1]
+        xj, yj = np.roll(xi, 1, axis=1), np.roll(yi, 1, axis=1)
+        px, py = px[:, None], py[:, None]
+        straddles = (yi > py) != (yj > py)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            x_cross = (xj - xi) * (py - yi) / (yj - yi) + xi
+        crossings = straddles & (px < x_cross)
+        return (crossings.sum(axis=1) % 2) == 1
+
+    def contains(self, points):
+        """
+        Membership matrix for many points at once.
+        points: (N, 2) array-like of x, y. Returns an (N, R) bool array in region order.
+        """
+        points = np.asarray(points, dtype=np.float64).reshape(-1, 2)
+        result = np.zeros((len(points), len(self.regions)), dtype=bool)
+        if len(points) == 0 or not self.regions:
+            return result
+
+        xs, ys = points[:, 0], points[:, 1]
+        cells, valid = self._cells_of(xs, ys)
+        point_idx = np.nonzero(valid)[0]
+        cells = cells[point_idx]
+        starts = self.cell_start[cells]
+        counts = self.cell_start[cells + 1] - starts
+        total = int(counts.sum())
+        if total == 0:
+            return result
+
+        # Expand every point into (point, candidate region) pairs
+        pair_point = np.repeat(point_idx, counts)
+        offsets = np.arange(total) - np.repeat(np.cumsum(counts) - counts, counts) + np.repeat(starts, counts)
+        pair_region = self.cell_regions[offsets]
+
+        px, py = xs[pair_point], ys[pair_point]
+        b = self.bounds[pair_region]
+        hit = (b[:, 0] <= px) & (px <= b[:, 1]) & (b[:, 2] <= py) & (py <= b[:, 3])
+
+        slots = self.polygon_slot[pair_region]
+        check = hit & (slots >= 0)
+        if check.any():
+            hit[check] = self._in_polygons(px[check], py[check], slots[check])
+
+        result[pair_point[hit], pair_region[hit]] = True
+        return result
+
+    def regions_at(self, x, y):
+        """Regions (dicts, in region order) that contain a single point."""
+        if not self.regions:
+            return []
+        ox, oy = self.origin
+        gx = int((x - ox) // self.cell_size)
+        gy = int((y - oy) // self.cell_size)
+        if not (0 <= gx < self.cols and 0 <= gy < self.rows):
+            return []
+        cell = gy * self.cols + gx
+        found = []
+        for i in self.cell_regions[self.cell_start[cell]:self.cell_start[cell + 1]]:
+            x1, x2, y1, y2 = self.bounds[i]
+            if not (x1 <= x <= x2 and y1 <= y <= y2):
+                continue
+            slot = self.polygon_slot[i]
+            if slot >= 0 and not self._in_polygons(np.array([x], dtype=np.float64), np.array([y], dtype=np.float64), np.array([slot]))[0]:
+                continue
+            found.append(self.regions[i])
+        return found
+
+    def assign_boxes(self, boxes):
+        """
+        Region membership of bounding-box centers.
+        boxes: (N, 4) array-like of x1, y1, x2, y2. Returns an (N, R) bool array.
+        """
+        boxes = np.asarray(boxes, dtype=np.float64).reshape(-1, 4)
+        centers = np.column_stack(((boxes[:, 0] + boxes[:, 2]) / 2, (boxes[:, 1] + boxes[:, 3]) / 2))
+        return self.contains(centers)
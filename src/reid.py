@@ -0,0 +1,358 @@
+import queue
+import threading
+from datetime import datetime
+import cv2
+import numpy as np
+
+REID_ENABLED = True  # False: no appearance crops are embedded and no tracks are merged
+REID_HSV_BINS = (8, 4, 4)  # hue x saturation joint bins and value bins, per body half
+REID_EMBEDDING_DIM = 2 * (REID_HSV_BINS[0] * REID_HSV_BINS[1] + REID_HSV_BINS[2])
+REID_MIN_SAMPLES = 2  # crops averaged into a track's embedding before it is matched
+REID_MATCH_THRESHOLD = 0.92  # cosine similarity of two tracks' embeddings to merge them
+REID_WINDOW_SECONDS = 1800  # tracks are matched against people seen in the last 30 minutes
+REID_QUEUE_SIZE = 256  # crop batches waiting for the encoder thread; more are dropped
+REID_BATCH_SIZE = 64  # crops embedded per encoder pass
+REID_CANDIDATES = 5  # most similar tracks above the threshold considered per new track
+
+
+def appearance_embeddings(crops):
+    """
+    (N, H, W, 3) uint8 BGR crops -> (N, REID_EMBEDDING_DIM) float32 unit vectors:
+    HSV colour histograms of the upper and lower half of the person (clothing),
+    over the middle two thirds of the crop width to leave out most background.
+    All crops are converted and binned in one pass.
+    """
+    n, h, w, _ = crops.shape
+    if not n:
+        return np.zeros((0, REID_EMBEDDING_DIM), dtype=np.float32)
+    crops = np.ascontiguousarray(crops[:, :, w // 6:w - w // 6])
+    w = crops.shape[2]
+    hsv = cv2.cvtColor(crops.reshape(n * h, w, 3), cv2.COLOR_BGR2HSV).reshape(n, h, w, 3).astype(np.int32)
+
+    hue_bins, sat_bins, val_bins = REID_HSV_BINS
+    colour_bins = hue_bins * sat_bins
+    per_half = colour_bins + val_bins
+    colour = (hsv[..., 0] * hue_bins // 180) * sat_bins + hsv[..., 1] * sat_bins // 256
+    value = colour_bins + hsv[..., 2] * val_bins // 256
+    # Offset of each pixel's histogram: crop, then upper or lower half
+    base = (np.arange(n)[:, None, None] * REID_EMBEDDING_DIM
+            + (np.arange(h) >= h // 2)[None, :, None] * per_half)
+    counts = np.bincount(np.concatenate([(base + colour).ravel(), (base + value).ravel()]),
+                         minlength=n * REID_EMBEDDING_DIM)
+    # Square root (Hellinger) so one dominant colour does not decide the match
+    embeddings = np.sqrt(counts.reshape(n, REID_EMBEDDING_DIM).astype(np.float32))
+    embeddings /= np.linalg.norm(embeddings, axis=1, keepdims=True)
+    return embeddings
+
+
+class AppearanceEncoder:
+    """
+    Appearance embeddings of the tracks of one pipeline, computed off the frame
+    loop: submit() only enqueues the crops sampled for a frame, and a
+    background thread embeds them in batches of REID_BATCH_SIZE and keeps a
+    running sum per track. If the queue is full the crops are dropped and
+    counted rather than blocking the caller.
+    """
+
+    def __init__(self, queue_size=REID_QUEUE_SIZE, batch_size=REID_BATCH_SIZE, min_samples=REID_MIN_SAMPLES):
+        self.batch_size = batch_size
+        self.min_samples = min_samples
+        self._queue = queue.Queue(maxsize=queue_size)
+        self._sums = {}  # yolo_id -> [embedding sum, samples]
+        self._lock = threading.Lock()
+        self._thread = None
+        self.dropped = 0
+
+    def submit(self, yolo_ids, crops):
+        """crops: (len(yolo_ids), H, W, 3) uint8 BGR, owned by the encoder from now on."""
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, daemon=True)
+            self._thread.start()
+        try:
+            self._queue.put_nowait((list(yolo_ids), crops))
+        except queue.Full:
+            self.dropped += len(yolo_ids)
+
+    def queue_depth(self):
+        return self._queue.qsize()
+
+    def _run(self):
+        while True:
+            item = self._queue.get()
+            if item is None:
+                return
+            items = [item]
+            size = len(item[0])
+            while size < self.batch_size:
+                try:
+                    item = self._queue.get_nowait()
+                except queue.Empty:
+                    break
+                if item is None:
+                    self._queue.put(None)  # stop after this batch
+                    break
+                items.append(item)
+                size += len(item[0])
+            try:
+                embeddings = appearance_embeddings(np.concatenate([crops for _, crops in items]))
+            except Exception as e:
+                print(f"Re-ID embedding error: {e}")
+                continue
+            yolo_ids = [yolo_id for ids, _ in items for yolo_id in ids]
+            with self._lock:
+                for yolo_id, embedding in zip(yolo_ids, embeddings):
+                    entry = self._sums.get(yolo_id)
+                    if entry is None:
+                        self._sums[yolo_id] = [embedding.copy(), 1]
+                    else:
+                        entry[0] += embedding
+                        entry[1] += 1
+
+    def embedding(self, yolo_id):
+        """Mean embedding of a track as a list of floats, or None before min_samples crops."""
+        with self._lock:
+            entry = self._sums.get(yolo_id)
+            if entry is None or entry[1] < self.min_samples:
+                return None
+            mean = entry[0] / np.linalg.norm(entry[0])
+        return [round(float(v), 5) for v in mean]
+
+    def forget(self, yolo_ids):
+        with self._lock:
+            for yolo_id in yolo_ids:
+                self._sums.pop(yolo_id, None)
+
+    def close(self):
+        if self._thread is not None:
+            self._queue.put(None)
+            self._thread.join(timeout=5)
+            self._thread = None
+
+
+class EmbeddingIndex:
+    """
+    Embeddings of recently seen tracks with their camera and time span,
+    searched by brute-force cosine similarity (one matrix-vector product over
+    the window, which holds a few thousand tracks at most).
+    """
+
+    def __init__(self, dim=REID_EMBEDDING_DIM, capacity=1024):
+        self.dim = dim
+        self._ids = []
+        self._rows = {}  # tracking_id -> row
+        self._allocate(capacity)
+
+    def _allocate(self, capacity):
+        count = len(self._ids)
+        vectors, cams, first, last = (np.empty((capacity, self.dim), dtype=np.float32), np.empty(capacity, dtype=np.int64),
+                                      np.empty(capacity), np.empty(capacity))
+        if count:
+            vectors[:count], cams[:count] = self._vectors[:count], self._cams[:count]
+            first[:count], last[:count] = self._first[:count], self._last[:count]
+        self._vectors, self._cams, self._first, self._last = vectors, cams, first, last
+
+    def __len__(self):
+        return len(self._ids)
+
+    def __contains__(self, tracking_id):
+        return tracking_id in self._rows
+
+    def camera(self, tracking_id):
+        return int(self._cams[self._rows[tracking_id]])
+
+    def span(self, tracking_id):
+        """(cam_id, first_seen, last_seen) of an indexed track."""
+        row = self._rows[tracking_id]
+        return int(self._cams[row]), float(self._first[row]), float(self._last[row])
+
+    def upsert(self, tracking_id, cam_id, vector, first_seen, last_seen):
+        """Add a track, or replace its embedding and widen its time span (epoch seconds)."""
+        row = self._rows.get(tracking_id)
+        if row is None:
+            row = len(self._ids)
+            if row == len(self._vectors):
+                self._allocate(row * 2)
+            self._ids.append(tracking_id)
+            self._rows[tracking_id] = row
+            self._cams[row] = cam_id
+            self._first[row] = first_seen
+            self._last[row] = last_seen
+        else:
+            self._first[row] = min(self._first[row], first_seen)
+            self._last[row] = max(self._last[row], last_seen)
+        self._vectors[row] = vector
+
+    def search(self, vector, cam_id, first_seen, threshold, limit=REID_CANDIDATES):
+        """
+        (tracking_id, similarity) of up to limit tracks at or above threshold, most
+        similar first, that can be the same person as a track on cam_id starting at
+        first_seen: any track on another camera, or one on the same camera that had
+        ended by then.
+        """
+        count = len(self._ids)
+        if not count:
+            return []
+        similarity = self._vectors[:count] @ np.asarray(vector, dtype=np.float32)
+        possible = (self._cams[:count] != cam_id) | (self._last[:count] <= first_seen)
+        rows = np.flatnonzero(possible & (similarity >= threshold))
+        rows = rows[np.argsort(-similarity[rows], kind="stable")[:limit]]
+        return [(self._ids[row], float(similarity[row])) for row in rows]
+
+    def evict(self, before):
+        """Drop tracks last seen before the given epoch seconds. Returns their IDs."""
+        count = len(self._ids)
+        keep = self._last[:count] >= before
+        if keep.all():
+            return []
+        evicted = [tracking_id for tracking_id, k in zip(self._ids, keep) if not k]
+        kept = np.flatnonzero(keep)
+        kept_count = len(kept)
+        self._vectors[:kept_count] = self._vectors[kept]
+        self._cams[:kept_count] = self._cams[kept]
+        self._first[:kept_count] = self._first[kept]
+        self._last[:kept_count] = self._last[kept]
+        self._ids = [self._ids[i] for i in kept]
+        self._rows = {tracking_id: row for row, tracking_id in enumerate(self._ids)}
+        return evicted
+
+
+class ReidService:
+    """
+    Store-wide re-identification at shard ingest. Tracks that arrive with an
+    appearance embedding (process_video_shards adds one per track) are matched
+    against the tracks seen on any camera within REID_WINDOW_SECONDS; a match
+    above REID_MATCH_THRESHOLD makes the new tracking_id an alias of the
+    matched person's canonical ID. The window is kept in memory and reloaded
+    from track_appearance after a restart.
+
+    Matching is one-to-one: a person (canonical ID) is never matched by a new
+    track that overlaps in time one of the person's tracks on the same camera,
+    and within a shard each person takes at most one new track, assigned in
+    order of similarity. Off when enabled is False (REID_ENABLED).
+    """
+
+    def __init__(self, threshold=REID_MATCH_THRESHOLD, window=REID_WINDOW_SECONDS, enabled=REID_ENABLED):
+        self.threshold = threshold
+        self.window = window
+        self.enabled = enabled
+        self.index = EmbeddingIndex()
+        self._canonical = {}  # tracking_id in the index -> canonical tracking_id
+        self._members = {}  # canonical tracking_id -> its tracking_ids in the index
+        self._newest = None  # epoch seconds of the latest sighting ingested
+        self._lock = threading.Lock()
+        self._warmed = False
+        self.observed = 0
+        self.matched = 0
+
+    def warm(self, orm):
+        """Load the current window from the database once per process."""
+        with self._lock:
+            if self._warmed:
+                return
+            self._warmed = True
+            for row in orm.get_recent_track_appearances(self.window):
+                vector = np.frombuffer(bytes(row["embedding"]), dtype=np.float16).astype(np.float32)
+                self.index.upsert(str(row["tracking_id"]), row["cam_id"], vector,
+                                  row["first_seen"].timestamp(), row["last_seen"].timestamp())
+                self._assign(str(row["tracking_id"]), str(row["canonical_id"] or row["tracking_id"]))
+                self._newest = max(self._newest or 0, row["last_seen"].timestamp())
+            print(f"Re-ID index warmed with {len(self.index)} tracks")
+
+    def observe(self, tracking_data):
+        """
+        Match and index the shard's tracks that carry an 'appearance'. Returns
+        (aliases, appearances): aliases are (tracking_id, canonical_id, similarity,
+        cam_id of the match) for new merges; appearances are track_appearance rows.
+        """
+        entries = []
+        for t in tracking_data:
+            if t.get("appearance"):
+                first = datetime.fromisoformat(t["time"])
+                entries.append((t, first.timestamp(), first.timestamp() + t["confusion_time"]))
+        aliases = []
+        with self._lock:
+            # Slide the window to this shard before matching, so nobody older than it can match
+            if entries:
+                self._newest = max([self._newest or 0] + [last for _, _, last in entries])
+                for tracking_id in self.index.evict(self._newest - self.window):
+                    self._unassign(tracking_id)
+
+            # Known tracks first, so a track's own continuation never looks like a new person
+            new = []
+            for t, first, last in entries:
+                if t["tracking_id"] in self.index:
+                    self.index.upsert(t["tracking_id"], t["cam_id"], np.asarray(t["appearance"], dtype=np.float32),
+                                      first, last)
+                else:
+                    new.append((t, first, last))
+
+            # Candidate (similarity, new track, canonical) pairs, then one-to-one in similarity order
+            pairs = []
+            for k, (t, first, last) in enumerate(new):
+                vector = np.asarray(t["appearance"], dtype=np.float32)
+                for match, similarity in self.index.search(vector, t["cam_id"], first, self.threshold):
+                    canonical = self._canonical.get(match, match)
+                    if not self._overlaps(canonical, t["cam_id"], first, last):
+                        pairs.append((similarity, k, canonical, match))
+            pairs.sort(key=lambda p: -p[0])
+            matched, taken = {}, set()
+            for similarity, k, canonical, match in pairs:
+                if k in matched or canonical in taken:
+                    continue
+                matched[k] = (canonical, similarity, match)
+                taken.add(canonical)
+
+            for k, (t, first, last) in enumerate(new):
+                tracking_id = t["tracking_id"]
+                self.observed += 1
+                canonical = tracking_id
+                if k in matched:
+                    canonical, similarity, match = matched[k]
+                    aliases.append((tracking_id, canonical, round(similarity, 4), self.index.camera(match)))
+                    self.matched += 1
+                self.index.upsert(tracking_id, t["cam_id"], np.asarray(t["appearance"], dtype=np.float32), first, last)
+                self._assign(tracking_id, canonical)
+
+        appearances = [(
+            t["tracking_id"], t["cam_id"], datetime.fromtimestamp(first), datetime.fromtimestamp(last),
+            np.asarray(t["appearance"], dtype=np.float16).tobytes()
+        ) for t, first, last in entries]
+        return aliases, appearances
+
+    def _assign(self, tracking_id, canonical):
+        self._canonical[tracking_id] = canonical
+        self._members.setdefault(canonical, set()).add(tracking_id)
+
+    def _unassign(self, tracking_id):
+        canonical = self._canonical.pop(tracking_id, None)
+        members = self._members.get(canonical)
+        if members is not None:
+            members.discard(tracking_id)
+            if not members:
+                del self._members[canonical]
+
+    def _overlaps(self, canonical, cam_id, first, last):
+        """Whether the person already has a track on cam_id during [first, last] (two people at once)."""
+        for member in self._members.get(canonical, ()):
+            member_cam, member_first, member_last = self.index.span(member)
+            if member_cam == cam_id and member_first < last and first < member_last:
+                return True
+        return False
+
+    def clear(self):
+        with self._lock:
+            self.index = EmbeddingIndex()
+            self._canonical.clear()
+            self._members.clear()
+            self._newest = None
+
+    def stats(self):
+        return {
+            "indexed_tracks": len(self.index),
+            "observed_tracks": self.observed,
+            "merged_tracks": self.matched,
+        }
+
+
+# Single instance shared by every ingest path of this process
+reid_service = ReidService()
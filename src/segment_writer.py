@@ -0,0 +1,288 @@
+import json
+import os
+import queue
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+import cv2
+from shard_media import shard_packager
+
+# Tried in order of browser compatibility; the first one that opens is used for the whole stream
+CODECS_TO_TRY = [
+    ('avc1', '.mp4'),   # H.264 - best browser compatibility
+    ('H264', '.mp4'),   # Alternative H.264 fourcc
+    ('mp4v', '.mp4'),   # MPEG-4 Part 2 - fallback
+    ('XVID', '.avi'),   # XVID - last resort
+]
+SEGMENT_QUEUE_SIZE = 64  # frames buffered between the frame loop and the encoder thread
+SHARD_INDEX_FILE = "shard_index.jsonl"
+SEGMENT_MAX_PAD_SECONDS = 2.0  # longest gap (e.g. a reconnect) filled with repeated frames
+
+_index_lock = threading.Lock()
+
+
+def negotiate_codec(output_dir, fps, size):
+    """Find the first codec this OpenCV build can write, using a throwaway probe file."""
+    for codec, ext in CODECS_TO_TRY:
+        probe_path = os.path.join(output_dir, f".codec_probe{ext}")
+        out = cv2.VideoWriter(probe_path, cv2.VideoWriter_fourcc(*codec), fps, size)
+        opened = out.isOpened()
+        out.release()
+        if os.path.exists(probe_path):
+            os.remove(probe_path)
+        if opened:
+            print(f"Using codec: {codec}")
+            return codec, ext
+    return None
+
+
+def append_shard_index(output_dir, record):
+    with _index_lock:
+        with open(os.path.join(output_dir, SHARD_INDEX_FILE), "a") as f:
+            f.write(json.dumps(record) + "\n")
+
+
+class _ShardIndexCache:
+    """
+    In-memory copy of one directory's shard index. Each lookup reads only what
+    was appended since the last one (segments may be closed by other processes,
+    e.g. batch chunks), and reloads when the file was replaced or truncated.
+    Only complete lines are consumed, so a record being appended is picked up
+    on the next lookup; no lock shared with append_shard_index is taken.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.records = {}
+        self._inode = None
+        self._offset = 0
+        self.lock = threading.Lock()  # held around refresh() and the lookup
+
+    def refresh(self):
+        try:
+            stat = os.stat(self.path)
+        except FileNotFoundError:
+            self.records, self._inode, self._offset = {}, None, 0
+            return
+        if stat.st_ino != self._inode or stat.st_size < self._offset:
+            self.records, self._inode, self._offset = {}, stat.st_ino, 0
+        if stat.st_size == self._offset:
+            return
+        with open(self.path, "rb") as f:
+            f.seek(self._offset)
+            data = f.read(stat.st_size - self._offset)
+        complete = data.rfind(b"\n") + 1
+        self._offset += complete
+        for line in data[:complete].splitlines():
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                record = json.loads(line)
+            except ValueError:
+                continue  # partially written line left by a crash
+            self.records[record["shard_id"]] = record
+
+
+_index_caches = {}  # index file path -> _ShardIndexCache
+_index_caches_lock = threading.Lock()
+
+
+def _shard_index_cache(output_dir):
+    path = os.path.abspath(os.path.join(output_dir, SHARD_INDEX_FILE))
+    with _index_caches_lock:
+        cache = _index_caches.get(path)
+        if cache is None:
+            cache = _index_caches[path] = _ShardIndexCache(path)
+    return cache
+
+
+def get_shard_record(shard_id, output_dir="shards"):
+    """Index record of one closed segment, or None."""
+    cache = _shard_index_cache(output_dir)
+    with cache.lock:
+        cache.refresh()
+        record = cache.records.get(shard_id)
+        return dict(record) if record else None
+
+
+def read_shard_index(output_dir="shards"):
+    """shard_id -> index record, for every segment closed so far."""
+    cache = _shard_index_cache(output_dir)
+    with cache.lock:
+        cache.refresh()
+        return {shard_id: dict(record) for shard_id, record in cache.records.items()}
+
+
+class _Segment:
+    def __init__(self, shard_id, path, writer, start_frame):
+        self.shard_id = shard_id
+        self.path = path
+        self.writer = writer
+        self.start_frame = start_frame
+        self.frames = 0
+        self.start_time = None  # capture time (datetime) of the first and last frame
+        self.end_time = None
+        self.start_media_time = None  # seconds into the source
+        self.end_media_time = None
+        self.padded = 0  # repeated frames written over gaps
+        self.last_frame = None
+
+
+class SegmentWriter:
+    """
+    Continuous recorder that cuts one stream into shard files.
+
+    The codec is negotiated once per stream. Frames are handed to an encoder
+    thread through a bounded queue, and the shard switch travels through the
+    same queue, so every frame lands in exactly one shard, in order. Each
+    shard starts a fresh encoder and therefore on a keyframe. Closing the finished file
+    (the blocking release()), repackaging it for streaming and recording it in
+    the shard index happen on a separate closer thread, off the frame loop and
+    off the encoder thread. An encoding error is recorded in error and costs
+    only that frame (or that shard, if its file can't be opened); the encoder
+    thread keeps draining the queue, so the frame loop never blocks on it.
+
+    With pad_gaps (live sources, which skip frames to stay current), the
+    previous frame is repeated over the frames skipped upstream, up to
+    SEGMENT_MAX_PAD_SECONDS, so a shard plays back in real time.
+    """
+
+    def __init__(self, output_dir, fps, size, cam_id=None, output_mode=None, metrics=None, pad_gaps=False):
+        self.output_dir = output_dir
+        self.fps = fps
+        self.size = size
+        self.cam_id = cam_id
+        self.output_mode = output_mode
+        self.metrics = metrics  # CameraMetrics receiving the "encode" stage timings
+        self.pad_gaps = pad_gaps
+        self.codec = None
+        self.ext = None
+        self.frames_written = 0
+        self.segments_closed = 0
+        self.error = None
+        self._queue = queue.Queue(maxsize=SEGMENT_QUEUE_SIZE)
+        self._closer = ThreadPoolExecutor(max_workers=1, thread_name_prefix="segment-closer")
+        self._thread = None
+
+    def open(self):
+        """Negotiate the codec and start the encoder thread. Returns False if no codec works."""
+        negotiated = negotiate_codec(self.output_dir, self.fps, self.size)
+        if negotiated is None:
+            return False
+        self.codec, self.ext = negotiated
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+        return True
+
+    def path_for(self, shard_id):
+        return os.path.join(self.output_dir, f"{shard_id}{self.ext}")
+
+    def start_segment(self, shard_id, start_frame):
+        """Frames written after this call go to shard_id; start_frame is the number of the first one."""
+        self._queue.put(("segment", shard_id, start_frame))
+
+    def write(self, frame, captured_at=None, media_time=None):
+        """
+        Queue a frame for the current segment. The frame must not be modified afterwards.
+        captured_at (datetime) and media_time (seconds into the source) are the frame's
+        own times, as returned by the reader, and become the shard's indexed time span;
+        without captured_at the time the frame is handed over is used.
+        """
+        if captured_at is None:
+            captured_at = datetime.now()
+        self._queue.put(("frame", frame, captured_at, media_time))
+
+    def queue_depth(self):
+        return self._queue.qsize()
+
+    def close(self):
+        """Finish the current segment and wait until every segment is closed and indexed."""
+        if self._thread is None:
+            return
+        self._queue.put(("close",))
+        self._thread.join()
+        self._thread = None
+        self._closer.shutdown(wait=True)
+
+    def _run(self):
+        segment = None
+        while True:
+            item = self._queue.get()
+            kind = item[0]
+            if kind == "close":
+                if segment is not None:
+                    self._closer.submit(self._finish, segment)
+                return
+            # A failure costs the item, never the thread: write() and close() rely on it draining the queue
+            try:
+                if kind == "frame":
+                    if segment is not None:
+                        self._encode(segment, *item[1:])
+                else:
+                    _, shard_id, start_frame = item
+                    if segment is not None:
+                        self._closer.submit(self._finish, segment)
+                    # Until the new writer is open, frames have no segment and are dropped
+                    segment = None
+                    path = self.path_for(shard_id)
+                    writer = cv2.VideoWriter(path, cv2.VideoWriter_fourcc(*self.codec), self.fps, self.size)
+                    if not writer.isOpened():
+                        self.error = f"Could not open VideoWriter for shard {shard_id}"
+                        print(f"ERROR: {self.error}")
+                    segment = _Segment(shard_id, path, writer, start_frame)
+            except Exception as e:
+                self.error = f"Encoder failed on a {kind}: {e}"
+                print(f"ERROR: {self.error}")
+
+    def _encode(self, segment, frame, captured_at, media_time):
+        if self.metrics is not None:
+            with self.metrics.stage("encode"):
+                self._write(segment, frame, media_time)
+        else:
+            self._write(segment, frame, media_time)
+        if segment.start_time is None:
+            segment.start_time = captured_at
+            segment.start_media_time = media_time
+        segment.end_time = captured_at
+        segment.end_media_time = media_time
+        segment.frames += 1
+        self.frames_written += 1
+
+    def _write(self, segment, frame, media_time):
+        if self.pad_gaps and media_time is not None and segment.end_media_time is not None:
+            missing = int(round((media_time - segment.end_media_time) * self.fps)) - 1
+            for _ in range(min(missing, int(SEGMENT_MAX_PAD_SECONDS * self.fps))):
+                segment.writer.write(segment.last_frame)
+                segment.padded += 1
+        segment.writer.write(frame)
+        if self.pad_gaps:
+            segment.last_frame = frame
+
+    def _finish(self, segment):
+        try:
+            segment.writer.release()
+            if segment.frames == 0:
+                if os.path.exists(segment.path):
+                    os.remove(segment.path)
+                return
+            if shard_packager.can_package(segment.path):
+                shard_packager.package(segment.path, self.output_mode or shard_packager.mode)
+            append_shard_index(self.output_dir, {
+                "shard_id": segment.shard_id,
+                "cam_id": self.cam_id,
+                "file": os.path.basename(segment.path),
+                "codec": self.codec,
+                "start_frame": segment.start_frame,
+                "end_frame": segment.start_frame + segment.frames - 1,
+                "frames": segment.frames,
+                "padded_frames": segment.padded,
+                "start_time": segment.start_time.isoformat(),
+                "end_time": segment.end_time.isoformat(),
+                "start_media_time": segment.start_media_time,
+                "end_media_time": segment.end_media_time,
+                "bytes": os.path.getsize(segment.path),
+            })
+            self.segments_closed += 1
+        except Exception as e:
+            print(f"Error closing shard {segment.shard_id}: {e}")
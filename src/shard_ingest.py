@@ -0,0 +1,122 @@
+import time
+from analytics_cache import analytics_cache
+from heatmap_tiles import shard_tiles
+from pipeline_metrics import pipeline_metrics
+from reid import reid_service
+
+
+def ingest_shard(orm, shard_id, data, tracking_data, cam_id=None):
+    """
+    Persist one shard as yielded by process_video_shards through the ORM bulk
+    inserts: tracking rows, bounding boxes, the boxes' region assignments and
+    heatmap tiles, and the re-identified tracks.
+    """
+    if cam_id is None and tracking_data:
+        cam_id = tracking_data[0]["cam_id"]
+    metrics = pipeline_metrics.camera(cam_id)
+    with metrics.stage("persist"):
+        _insert_shard_data(orm, shard_id, data, tracking_data, cam_id, metrics)
+        merged_cams = resolve_identities(orm, tracking_data)
+
+    # New shard data changes analytics for every region of this camera,
+    # and a re-identified person also changes the counts of the camera they were first seen on
+    for cam in {cam_id, *merged_cams} - {None}:
+        analytics_cache.invalidate_camera(cam)
+
+
+def resolve_identities(orm, tracking_data):
+    """
+    Match the shard's tracks against people seen shortly before on any camera
+    (reid.reid_service) and store the merges as track aliases. Returns the
+    cameras of the matched people; nothing when re-ID is disabled.
+    """
+    if not reid_service.enabled or not any(t.get("appearance") for t in tracking_data):
+        return set()
+    reid_service.warm(orm)
+    aliases, appearances = reid_service.observe(tracking_data)
+    if appearances:
+        orm.upsert_track_appearances(appearances)
+    if aliases:
+        orm.batch_insert_track_aliases([(tracking_id, canonical_id, similarity)
+                                        for tracking_id, canonical_id, similarity, _ in aliases])
+    return {cam for _, _, _, cam in aliases}
+
+
+def _insert_shard_data(orm, shard_id, data, tracking_data, cam_id, metrics):
+    # Insert Tracking
+    tracking_tuples = []
+    for t in tracking_data:
+        tracking_tuples.append((
+            t["tracking_id"],
+            t["confusion_time"],
+            t["tracker_group"],
+            t["cam_id"],
+            t["time"],
+            t["video_shard"],
+            t.get("gender", "Unknown"),
+            t.get("gender_confidence", 0.0),
+            t.get("gender_samples", 0)
+        ))
+    if tracking_tuples:
+        started = time.perf_counter()
+        orm.batch_insert_tracking(tracking_tuples)
+        metrics.db_insert("tracking", len(tracking_tuples), time.perf_counter() - started)
+
+    # Gender votes improve as tracks are sampled again; earlier shards of a track take the latest vote
+    track_genders = [(t[6], t[7], t[8], t[0]) for t in tracking_tuples if t[8]]
+    if track_genders:
+        orm.update_track_genders(track_genders)
+
+    # Insert Bounding Boxes
+    bbox_tuples = []
+    for d in data:
+        bbox = d["bbox"]
+        bbox_tuples.append((
+            int(bbox[0]), int(bbox[2]), int(bbox[1]), int(bbox[3]),
+            d["timestamp"],
+            d["track_id"],
+            d["Video_shard"],
+            d["Frame_number"]
+        ))
+    if bbox_tuples:
+        started = time.perf_counter()
+        orm.batch_insert_bounding_boxes(bbox_tuples)
+        metrics.db_insert("bounding_box", len(bbox_tuples), time.perf_counter() - started)
+
+    # Assign boxes to the camera's regions (rectangles and polygons) at ingest time
+    if cam_id is not None and data:
+        presence_tuples = assign_shard_regions(data, orm.get_region_index(cam_id))
+        if presence_tuples:
+            started = time.perf_counter()
+            orm.batch_insert_region_presence(presence_tuples)
+            metrics.db_insert("region_presence", len(presence_tuples), time.perf_counter() - started)
+
+        # Heatmap tiles of the shard, added to the camera's daily rollups
+        started = time.perf_counter()
+        shard_tile, day_tiles = shard_tiles(data)
+        orm.save_heatmap_tiles(cam_id, shard_id, shard_tile, day_tiles)
+        metrics.db_insert("heatmap", len(shard_tile), time.perf_counter() - started)
+
+
+def assign_shard_regions(data, index):
+    """
+    Resolve every box of a shard against the camera's region index and aggregate
+    per (region, track, shard) into region_presence tuples.
+    """
+    if not index.regions:
+        return []
+    membership = index.assign_boxes([d["bbox"] for d in data])
+
+    presence = {}
+    for box_idx, region_idx in zip(*membership.nonzero()):
+        d = data[box_idx]
+        key = (index.regions[region_idx]['region_id'], d["track_id"], d["Video_shard"])
+        entry = presence.get(key)
+        if entry is None:
+            presence[key] = [d["timestamp"], d["timestamp"], 1]
+        else:
+            # ISO timestamps compare correctly as strings
+            entry[0] = min(entry[0], d["timestamp"])
+            entry[1] = max(entry[1], d["timestamp"])
+            entry[2] += 1
+    return [key + tuple(entry) for key, entry in presence.items()]
@@ -0,0 +1,214 @@
+import os
+import re
+import shutil
+import subprocess
+from concurrent.futures import ThreadPoolExecutor
+from email.utils import formatdate, parsedate_to_datetime
+
+# How finished shards are packaged for playback
+SHARD_MODE_MP4 = "mp4"  # single MP4 with the index (moov) moved to the front: instant start, seek by Range
+SHARD_MODE_FMP4 = "fmp4"  # fragmented MP4, playable while it is still being downloaded
+SHARD_MODE_HLS = "hls"  # fMP4 HLS playlist + 2 s segments next to the MP4
+SHARD_OUTPUT_MODE = SHARD_MODE_MP4
+HLS_SEGMENT_SECONDS = 2
+
+STREAM_CHUNK_SIZE = 256 * 1024  # bytes per read when streaming a file or range
+SHARD_EXTENSIONS = ('.mp4', '.avi')
+MEDIA_TYPES = {
+    '.mp4': "video/mp4",
+    '.avi': "video/x-msvideo",
+    '.m4s': "video/iso.segment",
+    '.m3u8': "application/vnd.apple.mpegurl",
+}
+# Cache, but revalidate: a shard is repackaged in place shortly after it is written,
+# and a revalidation that matches the ETag costs a bodiless 304
+SHARD_CACHE_CONTROL = "public, no-cache"
+
+_SHARD_ID = re.compile(r"^[0-9a-fA-F-]{1,64}$")
+_HLS_FILE = re.compile(r"^(index\.m3u8|init\.mp4|seg_\d{1,6}\.m4s)$")
+
+
+class RangeNotSatisfiable(Exception):
+    pass
+
+
+def shard_file(shard_id, output_dir="shards"):
+    """Path of the shard's video file, or None. Only UUID-like ids are accepted."""
+    if not _SHARD_ID.match(shard_id):
+        return None
+    for ext in SHARD_EXTENSIONS:
+        path = os.path.join(output_dir, f"{shard_id}{ext}")
+        if os.path.exists(path):
+            return path
+    return None
+
+
+def hls_dir(shard_id, output_dir="shards"):
+    return os.path.join(output_dir, f"{shard_id}_hls")
+
+
+def hls_file(shard_id, name, output_dir="shards"):
+    """Path of a playlist/segment of the shard's HLS rendition, or None."""
+    if not _SHARD_ID.match(shard_id) or not _HLS_FILE.match(name):
+        return None
+    path = os.path.join(hls_dir(shard_id, output_dir), name)
+    return path if os.path.exists(path) else None
+
+
+def media_type_of(path):
+    return MEDIA_TYPES.get(os.path.splitext(path)[1], "application/octet-stream")
+
+
+def file_etag(stat):
+    return f'"{stat.st_mtime_ns:x}-{stat.st_size:x}"'
+
+
+def parse_range(header, size):
+    """
+    Parse a single "bytes=" range against a file of 'size' bytes.
+    Returns (start, end) inclusive, or None when the header should be ignored
+    (missing, malformed or multi-range: the whole file is sent instead).
+    Raises RangeNotSatisfiable when the range lies outside the file.
+    """
+    if not header or not header.startswith("bytes=") or "," in header:
+        return None
+    first, _, last = header[6:].strip().partition("-")
+    try:
+        if first == "":
+            # Suffix range: the last N bytes
+            length = int(last)
+            if length <= 0:
+                raise RangeNotSatisfiable()
+            return max(0, size - length), size - 1
+        start = int(first)
+        end = int(last) if last else size - 1
+    except ValueError:
+        return None
+    if start >= size or end < start:
+        raise RangeNotSatisfiable()
+    return start, min(end, size - 1)
+
+
+def iter_file(path, start, length, chunk_size=STREAM_CHUNK_SIZE):
+    with open(path, "rb") as f:
+        f.seek(start)
+        remaining = length
+        while remaining > 0:
+            chunk = f.read(min(chunk_size, remaining))
+            if not chunk:
+                break
+            remaining -= len(chunk)
+            yield chunk
+
+
+def _not_modified(headers, etag, mtime):
+    if_none_match = headers.get("if-none-match")
+    if if_none_match is not None:
+        return if_none_match.strip() == "*" or etag in [t.strip() for t in if_none_match.split(",")]
+    if_modified_since = headers.get("if-modified-since")
+    if if_modified_since:
+        try:
+            return int(mtime) <= parsedate_to_datetime(if_modified_since).timestamp()
+        except (TypeError, ValueError):
+            return False
+    return False
+
+
+def plan_file_response(path, headers):
+    """
+    Work out how to answer a GET for a file with conditional and Range request headers
+    (a case-insensitive mapping such as starlette's request.headers).
+    Returns (status, response headers, start, length); length is 0 for 304/416.
+    """
+    stat = os.stat(path)
+    size = stat.st_size
+    etag = file_etag(stat)
+    response_headers = {
+        "Accept-Ranges": "bytes",
+        "ETag": etag,
+        "Last-Modified": formatdate(stat.st_mtime, usegmt=True),
+        "Cache-Control": SHARD_CACHE_CONTROL,
+    }
+
+    if _not_modified(headers, etag, stat.st_mtime):
+        return 304, response_headers, 0, 0
+
+    range_header = headers.get("range")
+    if_range = headers.get("if-range")
+    if if_range and if_range.strip() != etag and if_range.strip() != response_headers["Last-Modified"]:
+        # The client's partial copy is stale: send the whole file
+        range_header = None
+
+    try:
+        byte_range = parse_range(range_header, size)
+    except RangeNotSatisfiable:
+        response_headers["Content-Range"] = f"bytes */{size}"
+        return 416, response_headers, 0, 0
+
+    if byte_range is None:
+        response_headers["Content-Length"] = str(size)
+        return 200, response_headers, 0, size
+
+    start, end = byte_range
+    response_headers["Content-Range"] = f"bytes {start}-{end}/{size}"
+    response_headers["Content-Length"] = str(end - start + 1)
+    return 206, response_headers, start, end - start + 1
+
+
+class ShardPackager:
+    """
+    Repackages finished shards for streaming on a background thread, so the
+    frame loop never waits on it. Uses ffmpeg stream copy (no re-encode); when
+    ffmpeg is not installed shards are left exactly as OpenCV wrote them.
+    Files are replaced atomically, so a viewer never sees a half-written shard.
+    """
+
+    def __init__(self, mode=SHARD_OUTPUT_MODE):
+        self.mode = mode
+        self.ffmpeg = shutil.which("ffmpeg")
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="shard-packager")
+        if self.ffmpeg is None:
+            print("ffmpeg not found; shards will be served as written (no faststart/fMP4/HLS)")
+
+    def can_package(self, path):
+        return self.ffmpeg is not None and path.endswith(".mp4")
+
+    def submit(self, path, mode=None):
+        if not self.can_package(path):
+            return None
+        return self._executor.submit(self.package, path, mode or self.mode)
+
+    def package(self, path, mode):
+        try:
+            movflags = "+frag_keyframe+empty_moov+default_base_moof" if mode == SHARD_MODE_FMP4 else "+faststart"
+            tmp_path = path[:-4] + ".tmp.mp4"
+            self._run(["-i", path, "-c", "copy", "-movflags", movflags, tmp_path])
+            os.replace(tmp_path, path)
+
+            if mode == SHARD_MODE_HLS:
+                shard_id = os.path.basename(path)[:-4]
+                out_dir = hls_dir(shard_id, os.path.dirname(path))
+                tmp_dir = out_dir + ".tmp"
+                shutil.rmtree(tmp_dir, ignore_errors=True)
+                os.makedirs(tmp_dir)
+                self._run([
+                    "-i", path, "-c", "copy", "-f", "hls",
+                    "-hls_time", str(HLS_SEGMENT_SECONDS),
+                    "-hls_playlist_type", "vod",
+                    "-hls_segment_type", "fmp4",
+                    "-hls_fmp4_init_filename", "init.mp4",
+                    "-hls_segment_filename", os.path.join(tmp_dir, "seg_%03d.m4s"),
+                    os.path.join(tmp_dir, "index.m3u8"),
+                ])
+                shutil.rmtree(out_dir, ignore_errors=True)
+                os.replace(tmp_dir, out_dir)
+            return True
+        except Exception as e:
+            print(f"Shard packaging failed for {path}: {e}")
+            return False
+
+    def _run(self, args):
+        subprocess.run([self.ffmpeg, "-y", "-loglevel", "error", *args], check=True, capture_output=True)
+
+
+shard_packager = ShardPackager()
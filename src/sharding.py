@@ -2,11 +2,7 @@ import cv2
 import time
 import uuid
 import os
-import torch
 import numpy as np
-from torch.nn import Module, Conv2d, MaxPool2d, Linear, CrossEntropyLoss
-from ultralytics import YOLO
-from datetime import datetime
 
 try:
     from database import DataBaseOrm
@@ -14,160 +10,183 @@ except ImportError:
     import sys
     sys.path.append(os.path.dirname(os.path.abspath(__file__)))
     from database import DataBaseOrm
+from segment_writer import SegmentWriter
+from live_source import open_frame_source, LIVE_MAX_LATENCY
+from pipeline_metrics import pipeline_metrics
+from crop_preprocessing import CropBatcher
+from track_attributes import TrackAttributeAggregator, GENDER_MIN_SHARPNESS
+from reid import REID_ENABLED, AppearanceEncoder
+from inference_backends import load_detector, load_gender_backend
 
-# --- CNN Model Definition ---
-class CnnBase(Module):
-    def __init__(self):
-        super(CnnBase , self).__init__()
-        self.conv1 = Conv2d(3,16,3,padding=1)
-        self.pool = MaxPool2d(2,2)
-        self.conv2 = Conv2d(16,32,3,padding=1)
-        self.conv3 = Conv2d(32,64,3,padding=1)
-        self.fc1 = Linear(64*8*8 , 512)
-        self.fc2 = Linear(512 , 2)
-        
-    def forward(self,x):
-        x = self.pool(torch.relu(self.conv1(x)))
-        x = self.pool(torch.relu(self.conv2(x)))
-        x = self.pool(torch.relu(self.conv3(x)))
-        x = x.reshape(-1 , 64*8*8)
-        x = torch.relu(self.fc1(x))
-        x = self.fc2(x)
-        return x
-
-def load_gender_classifier(weights_path):
-    if not os.path.exists(weights_path):
-        print(f"Warning: CNN weights not found at {weights_path}")
-        return None
-        
-    model = CnnBase()
-    try:
-        state_dict = torch.load(weights_path, map_location="cpu")
-        model.load_state_dict(state_dict)
-        model.eval()
-        print(f"Loaded Gender CNN from {weights_path}")
-        return model
-    except Exception as e:
-        print(f"Error loading CNN weights: {e}")
-        return None
+def draw_track(image, bbox, yolo_id, gender):
+    """Draw one track's box and 'ID:<yolo id> <gender>' label onto image in place."""
+    x1, y1, x2, y2 = map(int, bbox)
+
+    # Color coding: Blue for Male, Pink for Female, White for Unknown
+    color = (255, 0, 0) # Blue (BGR)
+    if gender == "Female":
+        color = (147, 20, 255) # Pinkish
+    elif gender == "Unknown":
+        color = (255, 255, 255)
+
+    cv2.rectangle(image, (x1, y1), (x2, y2), color, 2)
 
-def process_video_shards(source, shard_duration, cam_id=1, output_dir="shards", model_path="yolo12s.pt", cnn_weights_path="../train/cnn_weights.pth", tracker_config="bytetrack.yaml", frame_callback=None, cancel_token=None):
+    label = f"ID:{yolo_id} {gender}"
+    # Draw background for text for better readability
+    (w, h), _ = cv2.getTextSize(label, cv2.FONT_HERSHEY_SIMPLEX, 0.6, 2)
+    cv2.rectangle(image, (x1, y1 - 20), (x1 + w, y1), color, -1)
+    cv2.putText(image, label, (x1, y1 - 5), cv2.FONT_HERSHEY_SIMPLEX, 0.6, (255, 255, 255), 2)
+
+def process_video_shards(source, shard_duration, cam_id=1, output_dir="shards", model_path="yolo12s.pt", cnn_weights_path="../train/cnn_weights.pth", tracker_config="bytetrack.yaml", frame_callback=None, cancel_token=None, output_mode=None, live=None, max_latency=LIVE_MAX_LATENCY, start_frame=0, end_frame=None, warmup_frames=0, time_origin=None, imgsz=None, frame_stride=1, annotate=True, backend=None, precision=None, threads=None):
     """
     Processes a video stream or file, splitting it into shards of a specific duration.
     Saves annotated video for each shard and yields tracking data.
     Uses a 2nd stage CNN for gender classification on 'person' detections.
     cancel_token: threading.Event that when set, signals processing should stop.
+    output_mode: how finished shards are packaged for streaming (see shard_media.SHARD_MODE_*);
+    defaults to SHARD_OUTPUT_MODE.
+    live: True/False forces the live (reconnecting, frame-dropping) or file reader;
+    None decides from the source.
+    max_latency: live sources only; frames older than this many seconds are skipped so
+    inference stays on the newest frame (0 = always the newest, None = every frame).
+    start_frame / end_frame: files only; process frames [start_frame, end_frame) of the file.
+    warmup_frames: the first warmup_frames frames are tracked (and passed to frame_callback)
+    but not recorded, so a chunk starts with a settled tracker (see batch_processing).
+    time_origin: files only; wall-clock time of frame 0, so chunks of one file share a clock.
+    imgsz: YOLO inference size (default: the model's own).
+    frame_stride: track every frame_stride-th frame only; the frames in between are still
+    written and passed to frame_callback, with the last tracked boxes, but add no box data.
+    annotate: False runs headless, without drawing boxes or writing shard videos.
+    backend / precision / threads: inference runtime for both models (see inference_backends);
+    default INFERENCE_BACKEND, INFERENCE_PRECISION and INFERENCE_THREADS.
     """
     
     if not os.path.exists(output_dir):
         os.makedirs(output_dir)
 
-    # Load YOLO model
+    # Load YOLO model (exported to the chosen runtime on first use)
     try:
-        model = YOLO(model_path)
+        model = load_detector(model_path, backend, precision, imgsz, threads)
     except Exception as e:
         print(f"Error loading YOLO model: {e}")
         return
 
     # Load CNN Gender Classifier
-    cnn_model = load_gender_classifier(cnn_weights_path)
-    gender_classes = ['Male', 'Female'] # 0: man, 1: woman (mapped to Male/Female)
+    cnn_model = load_gender_backend(cnn_weights_path, backend, precision, threads)
 
-    # Open video source
-    cap = cv2.VideoCapture(source)
-    if not cap.isOpened():
+    # Open video source (live streams get a reconnecting, newest-frames-first reader)
+    reader = open_frame_source(source, live=live, cancel_token=cancel_token, max_latency=max_latency, cam_id=cam_id,
+                               start_frame=start_frame, end_frame=end_frame, time_origin=time_origin)
+    if reader is None:
         print(f"Error: Could not open video source {source}")
         return
 
     # Get video properties
-    fps = cap.get(cv2.CAP_PROP_FPS)
-    if fps == 0:
-        fps = 30 # Default fallback
-    width = int(cap.get(cv2.CAP_PROP_FRAME_WIDTH))
-    height = int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
+    fps = reader.fps
+    width = reader.width
+    height = reader.height
 
-    # Calculate frames per shard
+    # Calculate frames per shard (files); live shards are cut by capture time instead,
+    # since frames skipped to stay current would otherwise stretch every shard
     frames_per_shard = int(fps * shard_duration)
+    frame_interval = 1.0 / fps if fps else 0.0
     print(f"FPS: {fps}, Frames per shard: {frames_per_shard}")
 
-    frame_number = 0
+    # Frame numbers are positions in the file, also when only a chunk of it is processed
+    frame_number = start_frame if not reader.live else 0
+    first_recorded = frame_number + warmup_frames
     
     # Global map for YOLO ID -> UUID to maintain identity across shards
     global_track_map = {}
     
-    # Cache for gender predictions to avoid re-running CNN on every frame for the same track ID
-    # Format: {yolo_id: "Male"|"Female"}
-    gender_cache = {}
+    # Gender votes per YOLO ID from a few sampled crops (see track_attributes)
+    attributes = TrackAttributeAggregator()
+    # Appearance embeddings of the same sampled crops, for re-identification at ingest (see reid)
+    encoder = AppearanceEncoder()
+    crop_batcher = CropBatcher()  # reused crop buffers for the Gender CNN
+
+    # Per-stage timings, cache hit rates and queue depths (see pipeline_metrics)
+    metrics = pipeline_metrics.camera(cam_id)
+
+    track_options = {"tracker": tracker_config, "persist": True, "verbose": False, "classes": [0]}
+    if imgsz:
+        track_options["imgsz"] = imgsz
+    frame_stride = max(1, int(frame_stride))
+    frames_decoded = 0
+    held_tracks = []  # tracks of the last tracked frame, shown on the frames skipped by frame_stride
+
+    # One writer for the whole stream: the codec is negotiated once and shard
+    # files are switched and closed in the background
+    writer = None
+    if annotate:
+        writer = SegmentWriter(output_dir, fps, (width, height), cam_id=cam_id, output_mode=output_mode, metrics=metrics,
+                               pad_gaps=reader.live)
+        if not writer.open():
+            print("ERROR: Could not create VideoWriter with any codec!")
+            reader.release()
+            return
+        metrics.track_queue("writer", writer.queue_depth)
+    metrics.track_queue("reader", reader.queue_depth)
+    metrics.track_queue("reid", encoder.queue_depth)
 
     try:
         while True:
             # Check for cancellation at start of each shard
             if cancel_token and cancel_token.is_set():
                 print(f"Processing cancelled before starting new shard")
-                cap.release()
+                reader.release()
                 return
                 
-            # Start a new shard
+            # Tracks that were not seen during the last shard have been written out already
+            encoder.forget(attributes.evict(frame_number - frames_per_shard))
+
+            # Start a new shard; the writer switches files between frame_number and frame_number + 1
             shard_id = str(uuid.uuid4())
-            shard_video_path = os.path.join(output_dir, f"{shard_id}.mp4")
             print(f"Starting Shard: {shard_id}")
-            
-            # Initialize VideoWriter
-            # Use H264 codec for browser compatibility
-            # Try different codecs in order of browser compatibility
-            out = None
-            codecs_to_try = [
-                ('avc1', '.mp4'),   # H.264 - best browser compatibility
-                ('H264', '.mp4'),   # Alternative H.264 fourcc
-                ('mp4v', '.mp4'),   # MPEG-4 Part 2 - fallback
-                ('XVID', '.avi'),   # XVID - last resort
-            ]
-            
-            for codec, ext in codecs_to_try:
-                if ext != '.mp4':
-                    shard_video_path = os.path.join(output_dir, f"{shard_id}{ext}")
-                fourcc = cv2.VideoWriter_fourcc(*codec)
-                out = cv2.VideoWriter(shard_video_path, fourcc, fps, (width, height))
-                if out.isOpened():
-                    print(f"Using codec: {codec}")
-                    break
-                out.release()
-            
-            if not out or not out.isOpened():
-                print("ERROR: Could not create VideoWriter with any codec!")
-                cap.release()
-                return
+            if writer is not None:
+                writer.start_segment(shard_id, max(frame_number, first_recorded) + 1)
 
             shard_data = []
             shard_unique_tracks = {} # Map to store unique tracks in this shard
             shard_frame_count = 0
+            shard_started_at = None  # capture time of the shard's first and latest recorded frame
+            last_captured = None
             shard_active = True
             
             while shard_active:
                 # Check for cancellation
                 if cancel_token and cancel_token.is_set():
                     print(f"Processing cancelled during shard {shard_id}")
-                    out.release()
-                    cap.release()
+                    if writer is not None:
+                        writer.close()
+                    reader.release()
                     return
                     
-                # Check duration based on frame count
-                if shard_frame_count >= frames_per_shard:
+                # Check duration: capture time for live sources, frame count for files
+                if reader.live:
+                    shard_done = (shard_started_at is not None and
+                                  (last_captured - shard_started_at).total_seconds() + frame_interval >= shard_duration)
+                else:
+                    shard_done = shard_frame_count >= frames_per_shard
+                if shard_done:
                     print(f"Shard {shard_id} duration completed ({shard_frame_count} frames).")
                     shard_active = False
                     break
 
-                ret, frame = cap.read()
+                with metrics.stage("decode"):
+                    ret, frame, captured_at, media_time = reader.read()
                 if not ret:
                     print("End of video stream or file.")
                     shard_active = False
-                    out.release()
-                    cap.release()
+                    if writer is not None:
+                        writer.close()
+                    reader.release()
                     
                     # Yield final data
                     tracking_data_list = []
                     for t_id, info in shard_unique_tracks.items():
                         duration = (info["last_seen"] - info["first_seen"]).total_seconds()
+                        gender, confidence, samples = attributes.label(info["yolo_id"])
                         tracking_data_list.append({
                             "tracking_id": t_id,
                             "confusion_time": duration,
@@ -175,22 +194,64 @@ def process_video_shards(source, shard_duration, cam_id=1, output_dir="shards",
                             "cam_id": cam_id,
                             "time": info["time"],
                             "video_shard": shard_id,
-                            "gender": info["gender"]
+                            "gender": gender,
+                            "gender_confidence": confidence,
+                            "gender_samples": samples,
+                            "appearance": encoder.embedding(info["yolo_id"])
                         })
                     
                     yield shard_id, shard_data, tracking_data_list
                     return
 
                 frame_number += 1
-                shard_frame_count += 1
+                recording = frame_number > first_recorded
+                if recording:
+                    shard_frame_count += 1
+                    if shard_started_at is None:
+                        shard_started_at = captured_at
+                    last_captured = captured_at
 
                 # Run tracking - Filter for class 0 (person) only
-                results = model.track(frame, tracker=tracker_config, persist=True, verbose=False, classes=[0])
+                on_stride = frames_decoded % frame_stride == 0
+                frames_decoded += 1
+                if on_stride:
+                    with metrics.stage("track"):
+                        results = model.track(frame, **track_options)
+                else:
+                    results = ()
                 
                 # Create a clean copy for annotation
-                annotated_frame = frame.copy()
+                annotated_frame = frame.copy() if annotate else frame
                 current_frame_tracks = []
                 
+                # Samples: a few good crops per track over its life, batched into one CNN call
+                # and handed to the re-ID encoder thread
+                frame_tracks = []  # (yolo_id, bbox)
+                for result in results:
+                    if result.boxes is not None and result.boxes.id is not None:
+                        frame_tracks += zip(result.boxes.id.int().tolist(), result.boxes.xyxy.tolist())
+                sampled = attributes.select(frame_tracks, frame_number, (width, height))
+                if cnn_model is not None:
+                    sampled_ids = {yolo_id for yolo_id, _ in sampled}
+                    for yolo_id, _ in frame_tracks:
+                        metrics.gender_cache(yolo_id not in sampled_ids)
+                if sampled:
+                    try:
+                        with metrics.stage("gender_crop"):
+                            crops, kept = crop_batcher.fill(frame, [bbox for _, bbox in sampled])
+                            sharp = crop_batcher.sharpness() >= GENDER_MIN_SHARPNESS
+                        if sharp.any():
+                            sharp_ids = [sampled[k][0] for k, ok in zip(kept, sharp) if ok]
+                            attributes.taken(sharp_ids)
+                            if REID_ENABLED:
+                                encoder.submit(sharp_ids, crop_batcher.crops()[sharp])
+                            if cnn_model is not None:
+                                with metrics.stage("gender_cnn"):
+                                    logits = cnn_model.predict(crops if sharp.all() else crops[sharp])
+                                attributes.add(sharp_ids, logits)
+                    except Exception as e:
+                        print(f"CNN Inference Error: {e}")
+
                 # Collect data
                 for result in results:
                     if result.boxes is not None:
@@ -212,60 +273,24 @@ def process_video_shards(source, shard_duration, cam_id=1, output_dir="shards",
                             
                             bbox = box.xyxy.tolist()[0]
                             
-                            # --- Gender Classification Logic ---
-                            gender = "Unknown"
-                            
-                            # Check if we already have a gender for this track
-                            if yolo_id in gender_cache:
-                                gender = gender_cache[yolo_id]
-                            else:
-                                # Since we filtered for person, we can just run inference if model exists
-                                if cnn_model is not None:
-                                    x1, y1, x2, y2 = map(int, bbox)
-                                    
-                                    # Clamp coordinates
-                                    x1 = max(0, x1); y1 = max(0, y1)
-                                    x2 = min(width, x2); y2 = min(height, y2)
-                                    
-                                    if x2 > x1 and y2 > y1:
-                                        crop = frame[y1:y2, x1:x2]
-                                        
-                                        # Preprocess for CNN
-                                        try:
-                                            crop_rgb = cv2.cvtColor(crop, cv2.COLOR_BGR2RGB)
-                                            crop_resized = cv2.resize(crop_rgb, (64, 64))
-                                            # Normalize and permute: (H, W, C) -> (C, H, W)
-                                            crop_tensor = torch.tensor(crop_resized, dtype=torch.float32).permute(2, 0, 1) / 255.0
-                                            crop_tensor = crop_tensor.unsqueeze(0) # Add batch dimension
-                                            
-                                            with torch.no_grad():
-                                                outputs = cnn_model(crop_tensor)
-                                                _, preds = torch.max(outputs, 1)
-                                                gender_idx = preds.item()
-                                                # 0 -> man (Male), 1 -> woman (Female)
-                                                gender = gender_classes[gender_idx]
-                                                
-                                            # Cache the result
-                                            gender_cache[yolo_id] = gender
-                                        except Exception as e:
-                                            print(f"CNN Inference Error: {e}")
-
-                            timestamp = datetime.now()
+                            # Current vote of the track's samples (Unknown until one is confident)
+                            gender = attributes.gender(yolo_id)
+
+                            # Capture time of the frame, not the time it was processed
+                            timestamp = captured_at
                             
-                            # Add to shard unique tracks if not present
-                            if db_track_id not in shard_unique_tracks:
-                                shard_unique_tracks[db_track_id] = {
-                                    "tracker_group": class_name,
-                                    "gender": gender,
-                                    "time": timestamp.isoformat(),
-                                    "first_seen": timestamp,
-                                    "last_seen": timestamp
-                                }
-                            else:
-                                shard_unique_tracks[db_track_id]["last_seen"] = timestamp
-                                # Update gender if it was unknown and now we know
-                                if shard_unique_tracks[db_track_id]["gender"] == "Unknown" and gender != "Unknown":
-                                    shard_unique_tracks[db_track_id]["gender"] = gender
+                            if recording:
+                                # Add to shard unique tracks if not present
+                                if db_track_id not in shard_unique_tracks:
+                                    shard_unique_tracks[db_track_id] = {
+                                        "tracker_group": class_name,
+                                        "yolo_id": yolo_id,
+                                        "time": timestamp.isoformat(),
+                                        "first_seen": timestamp,
+                                        "last_seen": timestamp
+                                    }
+                                else:
+                                    shard_unique_tracks[db_track_id]["last_seen"] = timestamp
                             
                             obj_data = {
                                 "track_id": db_track_id,
@@ -275,48 +300,54 @@ def process_video_shards(source, shard_duration, cam_id=1, output_dir="shards",
                                 "Video_shard": shard_id,
                                 "timestamp": timestamp.isoformat()
                             }
-                            shard_data.append(obj_data)
+                            if recording:
+                                shard_data.append(obj_data)
                             
                             current_frame_tracks.append({
                                 "track_id": db_track_id,
+                                "yolo_id": yolo_id,
                                 "bbox": bbox,
                                 "gender": gender,
-                                "frame_timestamp": frame_number / fps  # Video time in seconds
+                                "frame_timestamp": media_time  # Video time in seconds
                             })
 
                             # --- Visualization ---
-                            x1, y1, x2, y2 = map(int, bbox)
-                            
-                            # Color coding: Blue for Male, Pink for Female, White for Unknown
-                            color = (255, 0, 0) # Blue (BGR)
-                            if gender == "Female":
-                                color = (147, 20, 255) # Pinkish
-                            elif gender == "Unknown":
-                                color = (255, 255, 255)
-                                
-                            cv2.rectangle(annotated_frame, (x1, y1), (x2, y2), color, 2)
-                            
-                            label = f"ID:{yolo_id} {gender}"
-                            # Draw background for text for better readability
-                            (w, h), _ = cv2.getTextSize(label, cv2.FONT_HERSHEY_SIMPLEX, 0.6, 2)
-                            cv2.rectangle(annotated_frame, (x1, y1 - 20), (x1 + w, y1), color, -1)
-                            cv2.putText(annotated_frame, label, (x1, y1 - 5), cv2.FONT_HERSHEY_SIMPLEX, 0.6, (255, 255, 255), 2)
+                            if annotate:
+                                with metrics.stage("annotate"):
+                                    draw_track(annotated_frame, bbox, yolo_id, gender)
+
+                if on_stride:
+                    held_tracks = current_frame_tracks
+                else:
+                    # Between strided frames the last tracked boxes are held
+                    current_frame_tracks = [dict(t, frame_timestamp=media_time) for t in held_tracks]
+                    if annotate:
+                        with metrics.stage("annotate"):
+                            for t in current_frame_tracks:
+                                draw_track(annotated_frame, t["bbox"], t["yolo_id"], t["gender"])
 
-                out.write(annotated_frame)
+                if recording and writer is not None:
+                    with metrics.stage("write"):
+                        writer.write(annotated_frame, captured_at, media_time)
+                metrics.frame_done()
 
                 if frame_callback:
                     # frame_callback returns False to signal stop
-                    should_continue = frame_callback(annotated_frame, current_frame_tracks)
+                    # The raw frame lets previews draw their own overlays client-side
+                    with metrics.stage("callback"):
+                        should_continue = frame_callback(annotated_frame, current_frame_tracks, frame)
                     if should_continue is False:
                         print("Processing stopped by callback")
-                        out.release()
-                        cap.release()
+                        if writer is not None:
+                            writer.close()
+                        reader.release()
                         return
             
             # Prepare tracking data list
             tracking_data_list = []
             for t_id, info in shard_unique_tracks.items():
                 duration = (info["last_seen"] - info["first_seen"]).total_seconds()
+                gender, confidence, samples = attributes.label(info["yolo_id"])
                 tracking_data_list.append({
                     "tracking_id": t_id,
                     "confusion_time": duration,
@@ -324,17 +355,24 @@ def process_video_shards(source, shard_duration, cam_id=1, output_dir="shards",
                     "cam_id": cam_id,
                     "time": info["time"],
                     "video_shard": shard_id,
-                    "gender": info["gender"]
+                    "gender": gender,
+                    "gender_confidence": confidence,
+                    "gender_samples": samples,
+                    "appearance": encoder.embedding(info["yolo_id"])
                 })
 
-            out.release()
             yield shard_id, shard_data, tracking_data_list
 
     except KeyboardInterrupt:
         print("Processing stopped by user.")
     finally:
-        if cap.isOpened():
-            cap.release()
+        metrics.untrack_queue("writer")
+        metrics.untrack_queue("reader")
+        metrics.untrack_queue("reid")
+        encoder.close()
+        if writer is not None:
+            writer.close()
+        reader.release()
 
 if __name__ == "__main__":
     # Example usage
@@ -379,7 +417,9 @@ if __name__ == "__main__":
                 t["cam_id"],
                 t["time"],
                 t["video_shard"],
-                t["gender"]
+                t["gender"],
+                t["gender_confidence"],
+                t["gender_samples"]
             ))
         
         if tracking_tuples:
@@ -0,0 +1,264 @@
+import argparse
+import math
+import sys
+import time
+import uuid
+from datetime import date, timedelta
+import numpy as np
+
+SYNTHETIC_FRAME_SIZE = (1280, 720)  # width, height of the simulated cameras
+SYNTHETIC_FPS = 30  # frame numbers are derived from box times at this rate
+STORE_OPEN_HOUR = 9
+STORE_CLOSE_HOUR = 21
+# Relative arrival rate for each opening hour (9:00 .. 20:00): quiet morning, lunch and evening peaks
+HOURLY_PROFILE = (0.4, 0.6, 0.8, 1.3, 1.4, 1.0, 0.8, 0.9, 1.2, 1.5, 1.3, 0.8)
+GENDERS = ("Male", "Female", "Unknown")
+GENDER_WEIGHTS = (0.45, 0.45, 0.10)
+WALK_SPEED_PX = (80.0, 160.0)  # pixels per second, uniform range
+DWELL_MEDIAN_SECONDS = 15.0  # per stop; lognormal
+DWELL_SIGMA = 0.8
+DWELL_MAX_SECONDS = 300.0
+MAX_STOPS = 3  # regions visited per person
+BOX_JITTER_PX = 4.0
+# Synthetic region IDs are SYNTHETIC_REGION_BASE + cam_id * 100 + k, clear of hand-made regions
+SYNTHETIC_REGION_BASE = 900_000
+
+_NAMESPACE = uuid.UUID("5b8e4a2e-0d6f-4c1b-9a57-3f1c2d7e9b40")
+
+
+class SyntheticWorkload:
+    """
+    Plausible store traffic for N cameras over M days, produced shard by shard in
+    the same form as process_video_shards, so it is loaded through the normal
+    ingest path (shard_ingest.ingest_shard).
+
+    Each camera has a grid of rectangular regions. People arrive at a Poisson
+    rate that follows HOURLY_PROFILE, walk in from a frame edge, stop at one to
+    MAX_STOPS regions for a lognormal dwell time, and walk out; every track
+    yields box_rate boxes per second. visitors_per_hour and box_rate set the
+    density. Output is deterministic for a given seed, and each (camera, day)
+    is generated independently, so days can be loaded in any order.
+    """
+
+    def __init__(self, cameras, days, visitors_per_hour=60, box_rate=5, regions_per_camera=4,
+                 shard_duration=30, end_date=None, seed=0):
+        self.cameras = list(range(1, cameras + 1))
+        self.days = days
+        self.visitors_per_hour = visitors_per_hour
+        self.box_rate = box_rate
+        self.regions_per_camera = regions_per_camera
+        self.shard_duration = shard_duration
+        self.end_date = end_date or date.today()
+        self.seed = seed
+
+    def dates(self):
+        """The simulated days, newest first."""
+        return [self.end_date - timedelta(days=offset) for offset in range(self.days)]
+
+    def regions(self, cam_id):
+        """Region rows of a camera: an even grid over the middle of the frame."""
+        width, height = SYNTHETIC_FRAME_SIZE
+        cols = math.ceil(math.sqrt(self.regions_per_camera))
+        rows = math.ceil(self.regions_per_camera / cols)
+        cell_w = width * 0.8 / cols
+        cell_h = height * 0.6 / rows
+        regions = []
+        for k in range(self.regions_per_camera):
+            x1 = int(width * 0.1 + (k % cols) * cell_w + cell_w * 0.1)
+            y1 = int(height * 0.3 + (k // cols) * cell_h + cell_h * 0.1)
+            regions.append({
+                "region_id": SYNTHETIC_REGION_BASE + cam_id * 100 + k + 1,
+                "region_name": f"Cam {cam_id} Aisle {k + 1}",
+                "x1": x1, "x2": int(x1 + cell_w * 0.8),
+                "y1": y1, "y2": int(y1 + cell_h * 0.8),
+                "cam_id": cam_id,
+            })
+        return regions
+
+    def estimated_boxes_per_day(self):
+        """Expected bounding_box rows per simulated day over all cameras."""
+        mean_dwell = DWELL_MEDIAN_SECONDS * math.exp(DWELL_SIGMA ** 2 / 2)
+        mean_stops = (1 + MAX_STOPS) / 2
+        mean_walk = (mean_stops + 1) * 0.5 * math.hypot(*SYNTHETIC_FRAME_SIZE) / (sum(WALK_SPEED_PX) / 2)
+        visit_seconds = mean_stops * mean_dwell + mean_walk
+        visitors = self.visitors_per_hour * sum(HOURLY_PROFILE)
+        return int(len(self.cameras) * visitors * visit_seconds * self.box_rate)
+
+    def _rng(self, cam_id, day):
+        return np.random.default_rng([self.seed, cam_id, day.toordinal()])
+
+    def _shard_uuid(self, cam_id, day, index):
+        return str(uuid.uuid5(_NAMESPACE, f"{self.seed}/{cam_id}/{day.isoformat()}/{index}"))
+
+    def _edge_point(self, rng):
+        width, height = SYNTHETIC_FRAME_SIZE
+        side = rng.integers(3)  # left, right or bottom edge; nobody walks in through the back wall
+        if side == 0:
+            return 0.0, rng.uniform(height * 0.3, height)
+        if side == 1:
+            return float(width), rng.uniform(height * 0.3, height)
+        return rng.uniform(0, width), float(height)
+
+    def _visitor(self, rng, regions, arrival):
+        """Box centres and times (seconds since midnight) of one person's visit."""
+        speed = rng.uniform(*WALK_SPEED_PX)
+        points = [self._edge_point(rng)]
+        times = [0.0]
+        for region in rng.choice(len(regions), size=rng.integers(1, min(MAX_STOPS, len(regions)) + 1), replace=False):
+            r = regions[region]
+            stop = (rng.uniform(r["x1"], r["x2"]), rng.uniform(r["y1"], r["y2"]))
+            walk = math.dist(points[-1], stop) / speed
+            dwell = min(rng.lognormal(math.log(DWELL_MEDIAN_SECONDS), DWELL_SIGMA), DWELL_MAX_SECONDS)
+            points += [stop, stop]
+            times += [times[-1] + walk, times[-1] + walk + dwell]
+        exit_point = self._edge_point(rng)
+        times.append(times[-1] + math.dist(points[-1], exit_point) / speed)
+        points.append(exit_point)
+
+        points = np.array(points)
+        t = np.arange(0.0, times[-1], 1.0 / self.box_rate)
+        cx = np.interp(t, times, points[:, 0]) + rng.normal(0, BOX_JITTER_PX, len(t))
+        cy = np.interp(t, times, points[:, 1]) + rng.normal(0, BOX_JITTER_PX, len(t))
+        return arrival + t, cx, cy
+
+    def generate_day(self, day):
+        """Yield (cam_id, shard_id, shard_data, tracking_data) for every shard of every camera on day."""
+        width, height = SYNTHETIC_FRAME_SIZE
+        midnight = np.datetime64(day.isoformat(), "us")
+        for cam_id in self.cameras:
+            rng = self._rng(cam_id, day)
+            regions = self.regions(cam_id)
+
+            track_ids, genders = [], []
+            parts = []
+            for hour, weight in zip(range(STORE_OPEN_HOUR, STORE_CLOSE_HOUR), HOURLY_PROFILE):
+                for arrival in np.sort(rng.uniform(hour * 3600, (hour + 1) * 3600, rng.poisson(self.visitors_per_hour * weight))):
+                    seconds, cx, cy = self._visitor(rng, regions, arrival)
+                    track = len(track_ids)
+                    track_ids.append(str(uuid.UUID(bytes=rng.bytes(16), version=4)))
+                    genders.append(GENDERS[rng.choice(len(GENDERS), p=GENDER_WEIGHTS)])
+                    parts.append((np.full(len(seconds), track), seconds, cx, cy))
+            if not parts:
+                continue
+
+            track = np.concatenate([p[0] for p in parts])
+            seconds = np.concatenate([p[1] for p in parts])
+            cx = np.concatenate([p[2] for p in parts])
+            cy = np.concatenate([p[3] for p in parts])
+            # Box size grows towards the bottom of the frame (closer to the camera)
+            box_w = 50 + 60 * np.clip(cy / height, 0, 1)
+            box_h = box_w * 2.4
+            x1 = np.clip(cx - box_w / 2, 0, width - 1)
+            x2 = np.clip(cx + box_w / 2, 0, width - 1)
+            y2 = np.clip(cy + box_h / 2, 0, height - 1)
+            y1 = np.clip(y2 - box_h, 0, height - 1)
+            stamps = np.datetime_as_string(midnight + (seconds * 1e6).astype("timedelta64[us]"), unit="us")
+            frames = (seconds * SYNTHETIC_FPS).astype(np.int64)
+
+            shard_of = (seconds // self.shard_duration).astype(np.int64)
+            order = np.lexsort((seconds, shard_of))
+            boundaries = np.flatnonzero(np.diff(shard_of[order])) + 1
+            for rows in np.split(order, boundaries):
+                index = int(shard_of[rows[0]])
+                shard_id = self._shard_uuid(cam_id, day, index)
+                shard_data = [{
+                    "track_id": track_ids[track[i]],
+                    "class_id": 0,
+                    "bbox": [float(x1[i]), float(y1[i]), float(x2[i]), float(y2[i])],
+                    "Frame_number": int(frames[i]),
+                    "Video_shard": shard_id,
+                    "timestamp": str(stamps[i]),
+                } for i in rows]
+
+                first, last = {}, {}
+                for i in rows:  # rows are in time order
+                    first.setdefault(track[i], i)
+                    last[track[i]] = i
+                tracking_data = [{
+                    "tracking_id": track_ids[t],
+                    "confusion_time": float(seconds[last[t]] - seconds[i]),
+                    "tracker_group": "person",
+                    "cam_id": cam_id,
+                    "time": str(stamps[i]),
+                    "video_shard": shard_id,
+                    "gender": genders[t],
+                } for t, i in first.items()]
+                yield cam_id, shard_id, shard_data, tracking_data
+
+
+def require_scratch_database():
+    """Exit unless SALESLOSS_DB_NAME points at a database other than the app's own."""
+    from database import DB_CONFIG, DEFAULT_DB_NAME
+
+    if DB_CONFIG["dbname"] == DEFAULT_DB_NAME:
+        print(f"Refusing to load synthetic data into '{DEFAULT_DB_NAME}'; set SALESLOSS_DB_NAME to a scratch database")
+        sys.exit(1)
+
+
+def ensure_cameras_and_regions(orm, workload):
+    """
+    Create the workload's cameras and regions that don't exist yet. Raises
+    RuntimeError when a region ID is taken by a region that isn't the
+    workload's own, instead of loading traffic against it.
+    """
+    for cam_id in workload.cameras:
+        if not orm.get_camera(cam_id):
+            orm.add_camera(cam_id, f"Synthetic Camera {cam_id}")
+        for region in workload.regions(cam_id):
+            existing = orm.get_region(region["region_id"])
+            if existing is None:
+                orm.add_region(region["region_id"], region["region_name"], region["x1"], region["x2"],
+                               region["y1"], region["y2"], cam_id)
+            elif existing["cam_id"] != cam_id or existing["region_name"] != region["region_name"]:
+                raise RuntimeError(f"Region {region['region_id']} already exists as '{existing['region_name']}' "
+                                   f"on camera {existing['cam_id']}")
+
+
+def load_day(orm, workload, day):
+    """Ingest one simulated day. Returns (shards, tracking rows, bounding box rows)."""
+    from shard_ingest import ingest_shard
+
+    shards = tracks = boxes = 0
+    for cam_id, shard_id, data, tracking_data in workload.generate_day(day):
+        ingest_shard(orm, shard_id, data, tracking_data, cam_id)
+        shards += 1
+        tracks += len(tracking_data)
+        boxes += len(data)
+    return shards, tracks, boxes
+
+
+def load_workload(orm, workload):
+    """Ingest every day of the workload, newest first. Returns load totals."""
+    ensure_cameras_and_regions(orm, workload)
+    totals = {"shards": 0, "tracking_rows": 0, "bounding_box_rows": 0}
+    started = time.perf_counter()
+    for day in workload.dates():
+        shards, tracks, boxes = load_day(orm, workload, day)
+        totals["shards"] += shards
+        totals["tracking_rows"] += tracks
+        totals["bounding_box_rows"] += boxes
+        print(f"Loaded {day}: {shards} shards, {tracks} tracking rows, {boxes} boxes")
+    totals["seconds"] = round(time.perf_counter() - started, 1)
+    totals["boxes_per_second"] = round(totals["bounding_box_rows"] / totals["seconds"], 1) if totals["seconds"] else None
+    return totals
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Load synthetic store traffic through the ORM bulk inserts "
+                                                 "into a scratch database: set SALESLOSS_DB_NAME.")
+    parser.add_argument("--cameras", type=int, default=4)
+    parser.add_argument("--days", type=int, default=7)
+    parser.add_argument("--visitors-per-hour", type=float, default=60, help="per camera, at an average hour")
+    parser.add_argument("--box-rate", type=float, default=5, help="boxes per second per track")
+    parser.add_argument("--regions", type=int, default=4, help="regions per camera")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    workload = SyntheticWorkload(args.cameras, args.days, args.visitors_per_hour, args.box_rate,
+                                 args.regions, seed=args.seed)
+    print(f"About {workload.estimated_boxes_per_day() * args.days:,} bounding boxes will be loaded")
+
+    require_scratch_database()
+    from database import DataBaseOrm
+    totals = load_workload(DataBaseOrm(), workload)
+    print(f"Done: {totals}")
@@ -0,0 +1,113 @@
+import numpy as np
+from gender_classifier import GENDER_CLASSES
+
+GENDER_SAMPLES_PER_TRACK = 5  # CNN calls per track over its lifetime
+GENDER_SAMPLE_GAP = 15  # frames between two samples of one track, so the samples differ in pose and light
+GENDER_MIN_CROP_HEIGHT = 64  # px; smaller people are too few pixels to classify
+GENDER_EDGE_MARGIN = 4  # px; boxes this close to the frame edge are likely cut off
+GENDER_MIN_SHARPNESS = 15.0  # variance of the Laplacian of the 64x64 grey crop; below is motion blur
+GENDER_MAX_CROPS_PER_FRAME = 8  # cap per frame, so a group walking in together does not stall one frame
+GENDER_MIN_CONFIDENCE = 0.6  # averaged probability needed for a label; below it stays Unknown
+
+
+class _TrackVotes:
+    __slots__ = ("probs", "samples", "crops", "last_attempt", "last_seen")
+
+    def __init__(self):
+        self.probs = np.zeros(len(GENDER_CLASSES), dtype=np.float64)
+        self.samples = 0  # CNN votes
+        self.crops = 0  # good crops taken (also used for re-ID when there is no CNN)
+        self.last_attempt = None
+        self.last_seen = 0
+
+
+class TrackAttributeAggregator:
+    """
+    Gender of each track from up to GENDER_SAMPLES_PER_TRACK good crops taken
+    over the track's lifetime, instead of its first crop only.
+
+    select() picks the tracks of a frame worth a sample: not yet at the sample
+    budget, no sample in the last GENDER_SAMPLE_GAP frames, tall enough and
+    clear of the frame edge. The caller crops those (CropBatcher), drops blurred
+    crops (CropBatcher.sharpness), reports the rest to taken() and passes their
+    CNN logits to add(). The label is the argmax of the averaged softmax, with the average as
+    its confidence. Tracks are keyed by tracker ID, as gender_cache was.
+    """
+
+    def __init__(self, samples_per_track=GENDER_SAMPLES_PER_TRACK, sample_gap=GENDER_SAMPLE_GAP,
+                 max_crops_per_frame=GENDER_MAX_CROPS_PER_FRAME):
+        self.samples_per_track = samples_per_track
+        self.sample_gap = sample_gap
+        self.max_crops_per_frame = max_crops_per_frame
+        self._tracks = {}
+
+    def select(self, tracks, frame_number, frame_size):
+        """
+        tracks: (yolo_id, bbox) of one frame. Returns the (yolo_id, bbox) to sample,
+        tracks with the fewest samples and then the largest boxes first.
+        """
+        width, height = frame_size
+        candidates = []
+        for yolo_id, bbox in tracks:
+            votes = self._tracks.get(yolo_id)
+            if votes is None:
+                votes = self._tracks[yolo_id] = _TrackVotes()
+            votes.last_seen = frame_number
+            if votes.crops >= self.samples_per_track:
+                continue
+            if votes.last_attempt is not None and frame_number - votes.last_attempt < self.sample_gap:
+                continue
+            x1, y1, x2, y2 = bbox
+            if y2 - y1 < GENDER_MIN_CROP_HEIGHT:
+                continue
+            if (x1 < GENDER_EDGE_MARGIN or y1 < GENDER_EDGE_MARGIN
+                    or x2 > width - GENDER_EDGE_MARGIN or y2 > height - GENDER_EDGE_MARGIN):
+                continue
+            candidates.append((votes.crops, -(x2 - x1) * (y2 - y1), yolo_id, bbox))
+
+        candidates.sort(key=lambda c: c[:2])
+        selected = [(yolo_id, bbox) for _, _, yolo_id, bbox in candidates[:self.max_crops_per_frame]]
+        for yolo_id, _ in selected:
+            # Rejected crops (blurred) also wait for the next gap, so they cost nothing per frame
+            self._tracks[yolo_id].last_attempt = frame_number
+        return selected
+
+    def taken(self, yolo_ids):
+        """Count a good crop for each track; a track stops being selected after samples_per_track."""
+        for yolo_id in yolo_ids:
+            self._tracks[yolo_id].crops += 1
+
+    def add(self, yolo_ids, logits):
+        """Record one CNN sample per track: logits is (len(yolo_ids), classes)."""
+        logits = np.asarray(logits, dtype=np.float64)
+        probs = np.exp(logits - logits.max(axis=1, keepdims=True))
+        probs /= probs.sum(axis=1, keepdims=True)
+        for yolo_id, p in zip(yolo_ids, probs):
+            votes = self._tracks[yolo_id]
+            votes.probs += p
+            votes.samples += 1
+
+    def label(self, yolo_id):
+        """(gender, confidence, samples) of a track; Unknown without samples or below GENDER_MIN_CONFIDENCE."""
+        votes = self._tracks.get(yolo_id)
+        if votes is None or not votes.samples:
+            return "Unknown", 0.0, 0
+        mean = votes.probs / votes.samples
+        best = int(mean.argmax())
+        confidence = round(float(mean[best]), 4)
+        if confidence < GENDER_MIN_CONFIDENCE:
+            return "Unknown", confidence, votes.samples
+        return GENDER_CLASSES[best], confidence, votes.samples
+
+    def gender(self, yolo_id):
+        return self.label(yolo_id)[0]
+
+    def evict(self, last_seen_before):
+        """Forget tracks not seen since frame last_seen_before. Returns their IDs."""
+        stale = [yolo_id for yolo_id, votes in self._tracks.items() if votes.last_seen < last_seen_before]
+        for yolo_id in stale:
+            del self._tracks[yolo_id]
+        return stale
+
+    def __len__(self):
+        return len(self._tracks)
@@ -0,0 +1,354 @@
+import errno
+import hashlib
+import json
+import os
+import re
+import threading
+import time
+import uuid
+
+UPLOAD_DIR = "uploads"
+UPLOAD_CHUNK_SIZE = 8 * 1024 * 1024  # bytes; the client may pick another size per upload
+UPLOAD_MAX_SIZE = 64 * 1024 ** 3  # bytes (a full day of recording at a high bitrate)
+UPLOAD_STALL_TIMEOUT = 600  # seconds without new data before a progressive reader gives up
+PROGRESSIVE_POLL_INTERVAL = 1.0  # seconds
+HASH_BLOCK_SIZE = 1024 * 1024
+FIFO_OPEN_TIMEOUT = 60  # seconds the feeder waits for the video reader to open the FIFO
+
+# POSIX-only calls: chunks fall back to seek + write under a lock, and progressive
+# processing (a FIFO the reader follows) is only offered where named pipes exist
+HAS_PWRITE = hasattr(os, "pwrite")
+HAS_FIFO = hasattr(os, "mkfifo")
+_seek_write_lock = threading.Lock()
+
+_SAFE_NAME = re.compile(r"[^A-Za-z0-9._-]+")
+
+
+class UploadError(Exception):
+    pass
+
+
+def safe_filename(filename):
+    name = _SAFE_NAME.sub("_", os.path.basename(filename or "")).strip("._")
+    return name or "upload"
+
+
+def write_block(fd, data, offset, digest=None):
+    """pwrite all of data at offset (pwrite may write less than asked) and feed the checksum."""
+    if digest is not None:
+        digest.update(data)
+    view = memoryview(data)
+    while view:
+        if HAS_PWRITE:
+            written = os.pwrite(fd, view, offset)
+        else:
+            with _seek_write_lock:
+                os.lseek(fd, offset, os.SEEK_SET)
+                written = os.write(fd, view)
+        view = view[written:]
+        offset += written
+    return offset
+
+
+def open_fifo_for_writing(path, timeout=FIFO_OPEN_TIMEOUT):
+    """
+    Open a FIFO for writing once a reader has opened it, or return None after timeout.
+    A plain open() would block forever if the reader never comes (e.g. it failed to start).
+    """
+    deadline = time.monotonic() + timeout
+    while True:
+        try:
+            fd = os.open(path, os.O_WRONLY | os.O_NONBLOCK)
+        except OSError as e:
+            if e.errno != errno.ENXIO:  # ENXIO: no reader yet
+                raise
+            if time.monotonic() > deadline:
+                return None
+            time.sleep(0.1)
+            continue
+        os.set_blocking(fd, True)
+        return os.fdopen(fd, "wb")
+
+
+class UploadSession:
+    """State of one chunked upload, persisted as JSON next to the data so uploads survive restarts."""
+
+    def __init__(self, upload_id, filename, size, chunk_size, sha256=None, received=None, completed=False, created_at=None):
+        self.upload_id = upload_id
+        self.filename = filename
+        self.size = size
+        self.chunk_size = chunk_size
+        self.sha256 = sha256
+        self.received = set(received or [])
+        self.completed = completed
+        self.created_at = created_at or time.time()
+        self.updated_at = time.time()
+        self.lock = threading.Lock()
+        self.changed = threading.Condition(self.lock)
+
+    @property
+    def chunks(self):
+        return max(1, -(-self.size // self.chunk_size))
+
+    def chunk_range(self, index):
+        start = index * self.chunk_size
+        return start, min(start + self.chunk_size, self.size)
+
+    def prefix_bytes(self):
+        """Length of the contiguous received prefix."""
+        index = 0
+        while index in self.received:
+            index += 1
+        return min(index * self.chunk_size, self.size)
+
+    def to_dict(self):
+        return {
+            "upload_id": self.upload_id,
+            "filename": self.filename,
+            "size": self.size,
+            "chunk_size": self.chunk_size,
+            "sha256": self.sha256,
+            "received": sorted(self.received),
+            "completed": self.completed,
+            "created_at": self.created_at,
+        }
+
+    def status(self):
+        missing = [i for i in range(self.chunks) if i not in self.received]
+        return {
+            "upload_id": self.upload_id,
+            "filename": self.filename,
+            "size": self.size,
+            "chunk_size": self.chunk_size,
+            "chunks": self.chunks,
+            "received_chunks": len(self.received),
+            "missing_chunks": missing,
+            "prefix_bytes": self.prefix_bytes(),
+            "completed": self.completed,
+        }
+
+
+class UploadStore:
+    """
+    Chunked, resumable uploads into a preallocated file.
+
+    Each chunk is written at its own offset with pwrite, so chunks can arrive in
+    any order, be retried, or come in parallel. A chunk only counts as received
+    once its SHA-256 (if the client sent one) matches, and complete() can verify
+    the whole file. The session state lives in a JSON file, so a client can ask
+    which chunks are missing and continue after a dropped connection or a
+    server restart. A chunk sent again is un-marked while it is rewritten, so a
+    retry that fails part-way leaves it missing rather than counted.
+
+    pwrite and mkfifo are POSIX-only: elsewhere chunks are written with
+    seek + write under a lock, and uploads can only be processed once complete.
+    """
+
+    def __init__(self, root=UPLOAD_DIR):
+        self.root = root
+        self._sessions = {}
+        self._lock = threading.Lock()
+
+    def _meta_path(self, upload_id):
+        return os.path.join(self.root, ".sessions", f"{upload_id}.json")
+
+    def data_path(self, session):
+        """Where the data is written; the '.part' suffix is dropped when the upload completes."""
+        path = os.path.join(self.root, f"{session.upload_id}_{safe_filename(session.filename)}")
+        return path if session.completed else path + ".part"
+
+    def _save(self, session):
+        meta_path = self._meta_path(session.upload_id)
+        tmp_path = meta_path + ".tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(session.to_dict(), f)
+        os.replace(tmp_path, meta_path)
+
+    def create(self, filename, size, chunk_size=UPLOAD_CHUNK_SIZE, sha256=None):
+        if size <= 0 or size > UPLOAD_MAX_SIZE:
+            raise UploadError(f"Upload size must be between 1 byte and {UPLOAD_MAX_SIZE} bytes")
+        if chunk_size <= 0:
+            raise UploadError("chunk_size must be positive")
+        os.makedirs(os.path.join(self.root, ".sessions"), exist_ok=True)
+        session = UploadSession(str(uuid.uuid4()), filename, size, chunk_size, sha256.lower() if sha256 else None)
+
+        # Reserve the space up front: the upload can't fail half-way for lack of disk,
+        # and the file doesn't fragment as chunks arrive out of order
+        fd = os.open(self.data_path(session), os.O_WRONLY | os.O_CREAT, 0o644)
+        try:
+            try:
+                os.posix_fallocate(fd, 0, size)
+            except (AttributeError, OSError):
+                os.ftruncate(fd, size)
+        finally:
+            os.close(fd)
+
+        self._save(session)
+        with self._lock:
+            self._sessions[session.upload_id] = session
+        return session
+
+    def get(self, upload_id):
+        with self._lock:
+            session = self._sessions.get(upload_id)
+        if session is not None:
+            return session
+        try:
+            with open(self._meta_path(os.path.basename(upload_id))) as f:
+                meta = json.load(f)
+        except (OSError, ValueError):
+            return None
+        session = UploadSession(**meta)
+        with self._lock:
+            return self._sessions.setdefault(upload_id, session)
+
+    def open_chunk(self, session, index):
+        """Validate a chunk index and open the data file for writing it. Returns (fd, start, end)."""
+        if session.completed:
+            raise UploadError("Upload already completed")
+        if not 0 <= index < session.chunks:
+            raise UploadError(f"Chunk index must be between 0 and {session.chunks - 1}")
+        start, end = session.chunk_range(index)
+        fd = os.open(self.data_path(session), os.O_WRONLY)
+        with session.changed:
+            # Rewritten in place: not received again until finish_chunk() succeeds
+            if index in session.received:
+                session.received.discard(index)
+                session.updated_at = time.time()
+                self._save(session)
+        return fd, start, end
+
+    def finish_chunk(self, session, index, digest, expected_sha256=None):
+        """Mark a written chunk as received, unless its checksum doesn't match."""
+        if expected_sha256 and digest != expected_sha256.lower():
+            raise UploadError(f"Checksum mismatch for chunk {index}")
+        with session.changed:
+            session.received.add(index)
+            session.updated_at = time.time()
+            self._save(session)
+            session.changed.notify_all()
+        return session.status()
+
+    def complete(self, session):
+        """Check that every chunk arrived (and the whole-file checksum, if given), then publish the file."""
+        with session.lock:
+            if session.completed:
+                return self.data_path(session)
+            if len(session.received) < session.chunks:
+                raise UploadError(f"{session.chunks - len(session.received)} chunk(s) still missing")
+            part_path = self.data_path(session)
+
+        if session.sha256:
+            digest = hashlib.sha256()
+            with open(part_path, "rb") as f:
+                for block in iter(lambda: f.read(HASH_BLOCK_SIZE), b""):
+                    digest.update(block)
+            if digest.hexdigest() != session.sha256:
+                raise UploadError("File checksum mismatch")
+
+        with session.changed:
+            session.completed = True
+            final_path = self.data_path(session)
+            os.replace(part_path, final_path)
+            self._save(session)
+            session.changed.notify_all()
+        return final_path
+
+    def feed_prefix(self, session, out):
+        """
+        Copy the upload to the binary file object 'out' as its contiguous prefix grows,
+        until the whole file is written or no new data arrived for UPLOAD_STALL_TIMEOUT.
+        """
+        offset = 0
+        last_progress = time.monotonic()
+        with open(self.data_path(session), "rb") as f:  # stays valid across the rename in complete()
+            while offset < session.size:
+                with session.changed:
+                    available = session.prefix_bytes()
+                    if available <= offset:
+                        if time.monotonic() - last_progress > UPLOAD_STALL_TIMEOUT:
+                            print(f"Upload {session.upload_id} stalled; ending progressive read at {offset} bytes")
+                            return offset
+                        session.changed.wait(PROGRESSIVE_POLL_INTERVAL)
+                        continue
+                f.seek(offset)
+                while offset < available:
+                    block = f.read(min(HASH_BLOCK_SIZE, available - offset))
+                    if not block:
+                        break
+                    out.write(block)
+                    offset += len(block)
+                last_progress = time.monotonic()
+        return offset
+
+    def progressive_source(self, session):
+        """
+        A path the video reader can open while the upload is still arriving: a FIFO
+        fed with the received prefix by a background thread. Only containers that
+        can be read front to back work this way (MPEG-TS, MKV, fragmented or faststart
+        MP4); see is_streamable().
+        """
+        fifo_dir = os.path.join(self.root, ".fifo")
+        os.makedirs(fifo_dir, exist_ok=True)
+        fifo_path = os.path.join(fifo_dir, f"{session.upload_id}_{uuid.uuid4().hex[:8]}")
+        if not HAS_FIFO:
+            raise UploadError("Processing an upload before it completes needs POSIX named pipes")
+        os.mkfifo(fifo_path)
+
+        def feed():
+            try:
+                out = open_fifo_for_writing(fifo_path)
+                if out is None:
+                    print(f"Upload {session.upload_id}: the video reader never opened {fifo_path}")
+                    return
+                with out:
+                    self.feed_prefix(session, out)
+            except BrokenPipeError:
+                pass  # reader stopped (job cancelled or finished)
+            except Exception as e:
+                print(f"Progressive upload feed error: {e}")
+            finally:
+                try:
+                    os.remove(fifo_path)
+                except OSError:
+                    pass
+
+        threading.Thread(target=feed, daemon=True).start()
+        return fifo_path
+
+    def is_streamable(self, session):
+        """
+        Whether the received prefix can be decoded before the upload completes.
+        A plain MP4 keeps its index (moov) at the end and isn't, until it has fully arrived.
+        Always False without named pipes (see progressive_source()).
+        """
+        if not HAS_FIFO:
+            return False
+        with session.lock:
+            available = session.prefix_bytes()
+        if available == 0:
+            return False
+        with open(self.data_path(session), "rb") as f:
+            head = f.read(min(available, 64 * 1024))
+        if head[4:8] != b"ftyp":
+            return True  # not MP4/MOV: TS, MKV, AVI... are read front to back
+        # Walk the top-level MP4 boxes: streamable if moov (or a fragment) comes before mdat
+        offset = 0
+        with open(self.data_path(session), "rb") as f:
+            while offset + 8 <= available:
+                f.seek(offset)
+                header = f.read(16)
+                box_size = int.from_bytes(header[:4], "big")
+                box_type = header[4:8]
+                if box_size == 1 and len(header) >= 16:
+                    box_size = int.from_bytes(header[8:16], "big")
+                if box_type in (b"moov", b"moof"):
+                    return True
+                if box_type == b"mdat" or box_size < 8:
+                    return False
+                offset += box_size
+        return False
+
+
+# Shared by the upload endpoints of this process
+upload_store = UploadStore()